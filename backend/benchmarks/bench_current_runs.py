@@ -0,0 +1,172 @@
+"""
+EXPLAIN-based comparison of the legacy ROW_NUMBER() "latest run" queries and
+the document_runs current-version queries.
+
+Usage (from backend/, SUPABASE_* env vars pointing at a scratch database):
+    python -m benchmarks.bench_current_runs [--pages 1000000] [--runs-per-file 3]
+
+Synthetic data is generated server-side with generate_series into a
+throw-away schema (bench_runs), which is dropped afterwards unless --keep.
+"""
+import argparse
+import time
+
+from entity_matcher import get_db_connection
+
+SETUP = """
+DROP SCHEMA IF EXISTS bench_runs CASCADE;
+CREATE SCHEMA bench_runs;
+SET search_path TO bench_runs;
+
+CREATE TABLE document_runs (
+    run_id BIGSERIAL PRIMARY KEY, filename TEXT NOT NULL, status TEXT NOT NULL,
+    is_current BOOLEAN NOT NULL DEFAULT FALSE, page_count INTEGER,
+    created_at TIMESTAMP NOT NULL, completed_at TIMESTAMP
+);
+CREATE TABLE pages (
+    id BIGSERIAL PRIMARY KEY, filename TEXT, preprocessed TEXT, page_number INTEGER,
+    page_label TEXT, page_confidence REAL, clf_type TEXT, run_id BIGINT, created_at TIMESTAMP
+);
+CREATE TABLE extracted2 (
+    filename TEXT, key TEXT, value TEXT, page_label TEXT, page_num INTEGER,
+    run_id BIGINT, created_at TIMESTAMP
+);
+CREATE TABLE call_info (
+    filename TEXT, model_version TEXT, total_token_count INTEGER, run_id BIGINT, created_at TIMESTAMP
+);
+
+-- %(files)s files x %(runs)s runs x %(pages_per_file)s pages
+INSERT INTO document_runs (filename, status, is_current, page_count, created_at, completed_at)
+SELECT 'file_' || f || '.pdf', 'complete', r = %(runs)s, %(pages_per_file)s,
+       timestamp '2024-01-01' + (f * %(runs)s + r) * interval '1 minute',
+       timestamp '2024-01-01' + (f * %(runs)s + r) * interval '1 minute'
+FROM generate_series(1, %(files)s) f, generate_series(1, %(runs)s) r;
+
+INSERT INTO pages (filename, preprocessed, page_number, page_label, page_confidence, clf_type, run_id, created_at)
+SELECT r.filename,
+       'debug_images/' || r.filename || '/page_' || n || '/preprocessed.png',
+       n,
+       (ARRAY['1120S_p1','1065_k1','1040_p1','acord_25','unknown'])[1 + (n %% 5)],
+       random(), 'keyword_matching', r.run_id, r.created_at
+FROM document_runs r, generate_series(1, %(pages_per_file)s) n;
+
+INSERT INTO extracted2 (filename, key, value, page_label, page_num, run_id, created_at)
+SELECT p.preprocessed, 'key_' || k, md5(random()::text), p.page_label, p.page_number, p.run_id, p.created_at
+FROM pages p, generate_series(1, %(keys)s) k;
+
+INSERT INTO call_info (filename, model_version, total_token_count, run_id, created_at)
+SELECT p.preprocessed, 'gemini-2.0-flash', 1500, p.run_id, p.created_at FROM pages p;
+
+CREATE UNIQUE INDEX ON document_runs (filename) WHERE is_current;
+CREATE INDEX ON document_runs (created_at DESC) WHERE is_current;
+CREATE INDEX ON pages (run_id, page_number);
+CREATE INDEX ON pages (filename);
+CREATE INDEX ON pages (preprocessed, created_at);
+CREATE INDEX ON extracted2 (run_id);
+CREATE INDEX ON extracted2 (filename);
+CREATE INDEX ON call_info (run_id);
+CREATE INDEX ON call_info (filename);
+ANALYZE;
+"""
+
+QUERIES = {
+    "get-file pages": (
+        """
+        WITH p1 AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY preprocessed ORDER BY created_at DESC) rn
+            FROM pages WHERE filename = %(filename)s
+        )
+        SELECT * FROM p1 WHERE rn = 1
+        """,
+        """
+        SELECT p.* FROM document_runs r JOIN pages p ON p.run_id = r.run_id
+        WHERE r.filename = %(filename)s AND r.is_current ORDER BY p.page_number
+        """,
+    ),
+    "get-file extracted": (
+        """
+        WITH e3 AS (
+            SELECT p.filename AS base_file, e2.*,
+                   ROW_NUMBER() OVER (PARTITION BY e2.filename, e2.key ORDER BY created_at DESC) rn
+            FROM extracted2 e2
+            JOIN (SELECT filename, preprocessed FROM pages) p ON e2.filename = p.preprocessed
+            WHERE p.filename = %(filename)s
+        )
+        SELECT * FROM e3 WHERE rn = 1
+        """,
+        """
+        SELECT r.filename AS base_file, e.* FROM document_runs r JOIN extracted2 e ON e.run_id = r.run_id
+        WHERE r.filename = %(filename)s AND r.is_current
+        """,
+    ),
+    "get-file info": (
+        """
+        WITH i1 AS (
+            SELECT p.filename AS base_file, i.*,
+                   ROW_NUMBER() OVER (PARTITION BY i.filename ORDER BY created_at DESC) rn
+            FROM call_info i
+            JOIN (SELECT filename, preprocessed FROM pages) p ON i.filename = p.preprocessed
+            WHERE p.filename = %(filename)s
+        )
+        SELECT * FROM i1 WHERE rn = 1
+        """,
+        """
+        SELECT r.filename AS base_file, i.* FROM document_runs r JOIN call_info i ON i.run_id = r.run_id
+        WHERE r.filename = %(filename)s AND r.is_current
+        """,
+    ),
+    "page_performance": (
+        """
+        WITH most_recent_runs AS (
+            SELECT page_label, page_confidence,
+                   ROW_NUMBER() OVER (PARTITION BY preprocessed ORDER BY created_at DESC) AS rn
+            FROM pages
+        )
+        SELECT page_label, COUNT(*), AVG(page_confidence) FROM most_recent_runs WHERE rn = 1 GROUP BY page_label
+        """,
+        """
+        SELECT p.page_label, COUNT(*), AVG(p.page_confidence)
+        FROM document_runs r JOIN pages p ON p.run_id = r.run_id
+        WHERE r.is_current GROUP BY p.page_label
+        """,
+    ),
+}
+
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+    plan = cursor.fetchone()[0][0]
+    return plan["Execution Time"], plan["Plan"]["Node Type"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1_000_000, help="Total page rows across all runs.")
+    parser.add_argument("--pages-per-file", type=int, default=20)
+    parser.add_argument("--runs-per-file", type=int, default=3)
+    parser.add_argument("--keys", type=int, default=5, help="extracted2 rows per page.")
+    parser.add_argument("--keep", action="store_true", help="Keep the bench_runs schema afterwards.")
+    args = parser.parse_args()
+
+    files = max(1, args.pages // (args.pages_per_file * args.runs_per_file))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    cursor.execute(SETUP, {"files": files, "runs": args.runs_per_file,
+                           "pages_per_file": args.pages_per_file, "keys": args.keys})
+    conn.commit()
+    print(f"Generated {files * args.runs_per_file * args.pages_per_file:,} pages in {time.perf_counter() - start:.1f}s")
+
+    cursor.execute("SET search_path TO bench_runs")
+    params = {"filename": f"file_{files // 2}.pdf"}
+    print(f"{'query':<22}{'legacy ms':>12}{'current ms':>12}{'speedup':>10}   plan root (legacy -> current)")
+    for name, (legacy, current) in QUERIES.items():
+        legacy_ms, legacy_node = explain(cursor, legacy, params)
+        current_ms, current_node = explain(cursor, current, params)
+        print(f"{name:<22}{legacy_ms:>12.2f}{current_ms:>12.2f}{legacy_ms / max(current_ms, 1e-6):>9.1f}x   {legacy_node} -> {current_node}")
+
+    if not args.keep:
+        cursor.execute("DROP SCHEMA bench_runs CASCADE")
+        conn.commit()
+    cursor.close()
+    conn.close()
@@ -0,0 +1,122 @@
+"""
+Compare JSON text vs packed binary storage for page OCR geometry.
+
+Usage (from backend/):
+    python -m benchmarks.bench_geometry_storage [--boxes 1500] [--pages 200] [--db]
+
+Without --db only the encode/decode cost and payload size are measured.
+With --db (SUPABASE_* env vars set) both layouts are written to temp tables and
+on-disk row size (pg_column_size) and read latency are reported.
+"""
+import argparse
+import json
+import random
+import time
+import numpy as np
+
+from geometry_codec import (
+    pack_strings, unpack_strings, pack_bboxes, unpack_bboxes,
+    pack_normalized_bboxes, unpack_normalized_bboxes,
+)
+
+
+def synthetic_page(n_boxes, width=2550, height=3300, seed=0):
+    """Build a page with Cloud Vision-like words and boxes."""
+    rng = random.Random(seed)
+    with open("ocr_results/cloud_vision_results.txt", encoding="utf-8") as f:
+        vocab = f.read().split() or ["word"]
+    words = [rng.choice(vocab) for _ in range(n_boxes)]
+    bboxes = []
+    for _ in range(n_boxes):
+        x1, y1 = rng.randint(0, width - 200), rng.randint(0, height - 40)
+        bboxes.append([x1, y1, x1 + rng.randint(20, 200), y1 + rng.randint(15, 40)])
+    normalized_bboxes = [[b[0] / width, b[1] / height, b[2] / width, b[3] / height] for b in bboxes]
+    return words, bboxes, normalized_bboxes
+
+
+def time_it(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return np.median(samples) * 1000
+
+
+def bench_codec(n_boxes, repeat):
+    words, bboxes, normalized_bboxes = synthetic_page(n_boxes)
+    tokens = [w.lower() for w in words]
+
+    json_cols = [json.dumps(words), json.dumps(bboxes), json.dumps(normalized_bboxes), json.dumps(tokens)]
+    bin_cols = [pack_strings(words), pack_bboxes(bboxes), pack_normalized_bboxes(normalized_bboxes)]
+
+    json_size = sum(len(c.encode("utf-8")) for c in json_cols)
+    bin_size = sum(len(c) for c in bin_cols)
+
+    json_decode = time_it(lambda: [json.loads(c) for c in json_cols], repeat)
+    bin_decode = time_it(lambda: (unpack_strings(bin_cols[0]), unpack_bboxes(bin_cols[1]),
+                                  unpack_normalized_bboxes(bin_cols[2])), repeat)
+    boxes_only = time_it(lambda: (unpack_bboxes(bin_cols[1]), unpack_normalized_bboxes(bin_cols[2])), repeat)
+
+    print(f"boxes per page:          {n_boxes}")
+    print(f"JSON payload:            {json_size / 1024:.1f} KiB")
+    print(f"binary payload:          {bin_size / 1024:.1f} KiB ({bin_size / json_size:.1%} of JSON)")
+    print(f"JSON decode:             {json_decode:.3f} ms")
+    print(f"binary decode (all):     {bin_decode:.3f} ms")
+    print(f"binary decode (boxes):   {boxes_only:.4f} ms (zero-copy views)")
+    return words, bboxes, normalized_bboxes
+
+
+def bench_db(words, bboxes, normalized_bboxes, n_pages, repeat):
+    from entity_matcher import get_db_connection
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    tokens = [w.lower() for w in words]
+    cursor.execute("""
+        CREATE TEMP TABLE bench_json (id SERIAL, words TEXT, bboxes TEXT, normalized_bboxes TEXT, tokens TEXT);
+        CREATE TEMP TABLE bench_bin (id SERIAL, words_bin BYTEA, bboxes_bin BYTEA, normalized_bboxes_bin BYTEA);
+    """)
+    json_row = (json.dumps(words), json.dumps(bboxes), json.dumps(normalized_bboxes), json.dumps(tokens))
+    bin_row = (pack_strings(words), pack_bboxes(bboxes), pack_normalized_bboxes(normalized_bboxes))
+    cursor.executemany("INSERT INTO bench_json (words, bboxes, normalized_bboxes, tokens) VALUES (%s, %s, %s, %s)",
+                       [json_row] * n_pages)
+    cursor.executemany("INSERT INTO bench_bin (words_bin, bboxes_bin, normalized_bboxes_bin) VALUES (%s, %s, %s)",
+                       [bin_row] * n_pages)
+    conn.commit()
+
+    cursor.execute("SELECT AVG(pg_column_size(t.*)) FROM bench_json t")
+    json_row_size = cursor.fetchone()[0]
+    cursor.execute("SELECT AVG(pg_column_size(t.*)) FROM bench_bin t")
+    bin_row_size = cursor.fetchone()[0]
+
+    def read_json():
+        cursor.execute("SELECT words, bboxes, normalized_bboxes, tokens FROM bench_json")
+        for row in cursor.fetchall():
+            [json.loads(c) for c in row]
+
+    def read_bin():
+        cursor.execute("SELECT words_bin, bboxes_bin, normalized_bboxes_bin FROM bench_bin")
+        for w, b, nb in cursor.fetchall():
+            unpack_strings(w), unpack_bboxes(b), unpack_normalized_bboxes(nb)
+
+    print(f"\n{n_pages} pages in Postgres")
+    print(f"JSON row size (on disk): {json_row_size / 1024:.1f} KiB")
+    print(f"binary row size:         {bin_row_size / 1024:.1f} KiB")
+    print(f"JSON read + decode:      {time_it(read_json, repeat):.1f} ms")
+    print(f"binary read + decode:    {time_it(read_bin, repeat):.1f} ms")
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", type=int, default=1500)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", action="store_true", help="Also measure row size and read latency in Postgres.")
+    args = parser.parse_args()
+
+    page = bench_codec(args.boxes, args.repeat)
+    if args.db:
+        bench_db(*page, n_pages=args.pages, repeat=max(3, args.repeat // 4))
@@ -0,0 +1,158 @@
+"""
+Response size and latency of /get-file for a 200-page document.
+
+Offline mode (default) builds a synthetic 200-page payload shaped like the
+endpoint's output (OCR geometry from the captured ocr_results/ text) and
+compares serializing:
+    legacy     every column of every page, stdlib json (what FastAPI did)
+    orjson     every column of every page, orjson
+    viewer     fields=page_number,page_label,page_confidence, 20 pages, orjson
+
+Live mode (--url http://localhost:8000 --filename X.pdf) times real requests
+against a running API, including an If-None-Match revalidation.
+
+Usage (from backend/):
+    python -m benchmarks.bench_get_file
+    python -m benchmarks.bench_get_file --url http://localhost:8000 --filename packet.pdf
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.fakes import load_canned_texts
+
+VIEWER_FIELDS = ["page_number", "page_label", "page_confidence"]
+
+
+def synthetic_pages(n_pages=200, seed=0):
+    rng = random.Random(seed)
+    texts = load_canned_texts()
+    pages = []
+    for i in range(1, n_pages + 1):
+        lines = texts[i % len(texts)].splitlines()
+        words = [w for line in lines for w in line.split()]
+        bboxes, y = [], 150
+        for line in lines:
+            x = 120
+            for w in line.split():
+                width = 20 * len(w)
+                bboxes.append([x, y, x + width, y + 40])
+                x += width + 15
+            y += 45
+        pages.append({
+            "filename": "packet.pdf",
+            "preprocessed": f"debug_images/packet/page_{i}/preprocessed.png",
+            "image_levels": "thumb,preview,full",
+            "page_number": i,
+            "image_width": 2550.0,
+            "image_height": 3300.0,
+            "lines": lines,
+            "words": words,
+            "bboxes": bboxes,
+            "normalized_bboxes": [[b[0] / 2550, b[1] / 3300, b[2] / 2550, b[3] / 3300] for b in bboxes],
+            "tokens": [w.lower() for w in words],
+            "words_for_clf": str(set(w.lower() for w in words[:200])),
+            "processing_time": rng.uniform(1, 3),
+            "clf_type": "keyword",
+            "page_label": "1120_page1",
+            "page_confidence": rng.uniform(0.6, 1.0),
+            "run_id": 1,
+            "created_at": "2025-01-01 00:00:00",
+            "s3_url": f"https://form-sage-storage.s3.amazonaws.com/debug_images/packet/page_{i}/preview.webp?X-Amz-Signature=" + "0" * 64,
+            "thumb_url": f"https://form-sage-storage.s3.amazonaws.com/debug_images/packet/page_{i}/thumb.webp?X-Amz-Signature=" + "0" * 64,
+        })
+    return pages
+
+
+def synthetic_extracted(pages, keys_per_page=25):
+    return [
+        {"base_file": "packet.pdf", "filename": p["preprocessed"], "key": f"field_{k}", "value": "1,000",
+         "page_label": p["page_label"], "page_confidence": p["page_confidence"], "page_num": p["page_number"], "run_id": 1}
+        for p in pages for k in range(keys_per_page)
+    ]
+
+
+def timed(fn, repeat):
+    samples, out = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return out, statistics.median(samples)
+
+
+def run_offline(n_pages, repeat):
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+        print("orjson not installed; the orjson rows fall back to stdlib json.")
+
+    def dumps_orjson(obj):
+        if orjson is None:
+            return json.dumps(obj).encode("utf-8")
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    pages = synthetic_pages(n_pages)
+    extracted = synthetic_extracted(pages)
+    keep = set(VIEWER_FIELDS) | {"s3_url", "thumb_url"}
+    viewer_pages = [{k: v for k, v in p.items() if k in keep} for p in pages[:20]]
+    viewer_extracted = [e for e in extracted if e["page_num"] <= 20]
+
+    cases = {
+        "legacy (all, json)": lambda: json.dumps({"pages": pages, "extracted": extracted}).encode("utf-8"),
+        "all fields, orjson": lambda: dumps_orjson({"pages": pages, "extracted": extracted}),
+        "viewer page (20 pages, 3 fields)": lambda: dumps_orjson({"pages": viewer_pages, "extracted": viewer_extracted}),
+    }
+    print(f"{'case':<36}{'bytes':>12}{'serialize ms':>15}")
+    for name, fn in cases.items():
+        body, ms = timed(fn, repeat)
+        print(f"{name:<36}{len(body):>12,}{ms:>15.1f}")
+
+
+def fetch(url, etag=None):
+    request = urllib.request.Request(url, headers={"If-None-Match": etag} if etag else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+            return response.status, len(body), response.headers.get("ETag"), (time.perf_counter() - start) * 1000
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, 0, etag, (time.perf_counter() - start) * 1000
+        raise
+
+
+def run_live(base_url, filename, repeat):
+    base = f"{base_url.rstrip('/')}/get-file?filename={urllib.parse.quote(filename)}"
+    cases = {
+        "all pages, all fields": base,
+        "20 pages, viewer fields": f"{base}&page_start=1&page_count=20&fields={','.join(VIEWER_FIELDS)}&level=preview",
+    }
+    print(f"{'case':<32}{'status':>8}{'bytes':>12}{'p50 ms':>10}")
+    for name, url in cases.items():
+        results = [fetch(url) for _ in range(repeat)]
+        status, size, etag, _ = results[-1]
+        print(f"{name:<32}{status:>8}{size:>12,}{statistics.median(r[3] for r in results):>10.1f}")
+        revalidated = [fetch(url, etag) for _ in range(repeat)]
+        print(f"{'  revalidate (If-None-Match)':<32}{revalidated[-1][0]:>8}{0:>12}{statistics.median(r[3] for r in revalidated):>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--url", help="Base URL of a running API (live mode).")
+    parser.add_argument("--filename", help="Processed file to request in live mode.")
+    args = parser.parse_args()
+    if args.url:
+        if not args.filename:
+            parser.error("--filename is required with --url")
+        run_live(args.url, args.filename, args.repeat)
+    else:
+        run_offline(args.pages, args.repeat)
@@ -0,0 +1,109 @@
+"""
+Near-duplicate lookup latency of phash_index.find_candidates() at millions of
+pages, compared with a sequential scan computing every Hamming distance.
+
+Usage (from backend/, SUPABASE_* env vars pointing at a scratch database):
+    python -m benchmarks.bench_phash [--pages 2000000] [--max-distance 6]
+
+Synthetic hashes are generated server-side into a throw-away schema
+(bench_phash) with the band indexes from migrations/011_page_hashes.sql,
+which is dropped afterwards unless --keep. Queries are near-duplicates of
+stored hashes (a few random bits flipped), plus unseen hashes.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from entity_matcher import get_db_connection
+import phash_index
+
+SETUP = """
+DROP SCHEMA IF EXISTS bench_phash CASCADE;
+CREATE SCHEMA bench_phash;
+SET search_path TO bench_phash;
+
+CREATE TABLE document_runs (run_id BIGINT PRIMARY KEY, filename TEXT NOT NULL, status TEXT NOT NULL);
+CREATE TABLE pages (
+    id BIGSERIAL PRIMARY KEY, run_id BIGINT, preprocessed TEXT, image_width REAL, image_height REAL,
+    phash BIGINT, phash_fine BYTEA
+);
+
+INSERT INTO document_runs SELECT f, 'file_' || f || '.pdf', 'complete' FROM generate_series(1, %(files)s) f;
+INSERT INTO pages (run_id, preprocessed, image_width, image_height, phash, phash_fine)
+SELECT 1 + (i %% %(files)s), 'debug_images/p' || i || '/preprocessed.png', 2550, 3300,
+       ('x' || md5(i::text))::bit(64)::bigint, NULL
+FROM generate_series(1, %(pages)s) i;
+
+CREATE INDEX ON pages (((phash >> 48) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX ON pages (((phash >> 32) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX ON pages (((phash >> 16) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX ON pages (((phash >> 0) & 65535)) WHERE phash IS NOT NULL;
+ANALYZE;
+"""
+
+SCAN_SQL = """
+    SELECT preprocessed FROM pages
+    WHERE length(replace(((phash # %(q)s)::bit(64))::text, '0', '')) <= %(d)s
+"""
+
+
+def flip_bits(value, n, rng):
+    unsigned = value & ((1 << 64) - 1)
+    for bit in rng.sample(range(64), n):
+        unsigned ^= 1 << bit
+    return unsigned - (1 << 64) if unsigned >= 1 << 63 else unsigned
+
+
+def timed(fn, repeat):
+    samples, out = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return out, statistics.median(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2_000_000)
+    parser.add_argument("--pages-per-file", type=int, default=20)
+    parser.add_argument("--max-distance", type=int, default=phash_index.PHASH_MAX_DISTANCE)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Keep the bench_phash schema afterwards.")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    cursor.execute(SETUP, {"pages": args.pages, "files": max(1, args.pages // args.pages_per_file)})
+    conn.commit()
+    print(f"Generated {args.pages:,} page hashes in {time.perf_counter() - start:.1f}s")
+
+    cursor.execute("SET search_path TO bench_phash")
+    rng = random.Random(0)
+    cursor.execute("SELECT phash FROM pages ORDER BY random() LIMIT %s", (args.queries,))
+    stored = [row[0] for row in cursor.fetchall()]
+    queries = [("near-duplicate", flip_bits(h, rng.randint(0, args.max_distance), rng)) for h in stored]
+    queries += [("unseen", rng.getrandbits(64) - (1 << 63)) for _ in range(args.queries)]
+
+    print(f"{'query':<16}{'index p50 ms':>14}{'found':>7}")
+    results = {}
+    for kind, q in queries:
+        found, ms = timed(lambda: phash_index.find_candidates(conn, q, max_distance=args.max_distance), args.repeat)
+        results.setdefault(kind, []).append((ms, len(found)))
+    for kind, rows in results.items():
+        print(f"{kind:<16}{statistics.median(r[0] for r in rows):>14.2f}"
+              f"{sum(1 for r in rows if r[1]) :>4}/{len(rows)}")
+
+    _, scan_ms = timed(lambda: (cursor.execute(SCAN_SQL, {"q": queries[0][1], "d": args.max_distance}),
+                                cursor.fetchall()), 1)
+    print(f"{'sequential scan':<16}{scan_ms:>14.2f}")
+    conn.rollback()
+
+    if not args.keep:
+        cursor.execute("DROP SCHEMA bench_phash CASCADE")
+        conn.commit()
+    cursor.close()
+    conn.close()
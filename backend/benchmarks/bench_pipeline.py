@@ -0,0 +1,258 @@
+"""
+End-to-end throughput benchmark for process_file() with offline fakes.
+
+Cloud Vision, Gemini, S3 and Postgres are replaced by the fakes in
+benchmarks/fakes.py (configurable latency and error rates), synthetic PDFs are
+generated with PyMuPDF, and per-stage timings come from tracing spans.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pipeline --files 3 --pages 10
+    python -m benchmarks.bench_pipeline --vision-ms 0 --gemini-ms 0 --s3-ms 0   # CPU cost only
+    python -m benchmarks.bench_pipeline --json out.json
+    python -m benchmarks.bench_pipeline --baseline out.json --tolerance 0.2      # exit 1 on regression
+    python -m benchmarks.bench_pipeline --scanned-fraction 0.3 --text-layer off  # OCR every page
+    python -m benchmarks.bench_pipeline --scanned-fraction 0.3                   # text-layer fast path
+    python -m benchmarks.bench_pipeline --zonal off                              # Gemini for every field
+    python -m benchmarks.bench_pipeline --roi off                                # send Gemini whole pages
+    python -m benchmarks.bench_pipeline --combined on --scanned-fraction 0.5     # one call for unlabelled pages
+
+--fake-classifiers replaces BART/CLIP with instant fakes so no model weights
+are needed; without it the real local models are loaded on first use.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.fakes import (
+    Latency, FakeVision, FakeGenai, FakeS3, SQLiteStore, FakeZeroShot,
+)
+from benchmarks.synthetic_pdf import make_pdf
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def install_fakes(args):
+    """Patch the pipeline modules to use the offline fakes. Returns the fakes."""
+    os.environ.setdefault("GOOGLE_GENAI_API_KEY", "fake-key")
+
+    import tracing
+    tracing.TRACING_ENABLED = True
+
+    import text_layer
+    text_layer.TEXT_LAYER_MODE = args.text_layer
+
+    import zonal_extractor
+    zonal_extractor.ZONAL_EXTRACTION = args.zonal == "on"
+
+    import roi_crop
+    roi_crop.ROI_CROP = args.roi == "on"
+
+    import combined_classify
+    combined_classify.COMBINED_CLASSIFY = args.combined == "on"
+
+    import extraction_policy
+    extraction_policy.EXTRACTION_TIERS = [m for m in args.tiers.split(",") if m]
+    extraction_policy.tier_stats.clear()
+
+    # Entity prefetch looks entities up in Postgres; there is none here.
+    import entity_matcher
+    entity_matcher.ENTITY_PREFETCH = False
+
+    # Near-duplicate reuse looks pages up in Postgres; there is none here.
+    import phash_index
+    phash_index.PHASH_REUSE = False
+
+    # Page cache in a scratch directory so runs don't warm each other up.
+    os.environ["PAGE_CACHE_DIR"] = tempfile.mkdtemp(prefix="xaio_bench_cache_")
+
+    import s3_utils
+    import storage
+    import upload_queue
+    import fast_processor_gemini as fpg
+    import document_ui
+
+    vision = FakeVision(Latency(args.vision_ms / 1000, args.vision_ms / 4000, args.vision_error_rate, seed=1))
+    genai = FakeGenai(Latency(args.gemini_upload_ms / 1000, args.gemini_upload_ms / 4000, seed=2),
+                      Latency(args.gemini_ms / 1000, args.gemini_ms / 4000, args.gemini_error_rate, seed=3))
+    s3 = FakeS3(Latency(args.s3_ms / 1000, args.s3_ms / 4000, args.s3_error_rate, seed=4))
+    store = SQLiteStore(latency=Latency(args.db_ms / 1000, args.db_ms / 4000, seed=5))
+
+    fpg.vision = vision
+    fpg.genai = genai
+    s3_utils.upload_fileobj_to_s3 = upload_queue.upload_fileobj_to_s3 = s3.upload_fileobj_to_s3
+    s3_utils.download_fileobj_from_s3 = s3.download_fileobj_from_s3
+    storage.download_to_file = s3.download_to_file
+    document_ui.store_results_to_db = store.store_results_to_db
+
+    if args.fake_classifiers:
+        fpg.get_text_classifier = lambda: FakeZeroShot()
+        fpg.ClassifyExtract.classify_using_image = lambda self, image_path, labels, threshold=0.6: None
+
+    return vision, genai, s3, store
+
+
+def run(args):
+    vision, genai, s3, store = install_fakes(args)
+    import tracing
+    import extraction_policy
+    from fast_processor_gemini import process_file
+
+    durations = defaultdict(list)
+    rss_growth = defaultdict(float)
+    last_rss = [peak_rss_mb()]
+
+    def on_span(record):
+        durations[record["stage"]].append(record["duration_ms"])
+        rss = peak_rss_mb()
+        rss_growth[record["stage"]] += max(0.0, rss - last_rss[0])
+        last_rss[0] = rss
+
+    tracing.add_span_listener(on_span)
+    workdir = tempfile.mkdtemp(prefix="xaio_bench_")
+    total_pages, failures, file_times = 0, 0, []
+    ocr_sources = defaultdict(int)
+    triage = defaultdict(int)
+    value_sources = defaultdict(int)
+    classifiers = defaultdict(int)
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    for i in range(args.files):
+        path = os.path.join(workdir, f"bench_{i}.pdf")
+        make_pdf(path, args.pages, args.scanned_fraction, args.blank_fraction, seed=i)
+        file_start = time.perf_counter()
+        try:
+            df_pages, df_extracted, _ = process_file(path, save_to_db=True)
+            total_pages += len(df_pages)
+            for source, count in df_pages["ocr_source"].value_counts().items():
+                ocr_sources[source] += int(count)
+            for label in df_pages["triage_label"].fillna("content"):
+                triage[label] += 1
+            for clf_type in df_pages["clf_type"].fillna("none"):
+                classifiers[clf_type] += 1
+            if df_extracted is not None:
+                for source in df_extracted["source"].fillna("gemini"):
+                    value_sources[source] += 1
+        except Exception as e:
+            failures += 1
+            print(f"{path}: failed with {e!r}")
+        file_times.append(time.perf_counter() - file_start)
+    elapsed = time.perf_counter() - start
+    tracing.remove_span_listener(on_span)
+
+    stages = {}
+    for stage, samples in sorted(durations.items()):
+        arr = np.asarray(samples)
+        stages[stage] = {
+            "count": len(arr),
+            "p50_ms": float(np.percentile(arr, 50)),
+            "p95_ms": float(np.percentile(arr, 95)),
+            "total_ms": float(arr.sum()),
+            "rss_growth_mb": rss_growth[stage],
+        }
+    return {
+        "files": args.files,
+        "pages": total_pages,
+        "failures": failures,
+        "elapsed_s": elapsed,
+        "pages_per_s": total_pages / elapsed if elapsed else 0.0,
+        "file_p50_s": float(np.percentile(file_times, 50)) if file_times else None,
+        "file_p95_s": float(np.percentile(file_times, 95)) if file_times else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - start_rss,
+        "calls": {"vision": vision.calls, "gemini": genai.calls, "s3_objects": len(s3.objects)},
+        "gemini_prompt_tokens": genai.prompt_token_total,
+        "ocr_sources": dict(ocr_sources),
+        "triage": dict(triage),
+        "value_sources": dict(value_sources),
+        "classifiers": dict(classifiers),
+        "tiers": extraction_policy.tier_stats.report(),
+        "rows": {k: int(v) for k, v in store.row_counts().items()},
+        "stages": stages,
+    }
+
+
+def print_report(result):
+    print(f"\n{result['pages']} pages in {result['elapsed_s']:.2f}s -> {result['pages_per_s']:.2f} pages/s "
+          f"({result['failures']} failed files)")
+    print(f"file latency p50 {result['file_p50_s']:.2f}s  p95 {result['file_p95_s']:.2f}s  "
+          f"peak RSS {result['peak_rss_mb']:.0f} MiB")
+    print("ocr source: " + ", ".join(f"{k}={v}" for k, v in sorted(result.get("ocr_sources", {}).items())))
+    print("triage:     " + ", ".join(f"{k}={v}" for k, v in sorted(result.get("triage", {}).items())))
+    print("classifier: " + ", ".join(f"{k}={v}" for k, v in sorted(result.get("classifiers", {}).items())))
+    print("values:     " + ", ".join(f"{k}={v}" for k, v in sorted(result.get("value_sources", {}).items())))
+    for model_id, t in result.get("tiers", {}).items():
+        print(f"tier {model_id}: {t['calls']} calls, mean {t['mean_latency_s'] * 1000:.0f} ms, "
+              f"{t['mean_tokens']:.0f} tokens, escalation rate {t['escalation_rate']:.0%}")
+    calls = result.get("calls", {}).get("gemini")
+    if calls:
+        print(f"gemini:     {calls} calls, {result.get('gemini_prompt_tokens', 0) / calls:.0f} prompt tokens/call")
+    print(f"\n{'stage':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'total ms':>12}{'RSS +MiB':>10}")
+    for stage, s in result["stages"].items():
+        print(f"{stage:<20}{s['count']:>7}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['total_ms']:>12.0f}{s['rss_growth_mb']:>10.1f}")
+
+
+def check_regression(result, baseline, tolerance):
+    """Compare against a previous --json result. Returns a list of regressions."""
+    problems = []
+    if result["pages_per_s"] < baseline["pages_per_s"] * (1 - tolerance):
+        problems.append(f"pages/s {result['pages_per_s']:.2f} < baseline {baseline['pages_per_s']:.2f}")
+    for stage, s in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base and s["p95_ms"] > base["p95_ms"] * (1 + tolerance) and s["p95_ms"] - base["p95_ms"] > 1:
+            problems.append(f"{stage} p95 {s['p95_ms']:.1f}ms > baseline {base['p95_ms']:.1f}ms")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per file.")
+    parser.add_argument("--scanned-fraction", type=float, default=0.0)
+    parser.add_argument("--blank-fraction", type=float, default=0.0)
+    parser.add_argument("--text-layer", choices=["auto", "off"], default="auto",
+                        help="Read digital pages from the PDF text layer (auto) or OCR every page (off).")
+    parser.add_argument("--zonal", choices=["on", "off"], default="on",
+                        help="Read fixed-layout fields from the OCR geometry before calling Gemini.")
+    parser.add_argument("--roi", choices=["on", "off"], default="on",
+                        help="Send Gemini crops of the regions holding the requested fields.")
+    parser.add_argument("--tiers", default="gemini-2.0-flash-lite,gemini-2.0-flash",
+                        help="Extraction models, cheapest first (EXTRACTION_TIERS).")
+    parser.add_argument("--combined", choices=["on", "off"], default="off",
+                        help="Classify and extract pages the keyword matcher can't label in one Gemini call.")
+    parser.add_argument("--vision-ms", type=float, default=800)
+    parser.add_argument("--vision-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-upload-ms", type=float, default=300)
+    parser.add_argument("--gemini-ms", type=float, default=2500)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Rate of 429s (retried with backoff).")
+    parser.add_argument("--s3-ms", type=float, default=60)
+    parser.add_argument("--s3-error-rate", type=float, default=0.0)
+    parser.add_argument("--db-ms", type=float, default=50)
+    parser.add_argument("--fake-classifiers", action="store_true", help="Replace BART/CLIP with instant fakes.")
+    parser.add_argument("--json", help="Write the result to this file.")
+    parser.add_argument("--baseline", help="Compare against a previous --json result.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = check_regression(result, json.load(f), args.tolerance)
+        if problems:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
@@ -0,0 +1,121 @@
+"""
+Search latency over a synthetic corpus: the page_search index (search_index.py)
+against the LIKE queries chat SQL generates over pages.lines.
+
+Usage (from backend/, SUPABASE_* env vars pointing at a scratch database with
+pg_trgm available):
+    python -m benchmarks.bench_search [--pages 1000000] [--lines-per-page 10]
+
+Synthetic data is generated server-side with generate_series into a
+throw-away schema (bench_search), which is dropped afterwards unless --keep.
+A few needles (a business name, an EIN, an amount) are planted on a small
+fraction of lines so the queries have realistic selectivity.
+"""
+import argparse
+import statistics
+import time
+
+from entity_matcher import get_db_connection
+import search_index
+
+SETUP = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+DROP SCHEMA IF EXISTS bench_search CASCADE;
+CREATE SCHEMA bench_search;
+SET search_path TO bench_search, public;
+
+CREATE TABLE document_runs (
+    run_id BIGSERIAL PRIMARY KEY, filename TEXT NOT NULL, is_current BOOLEAN NOT NULL DEFAULT TRUE
+);
+CREATE TABLE page_search (
+    id BIGSERIAL PRIMARY KEY, run_id BIGINT NOT NULL, filename TEXT NOT NULL,
+    preprocessed TEXT NOT NULL, page_number INTEGER, source TEXT NOT NULL, key TEXT,
+    content TEXT NOT NULL, bbox INTEGER[], normalized_bbox REAL[],
+    tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+);
+
+INSERT INTO document_runs (filename) SELECT 'file_' || f || '.pdf' FROM generate_series(1, %(files)s) f;
+
+INSERT INTO page_search (run_id, filename, preprocessed, page_number, source, content, bbox)
+SELECT r.run_id, r.filename, 'debug_images/' || r.filename || '/page_' || n || '/preprocessed.png', n, 'line',
+       CASE
+           WHEN (r.run_id * 7919 + n * 31 + l) %% 20011 = 0 THEN 'Acme Holdings LLC'
+           WHEN (r.run_id * 7919 + n * 31 + l) %% 20021 = 0 THEN 'Employer identification number 12-3456789'
+           WHEN (r.run_id * 7919 + n * 31 + l) %% 997 = 0 THEN 'Total income 48,250'
+           ELSE array_to_string(ARRAY(
+               SELECT (ARRAY['income','deductions','schedule','form','total','tax','line','see',
+                             'instructions','partner','shareholder','business','credits','payments',
+                             'amount','return','name','address','city','state','ordinary','gross',
+                             'receipts','sales','cost','goods','sold','wages','interest','dividends'])
+                      [1 + floor(random() * 30)::int]
+               -- referencing n correlates the subquery, so every line gets fresh words
+               FROM generate_series(1, 4 + (l %% 6)) w WHERE w > 0 * n
+           ), ' ')
+       END,
+       ARRAY[100, 100 + l * 45, 1400, 140 + l * 45]
+FROM document_runs r, generate_series(1, %(pages_per_file)s) n, generate_series(1, %(lines)s) l;
+
+-- What chat SQL scans today: one text blob of lines per page.
+CREATE TABLE pages AS
+SELECT filename, preprocessed, page_number, run_id, string_agg(content, E'\\n' ORDER BY id) AS lines
+FROM page_search GROUP BY filename, preprocessed, page_number, run_id;
+
+CREATE INDEX ON page_search USING GIN (tsv);
+CREATE INDEX ON page_search USING GIN (content gin_trgm_ops);
+CREATE INDEX ON page_search (run_id);
+CREATE INDEX ON page_search (filename);
+CREATE UNIQUE INDEX ON document_runs (filename) WHERE is_current;
+ANALYZE;
+"""
+
+QUERIES = ["Acme Holdings", "12-3456789", "total income 48,250", "Acme Holdngs"]
+
+
+def like_query(cursor, query):
+    start = time.perf_counter()
+    cursor.execute(
+        "SELECT filename, page_number FROM pages WHERE lines ILIKE %s LIMIT 20",
+        (f"%{query}%",)
+    )
+    cursor.fetchall()
+    return (time.perf_counter() - start) * 1000
+
+
+def index_query(conn, query):
+    start = time.perf_counter()
+    result = search_index.search(conn, query, page_size=20)
+    return (time.perf_counter() - start) * 1000, len(result["hits"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1_000_000, help="Total pages across all files.")
+    parser.add_argument("--pages-per-file", type=int, default=20)
+    parser.add_argument("--lines-per-page", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="Keep the bench_search schema afterwards.")
+    args = parser.parse_args()
+
+    files = max(1, args.pages // args.pages_per_file)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    cursor.execute(SETUP, {"files": files, "pages_per_file": args.pages_per_file, "lines": args.lines_per_page})
+    conn.commit()
+    print(f"Generated {files * args.pages_per_file:,} pages / "
+          f"{files * args.pages_per_file * args.lines_per_page:,} lines in {time.perf_counter() - start:.1f}s")
+
+    cursor.execute("SET search_path TO bench_search, public")
+    print(f"{'query':<24}{'LIKE p50 ms':>13}{'index p50 ms':>14}{'hits':>6}")
+    for query in QUERIES:
+        like_ms = statistics.median(like_query(cursor, query) for _ in range(args.repeat))
+        samples = [index_query(conn, query) for _ in range(args.repeat)]
+        index_ms = statistics.median(s[0] for s in samples)
+        print(f"{query:<24}{like_ms:>13.1f}{index_ms:>14.1f}{samples[-1][1]:>6}")
+    conn.rollback()
+
+    if not args.keep:
+        cursor.execute("DROP SCHEMA bench_search CASCADE")
+        conn.commit()
+    cursor.close()
+    conn.close()
@@ -0,0 +1,130 @@
+"""
+Region, nearest-neighbour and same-line query latency of spatial_index.GridIndex
+against linear scans over the same boxes: a vectorized NumPy scan of every box,
+and a Python loop over the list of lists pages carry today.
+
+Usage (from backend/):
+    python -m benchmarks.bench_spatial_index [--words 3000] [--queries 500] [--cells 32]
+
+Pages are synthetic: rows of words of random widths laid out like a dense
+form, in normalized coordinates. Every index answer is checked against the
+NumPy scan.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from spatial_index import GridIndex, box_distance, containment
+
+
+def synthetic_page(n_words, rng):
+    """n_words boxes in text rows across a page, [x1, y1, x2, y2] normalized."""
+    boxes, y = [], 0.02
+    line_height = min(0.012, 0.9 / max(1, n_words / 12))
+    while len(boxes) < n_words:
+        x = 0.03 + rng.uniform(0, 0.02)
+        while x < 0.95 and len(boxes) < n_words:
+            width = rng.uniform(0.01, 0.08)
+            boxes.append([x, y, min(x + width, 0.98), y + line_height * 0.8])
+            x += width + rng.uniform(0.004, 0.04)
+        y += line_height
+    return np.array(boxes)
+
+
+def scan_query(boxes, region):
+    hit = ((boxes[:, 0] <= region[2]) & (boxes[:, 2] >= region[0])
+           & (boxes[:, 1] <= region[3]) & (boxes[:, 3] >= region[1]))
+    return np.nonzero(hit)[0]
+
+
+def scan_within(boxes, region, min_containment=0.5):
+    return np.nonzero(containment(boxes, region) >= min_containment)[0]
+
+
+def scan_nearest(boxes, point, k):
+    distances = box_distance(boxes, np.array([point[0], point[1], point[0], point[1]]))
+    return np.argsort(distances, kind="stable")[:k]
+
+
+def scan_same_line(boxes, i, tolerance=0.5):
+    box = boxes[i]
+    centre, height = (box[1] + box[3]) / 2, box[3] - box[1]
+    centres = (boxes[:, 1] + boxes[:, 3]) / 2
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], height)
+    line = np.nonzero(np.abs(centres - centre) <= tolerance * heights)[0]
+    return line[np.argsort(boxes[line, 0], kind="stable")]
+
+
+def python_within(box_list, region, min_containment=0.5):
+    """What callers do with pages' bboxes lists today."""
+    found = []
+    for i, (x1, y1, x2, y2) in enumerate(box_list):
+        iw = min(x2, region[2]) - max(x1, region[0])
+        ih = min(y2, region[3]) - max(y1, region[1])
+        area = (x2 - x1) * (y2 - y1)
+        if iw > 0 and ih > 0 and area > 0 and iw * ih / area >= min_containment:
+            found.append(i)
+    return found
+
+
+def timed(fn, args_list):
+    """Median microseconds per call over args_list, and the results."""
+    samples, results = [], []
+    for args in args_list:
+        start = time.perf_counter()
+        results.append(fn(*args))
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=3000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--cells", type=int, default=32)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    boxes = synthetic_page(args.words, rng)
+    box_list = boxes.tolist()
+
+    start = time.perf_counter()
+    index = GridIndex(boxes, cells=args.cells)
+    build_ms = (time.perf_counter() - start) * 1000
+    blob = index.to_bytes()
+    start = time.perf_counter()
+    restored = GridIndex.from_bytes(blob)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"{len(boxes):,} boxes: build {build_ms:.2f} ms, {len(blob) / 1024:.1f} KiB serialized, "
+          f"from_bytes {load_ms:.3f} ms")
+
+    # Field-sized regions (a value cell, a line, a block), random points, random words.
+    regions = []
+    for _ in range(args.queries):
+        w, h = rng.uniform(0.05, 0.4), rng.uniform(0.01, 0.08)
+        x, y = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+        regions.append((np.array([x, y, x + w, y + h]),))
+    points = [(rng.uniform(0, 1, 2), args.k) for _ in range(args.queries)]
+    words = [(int(i),) for i in rng.integers(0, len(boxes), args.queries)]
+
+    rows = [
+        ("query", lambda r: index.query(r), lambda r: scan_query(boxes, r), regions),
+        ("within", lambda r: index.within(r)[0], lambda r: scan_within(boxes, r), regions),
+        ("nearest", lambda p, k: index.nearest(p, k)[0], lambda p, k: scan_nearest(boxes, p, k), points),
+        ("same_line", lambda i: index.same_line(i), lambda i: scan_same_line(boxes, i), words),
+    ]
+    print(f"\n{'query':<12}{'index us':>10}{'numpy scan us':>15}{'speedup':>9}")
+    for name, indexed, scanned, args_list in rows:
+        index_us, got = timed(indexed, args_list)
+        scan_us, expected = timed(scanned, args_list)
+        mismatches = sum(1 for a, b in zip(got, expected) if not np.array_equal(np.sort(a), np.sort(b)))
+        note = f"  ({mismatches} mismatches)" if mismatches else ""
+        print(f"{name:<12}{index_us:>10.1f}{scan_us:>15.1f}{scan_us / index_us:>8.1f}x{note}")
+
+    python_us, _ = timed(lambda r: python_within(box_list, r), regions)
+    print(f"{'within (python list scan)':<27}{python_us:>10.1f} us")
+    restored_us, _ = timed(lambda r: restored.within(r)[0], regions)
+    print(f"{'within (from_bytes index)':<27}{restored_us:>10.1f} us")
@@ -0,0 +1,321 @@
+"""
+Offline stand-ins for Cloud Vision, Gemini, S3 and Postgres, used by the
+pipeline benchmark. Each fake has a configurable latency model and error rate
+so throughput can be measured without GCP, Gemini, AWS or Supabase.
+"""
+import glob
+import json
+import random
+import sqlite3
+import struct
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Literal, get_args, get_origin
+
+from pydantic import BaseModel
+
+import pandas as pd
+from PIL import Image
+
+
+class Latency:
+    """Sleep for mean +/- jitter seconds; raise `error` with probability error_rate."""
+
+    def __init__(self, mean=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.mean = mean
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, error=None):
+        with self._lock:
+            delay = max(0.0, self._rng.uniform(self.mean - self.jitter, self.mean + self.jitter))
+            fail = self._rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail and error is not None:
+            raise error()
+
+
+# --- Cloud Vision ---------------------------------------------------------------
+
+def _png_size(image_bytes):
+    """Width/height from a PNG IHDR chunk without decoding the image."""
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", image_bytes[16:24])
+    return 2550, 3300
+
+
+def load_canned_texts(pattern="ocr_results/*_results.txt"):
+    """Full-page OCR text captured from real engines; cycled through by FakeVision."""
+    texts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts or ["Form 1120\nBalance Sheets per Books\nCash"]
+
+
+class FakeVision:
+    """
+    Drop-in for the `google.cloud.vision` module as used by PDFHandler:
+    vision.Image(content=...) and ImageAnnotatorClient().document_text_detection().
+    Returns canned annotations from ocr_results/, with word boxes laid out
+    line by line over the real page size.
+    """
+
+    def __init__(self, latency=None, texts=None):
+        self.latency = latency or Latency()
+        self.texts = texts or load_canned_texts()
+        self.calls = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class ImageAnnotatorClient:
+            def document_text_detection(self, image):
+                return fake._annotate(image.content)
+
+        self.ImageAnnotatorClient = ImageAnnotatorClient
+        self.Image = lambda content: SimpleNamespace(content=content)
+
+    def _annotate(self, image_bytes):
+        with self._lock:
+            text = self.texts[self.calls % len(self.texts)]
+            self.calls += 1
+        self.latency.wait(error=lambda: RuntimeError("Fake Vision: 503 Service Unavailable"))
+        width, height = _png_size(image_bytes)
+        lines = text.splitlines()
+        line_height = max(10, int(height * 0.9 / max(1, len(lines))))
+        annotations = [SimpleNamespace(description=text, bounding_poly=None)]
+        for i, line in enumerate(lines):
+            x = int(width * 0.05)
+            y = int(height * 0.05) + i * line_height
+            for word in line.split():
+                w = max(8, len(word) * int(width * 0.008))
+                vertices = [SimpleNamespace(x=x, y=y), SimpleNamespace(x=x + w, y=y),
+                            SimpleNamespace(x=x + w, y=y + line_height - 2), SimpleNamespace(x=x, y=y + line_height - 2)]
+                annotations.append(SimpleNamespace(description=word, bounding_poly=SimpleNamespace(vertices=vertices)))
+                x += w + int(width * 0.006)
+        return SimpleNamespace(
+            error=SimpleNamespace(message=""),
+            full_text_annotation=SimpleNamespace(text=text),
+            text_annotations=annotations,
+        )
+
+
+# --- Gemini ---------------------------------------------------------------------
+
+class FakeClientError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(message or f"Fake Gemini error {code}")
+        self.code = code
+
+
+class FakeUsage(dict):
+    """usage_metadata stand-in: mapping for info.update(), attributes for span attrs."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def fake_field_value(name, annotation):
+    """A plausible, schema-valid value for a gemini_models field."""
+    if annotation is bool:
+        return False
+    if annotation is float:
+        return 0.9
+    if get_origin(annotation) is Literal:
+        return get_args(annotation)[0]
+    if get_origin(annotation) is not None and bool in get_args(annotation):
+        return False
+    # Optional nested schemas (combined_classify branches) are left empty.
+    if get_origin(annotation) is not None and any(isinstance(a, type) and issubclass(a, BaseModel)
+                                                  for a in get_args(annotation)):
+        return None
+    name = name.lower()
+    if "ein" in name.split("_"):
+        return "12-3456789"
+    if "ssn" in name:
+        return "1234"
+    if "year" in name:
+        return "2023"
+    if "date" in name or name == "dob":
+        return "01/01/2024"
+    if name == "cost_of_goods_sold":
+        return "0"  # so gross receipts - COGS = gross profit passes validation
+    if "pct" in name:
+        return "50%"
+    if any(k in name for k in ("cash", "revenue", "profit", "assets", "liabilities", "payable",
+                               "receivable", "inventories", "wages", "agi", "interest", "deductions",
+                               "depreciation", "compensation", "amount", "limit", "goods")):
+        return "1,000"
+    return "Sample " + name.replace("_", " ").title()
+
+
+def fake_parsed(schema):
+    if "page_label" in schema.model_fields:
+        # Combined classify-and-extract: the first label, with its branch filled.
+        from gemini_models import get_model
+        label = get_args(schema.model_fields["page_label"].annotation)[0]
+        model = get_model(label)
+        return schema(page_label=label, label_confidence=0.9, **{model.__name__: fake_parsed(model)})
+    values = {name: fake_field_value(name, field.annotation) for name, field in schema.model_fields.items()}
+    return schema(**values)
+
+
+def image_tokens(file):
+    """Gemini's image token count: 258 per image up to 384 px, else 258 per 768x768 tile."""
+    try:
+        if hasattr(file, "seek"):
+            file.seek(0)
+        with Image.open(file) as image:
+            width, height = image.size
+    except Exception:
+        return 0
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * -(-width // 768) * -(-height // 768)
+
+
+class FakeGenai:
+    """
+    Drop-in for the `google.genai` module as used by ClassifyExtract.process_image:
+    genai.Client(api_key).files.upload(...), .models.generate_content(...), genai.errors.ClientError.
+    Prompt tokens are prompt_tokens plus the image tokens of the uploaded files.
+    """
+
+    def __init__(self, upload_latency=None, generate_latency=None, prompt_tokens=1300, output_tokens=250):
+        self.upload_latency = upload_latency or Latency()
+        self.generate_latency = generate_latency or Latency()
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self.prompt_token_total = 0
+        self.errors = SimpleNamespace(ClientError=FakeClientError)
+        fake = self
+
+        class Files:
+            def upload(self, file, config=None):
+                fake.upload_latency.wait(error=lambda: FakeClientError(429, "Fake upload throttled"))
+                return SimpleNamespace(name=(config or {}).get("display_name", "file"), tokens=image_tokens(file))
+
+        class Models:
+            def generate_content(self, model, contents, config=None):
+                fake.calls += 1
+                fake.generate_latency.wait(error=lambda: FakeClientError(429, "Fake generate throttled"))
+                schema = (config or {}).get("response_schema")
+                prompt_tokens = fake.prompt_tokens + sum(getattr(part, "tokens", 0) for part in contents)
+                fake.prompt_token_total += prompt_tokens
+                return SimpleNamespace(
+                    parsed=fake_parsed(schema) if schema is not None else None,
+                    model_version=model,
+                    usage_metadata=FakeUsage(
+                        prompt_token_count=prompt_tokens,
+                        candidates_token_count=fake.output_tokens,
+                        total_token_count=prompt_tokens + fake.output_tokens,
+                    ),
+                )
+
+        class Client:
+            def __init__(self, api_key=None, **kwargs):
+                self.files = Files()
+                self.models = Models()
+
+        self.Client = Client
+
+
+# --- S3 ---------------------------------------------------------------------------
+
+class FakeS3:
+    """In-memory object store with the s3_utils/storage upload and download signatures."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def upload_fileobj_to_s3(self, file_obj, object_key, bucket_name="form-sage-storage", content_type=None):
+        data = file_obj.read()
+        self.latency.wait(error=lambda: RuntimeError("Fake S3: SlowDown"))
+        with self._lock:
+            self.objects[(bucket_name, object_key)] = data
+        return object_key
+
+    def download_fileobj_from_s3(self, object_key, bucket_name="form-sage-storage"):
+        self.latency.wait(error=lambda: RuntimeError("Fake S3: InternalError"))
+        with self._lock:
+            data = self.objects[(bucket_name, object_key)]
+        return BytesIO(data)
+
+    def download_to_file(self, object_key, path, bucket_name="form-sage-storage"):
+        with open(path, "wb") as f:
+            f.write(self.download_fileobj_from_s3(object_key, bucket_name).getvalue())
+        return path
+
+
+# --- Postgres ---------------------------------------------------------------------
+
+class SQLiteStore:
+    """
+    Stand-in for document_ui.store_results_to_db that writes the same three
+    DataFrames to SQLite, so the serialization and insert cost is still paid.
+    """
+
+    def __init__(self, path=":memory:", latency=None):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.latency = latency or Latency()
+        self.run_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _serializable(df):
+        df = df.copy()
+        for col in df.columns:
+            if df[col].apply(lambda x: isinstance(x, (list, dict, set, bytes))).any():
+                df[col] = df[col].apply(lambda x: str(x) if isinstance(x, set)
+                                        else json.dumps(x) if isinstance(x, (list, dict))
+                                        else x)
+        return df
+
+    def store_results_to_db(self, filename, df_pages, df_extracted=None, df_info=None, pending_uploads=None,
+                            content_hash=None):
+        if pending_uploads is not None:
+            pending_uploads.flush()
+        with self._lock:
+            self.run_id += 1
+            run_id = self.run_id
+            self.latency.wait(error=lambda: RuntimeError("Fake DB: connection reset"))
+            for df, table in ((df_pages, "pages"), (df_extracted, "extracted2"), (df_info, "call_info")):
+                if df is not None and not df.empty:
+                    self._serializable(df.assign(run_id=run_id)).to_sql(table, self.conn, if_exists="append", index=False)
+            self.conn.commit()
+        return run_id
+
+    def row_counts(self):
+        counts = {}
+        for table in ("pages", "extracted2", "call_info"):
+            try:
+                counts[table] = pd.read_sql_query(f"SELECT COUNT(*) AS n FROM {table}", self.conn)["n"][0]
+            except Exception:
+                counts[table] = 0
+        return counts
+
+
+# --- Local classifiers --------------------------------------------------------------
+
+class FakeZeroShot:
+    """Replaces the BART zero-shot pipeline: always prefers the first candidate label."""
+
+    def __init__(self, score=0.7, latency=None):
+        self.score = score
+        self.latency = latency or Latency()
+
+    def __call__(self, text, candidate_labels):
+        self.latency.wait()
+        rest = (1 - self.score) / max(1, len(candidate_labels) - 1)
+        return {"labels": list(candidate_labels), "scores": [self.score] + [rest] * (len(candidate_labels) - 1)}
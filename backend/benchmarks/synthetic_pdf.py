@@ -0,0 +1,57 @@
+"""
+Generate synthetic multi-page PDFs for benchmarks.
+
+Pages are filled with lines taken from the captured OCR output in ocr_results/,
+so they look like the tax forms the pipeline sees. A fraction of pages can be
+made "scanned" (rasterized, no text layer) or blank.
+"""
+import random
+import fitz  # PyMuPDF
+
+from benchmarks.fakes import load_canned_texts
+
+
+def make_pdf(path, n_pages=10, scanned_fraction=0.0, blank_fraction=0.0, seed=0):
+    """
+    Write an n_pages PDF to `path` and return a list describing each page
+    ("digital", "scanned" or "blank").
+    """
+    rng = random.Random(seed)
+    texts = [t.splitlines() for t in load_canned_texts()]
+    doc = fitz.open()
+    kinds = []
+    for i in range(n_pages):
+        roll = rng.random()
+        kind = "blank" if roll < blank_fraction else "scanned" if roll < blank_fraction + scanned_fraction else "digital"
+        page = doc.new_page(width=612, height=792)  # US Letter in points
+        if kind != "blank":
+            lines = texts[i % len(texts)]
+            y = 40
+            for line in lines:
+                if y > 760:
+                    break
+                page.insert_text((36, y), line[:110], fontsize=8)
+                y += 11
+            if kind == "scanned":
+                # Replace the page by a 150 dpi raster of itself so it has no text layer.
+                pix = page.get_pixmap(dpi=150)
+                doc.delete_page(page.number)
+                page = doc.new_page(pno=i, width=612, height=792)
+                page.insert_image(page.rect, stream=pix.tobytes("png"))
+        kinds.append(kind)
+    doc.save(path)
+    doc.close()
+    return kinds
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF packet.")
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--scanned-fraction", type=float, default=0.0)
+    parser.add_argument("--blank-fraction", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    kinds = make_pdf(args.path, args.pages, args.scanned_fraction, args.blank_fraction, args.seed)
+    print(f"Wrote {args.path}: " + ", ".join(f"{k}={kinds.count(k)}" for k in sorted(set(kinds))))
@@ -7,6 +7,8 @@ from datetime import datetime
 from openai import OpenAI
 import psycopg2
 import psycopg2.extras
+from translation_cache import translation_cache, schema_hash
+from query_cache import cached_read_sql, bump_table_versions, bump_tables_for_statement
 
 # Initialize the OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
@@ -18,19 +20,36 @@ Table: pages(
     a document and information on whether/how each page was classified */
     filename TEXT,          /* File name of the uploaded document */
     preprocessed TEXT,      /* File path of a page's final preprocessed image */
+    image_levels TEXT,      /* Comma-separated renditions stored next to the preprocessed image, e.g. thumb,preview,full */
     page_number INTEGER,    /* Page number in the document */
     image_width REAL,       /* Width of the page image */
     image_height REAL,      /* Height of the page image */
+    ocr_source TEXT,        /* 'text_layer' (read from the PDF's embedded text), 'vision' (Cloud Vision OCR), 'reused' (copied from a near-duplicate page; older runs only) or 'none' (blank page, not OCR'd) */
+    triage_label TEXT,      /* 'blank_page', 'separator_page' or 'near_empty_page' from the pre-OCR triage; NULL for regular pages */
+    ink_density REAL,       /* Fraction of the page covered by ink, measured by the triage */
+    phash BIGINT,           /* 64-bit perceptual hash of the page image */
+    phash_fine BYTEA,       /* 1024-bit perceptual hash used to verify near-duplicates; not queryable as text */
+    word_index BYTEA,       /* Serialized spatial index over normalized_bboxes (see spatial_index.py); not queryable as text */
+    reused_from TEXT,       /* pages.preprocessed of the near-duplicate page whose OCR, label and values were reused */
     lines TEXT,             /* Extracted lines of text */
     words TEXT,             /* Extracted words */
     bboxes TEXT,            /* Bounding boxes of words */
     normalized_bboxes TEXT, /* Normalized bounding boxes */
     tokens TEXT,            /* Extracted tokens */
     words_for_clf TEXT,     /* Words used for classification */
+    words_bin BYTEA,        /* Packed words (binary storage mode); not queryable as text */
+    bboxes_bin BYTEA,       /* Packed bounding boxes (binary storage mode) */
+    normalized_bboxes_bin BYTEA, /* Packed normalized bounding boxes (binary storage mode) */
     processing_time REAL,   /* Time taken for processing */
-    clf_type TEXT,          /* Type of classifier used */
+    render_time REAL,       /* Seconds spent rendering the page image */
+    ocr_time REAL,          /* Seconds spent on OCR for the page */
+    preprocess_time REAL,   /* Seconds spent denoising and uploading the page image */
+    classify_time REAL,     /* Seconds spent classifying the page */
+    extract_time REAL,      /* Seconds spent extracting fields from the page */
+    clf_type TEXT,          /* Type of classifier used ('triage' for pages labelled by the pre-OCR triage, 'reused' for near-duplicates, 'gemini_combined' for one-call classify and extract) */
     page_label TEXT,        /* Predicted label for the page */
     page_confidence REAL,        /* Confidence score for the label */
+    run_id INTEGER,         /* Foreign key to document_runs.run_id */
     created_at DATETIME default current_timestamp /* Timestamp of creation */
 )
 Table: extracted2(
@@ -43,8 +62,39 @@ Table: extracted2(
     page_label TEXT,    /* Type of page -- correspondes to pages.page_label */
     page_confidence REAL, /* Confidence score of page_label -- correspondes to pages.page_confidence */
     page_num INTEGER,   /* Page number in the document */
+    source TEXT,        /* 'zonal' (read from the form layout), 'pattern' (EIN/SSN/tax year read with validated patterns), 'gemini' (model extraction) or 'reused' (copied from a near-duplicate page) */
+    confidence REAL,    /* Confidence of a zonal or pattern value; NULL for other sources */
+    cross_check TEXT,   /* For Gemini values of identifier/date/amount fields: 'match' if the value validates and appears on the page, 'mismatch' if not */
+    run_id INTEGER,     /* Foreign key to document_runs.run_id */
     created_at DATETIME default current_timestamp /* Timestamp of creation */
 )
+Table: document_runs(
+    /* One row per processing run of an uploaded file. Files can be re-processed,
+       so pages and extracted2 keep rows from older runs; join on a run with
+       is_current = TRUE to only see the latest version of each file. */
+    run_id INTEGER PRIMARY KEY,
+    filename TEXT,          /* File name of the uploaded document -- corresponds to pages.filename */
+    status TEXT,            /* 'running', 'complete' or 'failed' */
+    is_current BOOLEAN,     /* TRUE for the latest completed run of the file */
+    page_count INTEGER,     /* Number of pages in the run */
+    content_hash TEXT,      /* SHA-256 of the uploaded file */
+    created_at DATETIME,    /* When the run started */
+    completed_at DATETIME   /* When the run completed */
+)
+Table: page_search(
+    /* Search index: one row per OCR line and per extracted value of each run.
+       Prefer it over LIKE on pages.lines / extracted2.value for "which documents mention X". */
+    run_id INTEGER,         /* Foreign key to document_runs.run_id; join on is_current for the latest version */
+    filename TEXT,          /* File name of the uploaded document -- corresponds to pages.filename */
+    preprocessed TEXT,      /* Corresponds to pages.preprocessed */
+    page_number INTEGER,    /* Page number in the document */
+    source TEXT,            /* 'line' or 'value' */
+    key TEXT,               /* extracted2.key for values */
+    content TEXT,           /* The line or value text; trigram-indexed, so ILIKE '%x%' is fast */
+    bbox INTEGER[],         /* [x1, y1, x2, y2] of the text on the page image */
+    normalized_bbox REAL[],
+    tsv TSVECTOR            /* to_tsvector('simple', content); query with tsv @@ websearch_to_tsquery('simple', ...) */
+)
 Table: entities(
     /* Table to store unique person or business entities */
     entity_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -102,6 +152,7 @@ def save_conversation(conversation, title="Conversation"):
             "INSERT INTO conversations (title, conversation) VALUES (%s, %s)",
             (title, conversation_json)
         )
+        bump_table_versions(cursor, ["conversations"])
         conn.commit()
     except Exception as e:
         print(f"Error saving conversation: {e}")
@@ -156,7 +207,7 @@ def cleanup_sql_query(raw_query: str) -> str:
     cleaned = re.sub(r"```", "", cleaned)
     return cleaned.strip()
 
-def convert_to_sql(nl_query: str, schema: str) -> str:
+def convert_to_sql(nl_query: str, schema: str, use_cache: bool = True) -> str:
     examples = """
     Examples of valid queries:
 
@@ -168,7 +219,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
            p.created_at,
            ent.entity_name
     FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
+    JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+    JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
     JOIN page_entity_crosswalk pc ON p.id = pc.page_id
     JOIN entities ent ON pc.entity_id = ent.entity_id
     WHERE ent.entity_name = 'Company XYZ'
@@ -181,7 +233,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
            MAX(CASE WHEN e.key = 'property_address' THEN e.value END) AS property_address,
            ent.entity_name
     FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
+    JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+    JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
     JOIN page_entity_crosswalk pc ON p.id = pc.page_id
     JOIN entities ent ON pc.entity_id = ent.entity_id
     WHERE ent.entity_name = 'Company ABC'
@@ -195,7 +248,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
            MAX(CASE WHEN e.key = 'term_length' THEN e.value END) AS term_length,
            ent.entity_name
     FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
+    JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+    JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
     JOIN page_entity_crosswalk pc ON p.id = pc.page_id
     JOIN entities ent ON pc.entity_id = ent.entity_id
     WHERE ent.entity_name = 'AAA Inc.'
@@ -207,7 +261,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
         SELECT DISTINCT e.filename,
                e.value AS owner_name
         FROM extracted2 e
-        JOIN pages p ON e.filename = p.preprocessed
+        JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+        JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
         JOIN page_entity_crosswalk pc ON p.id = pc.page_id
         JOIN entities ent ON pc.entity_id = ent.entity_id
         WHERE ent.entity_name = 'MM Corp'
@@ -217,7 +272,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
     drivers AS (
         SELECT DISTINCT ent.entity_name AS person_name
         FROM extracted2 e
-        JOIN pages p ON e.filename = p.preprocessed
+        JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+        JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
         JOIN page_entity_crosswalk pc ON p.id = pc.page_id
         JOIN entities ent ON pc.entity_id = ent.entity_id
         WHERE e.page_label = 'drivers_license'
@@ -235,7 +291,8 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
            MAX(CASE WHEN e.key = 'date_incorporated' THEN e.value END) AS date_incorporated,
            ent.entity_name
     FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
+    JOIN pages p ON e.filename = p.preprocessed AND e.run_id = p.run_id
+    JOIN document_runs r ON r.run_id = p.run_id AND r.is_current
     JOIN page_entity_crosswalk pc ON p.id = pc.page_id
     JOIN entities ent ON pc.entity_id = ent.entity_id
     WHERE ent.entity_name = 'JJ LLC'
@@ -243,6 +300,14 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
     GROUP BY e.filename, ent.entity_name;
     """
 
+    # Repeated (or, if enabled, near-identical) questions skip the model call.
+    model = "gpt-4o"
+    schema_key = schema_hash(schema, examples, model)
+    if use_cache:
+        cached = translation_cache.get(nl_query, schema_key)
+        if cached is not None:
+            return cached
+
     prompt = f"""You are an expert data scientist specialized in SQL query generation. Analyze the provided PostgreSQL database schema and think step-by-step to produce precise and optimized SQL queries.
 
     Database Schema:
@@ -262,7 +327,7 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
 
     response = client.chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
-        model="gpt-4o",
+        model=model,
         temperature=0,
     )
     allowed_prefixes = (
@@ -283,19 +348,85 @@ def convert_to_sql(nl_query: str, schema: str) -> str:
     sql_query = cleanup_sql_query(sql_query)
     if not sql_query.lower().startswith(allowed_prefixes):
         raise ValueError("Generated query does not start with a valid SQL command. Aborting for safety.")
+    if use_cache:
+        translation_cache.put(nl_query, schema_key, sql_query)
     return sql_query
 
+# Limits for read queries (generated SQL can easily scan all of `pages`).
+SQL_ROW_CAP = int(os.environ.get("SQL_ROW_CAP", "10000"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.environ.get("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+SQL_FETCH_SIZE = int(os.environ.get("SQL_FETCH_SIZE", "1000"))
+
+def is_read_query(query: str) -> bool:
+    return query.strip().lower().startswith(("select", "with"))
+
+def stream_sql_query(query: str, batch_size: int = SQL_FETCH_SIZE, row_cap: int = SQL_ROW_CAP):
+    """
+    Run a read query through a named (server-side) cursor and yield results in
+    batches, so at most `batch_size` rows are held in memory at a time:
+        ("columns", [names]), ("rows", [tuples]) ..., ("done", {"row_count", "truncated"})
+    The session is read-only and statement_timeout applies to every fetch.
+    """
+    conn = get_connection()
+    try:
+        conn.set_session(readonly=True)
+        with conn.cursor() as setup:
+            setup.execute("SET statement_timeout = %s", (SQL_STATEMENT_TIMEOUT_MS,))
+        cursor = conn.cursor(name="run_sql_stream")
+        cursor.itersize = batch_size
+        cursor.execute(query)
+        row_count, truncated = 0, False
+        # The first fetch runs the query; description is only available after it.
+        batch = cursor.fetchmany(min(batch_size, row_cap))
+        yield "columns", [d[0] for d in cursor.description]
+        while batch:
+            row_count += len(batch)
+            yield "rows", batch
+            if row_count >= row_cap:
+                truncated = bool(cursor.fetchmany(1))
+                break
+            batch = cursor.fetchmany(min(batch_size, row_cap - row_count))
+        cursor.close()
+        yield "done", {"row_count": row_count, "truncated": truncated}
+    finally:
+        conn.close()
+
 def run_sql_query(query: str) -> pd.DataFrame:
-    """Execute the given SQL query on the SQLite database and return the results as a DataFrame."""
+    """
+    Execute the given SQL query on the database and return the results as a DataFrame.
+    Read queries are streamed and capped at SQL_ROW_CAP rows; df.attrs["truncated"]
+    says whether rows were dropped. Their results are cached until an ingest
+    or write touches one of the tables they read (see query_cache.py).
+    """
+    if is_read_query(query):
+        def load():
+            columns, rows, done = [], [], {}
+            for kind, value in stream_sql_query(query):
+                if kind == "columns":
+                    columns = value
+                elif kind == "rows":
+                    rows.extend(value)
+                else:
+                    done = value
+            df = pd.DataFrame(rows, columns=columns)
+            df.attrs["truncated"] = done.get("truncated", False)
+            return df
+
+        conn = get_connection()
+        try:
+            df = cached_read_sql(query, conn, loader=load)
+        except Exception as e:
+            df = pd.DataFrame({"error": [str(e)]})
+        finally:
+            conn.close()
+        return df
     conn = get_connection()
     try:
-        if query.strip().lower().startswith(("select", "with")):
-            df = pd.read_sql_query(query, conn)
-        else:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            conn.commit()
-            df = pd.DataFrame({"result": ["Query executed successfully"]})
+        cursor = conn.cursor()
+        cursor.execute(query)
+        bump_tables_for_statement(cursor, query)
+        conn.commit()
+        df = pd.DataFrame({"result": ["Query executed successfully"]})
     except Exception as e:
         df = pd.DataFrame({"error": [str(e)]})
     finally:
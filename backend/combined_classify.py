@@ -0,0 +1,92 @@
+"""
+Classify and extract a page in one Gemini call.
+
+Pages the keyword matcher can't label normally go through BART, maybe CLIP,
+and then a separate Gemini extraction call. With COMBINED_CLASSIFY on they
+go to a single call instead, whose response schema carries the page label
+and the fields of every gemini_models schema:
+
+    page_label          enum of the labels with a schema, plus "unknown"
+    label_confidence    the model's 0..1 confidence in page_label
+    <SchemaClass>       optional object per schema class (BalanceSheet, F1040_p1, ...)
+
+Gemini's response schemas have no discriminated unions, so the union is a
+label enum plus one optional branch per schema class; only the branch of the
+chosen label is read (unpack()). Labels sharing a schema (the three balance
+sheets) share its branch.
+
+Environment:
+    COMBINED_CLASSIFY           1/0 (default 0)
+    COMBINED_MIN_CONFIDENCE     min label_confidence to accept a label, else "unknown" (default 0.5)
+"""
+import os
+from functools import lru_cache
+from typing import Literal, Optional
+
+from pydantic import Field, create_model
+
+from gemini_models import get_model
+
+COMBINED_CLASSIFY = os.environ.get("COMBINED_CLASSIFY", "0").lower() in ("1", "true", "yes")
+COMBINED_MIN_CONFIDENCE = float(os.environ.get("COMBINED_MIN_CONFIDENCE", "0.5"))
+
+UNKNOWN = "unknown"
+
+# Labels a page can get from the combined call, with a short description for the prompt.
+LABELS = {
+    "1120S_p1": "First page of Form 1120-S (profit and loss)",
+    "1120S_k1": "Schedule K-1 of Form 1120-S (shareholder information)",
+    "1120S_bal_sheet": "Schedule L balance sheet of Form 1120-S",
+    "1065_p1": "First page of Form 1065 (profit and loss)",
+    "1065_k1": "Schedule K-1 of Form 1065 (partner information)",
+    "1065_bal_sheet": "Schedule L balance sheet of Form 1065",
+    "1120_p1": "First page of Form 1120 (profit and loss)",
+    "1120_bal_sheet": "Schedule L balance sheet of Form 1120",
+    "1040_p1": "First page of Form 1040 (personal information)",
+    "1040_sch_c": "Schedule C of Form 1040 (sole proprietor business)",
+    "acord_25": "ACORD 25 certificate of liability insurance",
+    "acord_28": "ACORD 28 evidence of commercial property insurance",
+    "drivers_license": "Government-issued driver's license",
+    "passport": "Government-issued passport",
+    "lease_document": "Lease agreement between a landlord and tenant",
+    "certificate_of_good_standing": "Certificate of good standing issued by a state agency",
+    "business_license": "State or local license authorizing a business to operate",
+}
+
+
+@lru_cache(maxsize=None)
+def combined_model():
+    """The combined response schema (see module docstring)."""
+    branches = {}
+    for label in LABELS:
+        model = get_model(label)
+        if model is not None and model.__name__ not in branches:
+            branches[model.__name__] = (Optional[model], Field(
+                default=None,
+                description=f"Only when page_label is {', '.join(l for l in LABELS if get_model(l) is model)}: "
+                            f"{model.__doc__ or 'the fields of the page'}",
+            ))
+    label_list = "; ".join(f"{label}: {description}" for label, description in LABELS.items())
+    return create_model(
+        "PageClassifyExtract",
+        __doc__="Classify the page, then extract the fields of its schema.",
+        page_label=(Literal[tuple(LABELS) + (UNKNOWN,)], Field(
+            description=f"The type of the page. One of {label_list}. Use {UNKNOWN} if none fits.")),
+        label_confidence=(float, Field(description="Confidence in page_label, from 0 to 1.")),
+        **branches,
+    )
+
+
+def unpack(parsed):
+    """
+    (page_label, confidence, values) from a parsed combined response. values
+    is the chosen branch's field dict, or None when the page is unknown or
+    the branch is missing.
+    """
+    label = parsed.page_label
+    confidence = float(parsed.label_confidence or 0.0)
+    model = get_model(label) if label != UNKNOWN else None
+    if model is None or confidence < COMBINED_MIN_CONFIDENCE:
+        return UNKNOWN, confidence, None
+    branch = getattr(parsed, model.__name__, None)
+    return label, confidence, branch.model_dump() if branch is not None else None
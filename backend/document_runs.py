@@ -0,0 +1,93 @@
+"""
+Run bookkeeping for processed documents.
+
+Every ingest of a file gets a row in `document_runs`; the pages, extracted2 and
+call_info rows it writes carry that run_id. When all rows are written the run
+is completed and atomically becomes the file's current run, so readers only
+ever see a complete run and never need ROW_NUMBER() over the history.
+"""
+from query_cache import bump_table_versions
+
+
+def start_run(conn, filename, content_hash=None):
+    """
+    Create a new (not yet current) run for `filename` and return its run_id.
+    `content_hash` is the SHA-256 of the uploaded bytes, when known.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO document_runs (filename, status, content_hash) VALUES (%s, 'running', %s) RETURNING run_id",
+        (filename, content_hash)
+    )
+    run_id = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return run_id
+
+
+def complete_run(conn, run_id, page_count=None):
+    """
+    Mark a run complete and make it the current run for its file.
+    Returns the run_id it superseded, or None if the file had no current run.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT filename FROM document_runs WHERE run_id = %s", (run_id,))
+    filename = cursor.fetchone()[0]
+    # Serialize concurrent completions for the same file so the partial unique
+    # index on (filename) WHERE is_current is never violated.
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (filename,))
+    cursor.execute(
+        "UPDATE document_runs SET is_current = FALSE WHERE filename = %s AND is_current RETURNING run_id",
+        (filename,)
+    )
+    superseded = cursor.fetchone()
+    cursor.execute("""
+        UPDATE document_runs
+        SET status = 'complete', is_current = TRUE, page_count = %s,
+            completed_at = (now() AT TIME ZONE 'utc')
+        WHERE run_id = %s
+    """, (page_count, run_id))
+    bump_table_versions(cursor, ["document_runs"])
+    conn.commit()
+    cursor.close()
+    return superseded[0] if superseded else None
+
+
+def fail_run(conn, run_id, error=None):
+    """Mark a run failed. The file's previous current run (if any) stays current."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE document_runs
+        SET status = 'failed', error = %s, completed_at = (now() AT TIME ZONE 'utc')
+        WHERE run_id = %s
+    """, (str(error) if error is not None else None, run_id))
+    conn.commit()
+    cursor.close()
+
+
+def find_completed_run(conn, content_hash, filename=None):
+    """
+    (run_id, filename) of the latest current run whose upload had this content
+    hash (and, if given, this filename), or None.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT run_id, filename FROM document_runs
+        WHERE content_hash = %s AND is_current AND (%s IS NULL OR filename = %s)
+        ORDER BY completed_at DESC LIMIT 1
+    """, (content_hash, filename, filename))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+
+def get_current_run(conn, filename):
+    """Return (run_id, completed_at) for the file's current run, or None."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT run_id, completed_at FROM document_runs WHERE filename = %s AND is_current",
+        (filename,)
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    return row
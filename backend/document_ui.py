@@ -10,22 +10,20 @@ import numpy as np
 from entity_matcher import match_entities_for_file
 import psycopg2
 import psycopg2.extras
-import boto3  # NEW: Import boto3 for generating S3 URLs
+from url_signer import url_cache
 from s3_utils import upload_fileobj_to_s3
+from geometry_codec import use_binary_geometry, encode_geometry_columns, decode_geometry_columns
+from file_queries import read_connection, fetch_file_payload
+from query_cache import bump_table_versions
+from document_runs import start_run, complete_run, fail_run
+from search_index import index_run, prune_run
+from metrics_store import record_run_metrics, record_stage_latency, stage_samples_from_pages
+from tracing import span, set_trace_run_id, flush_spans
+import time
 
 # --- Helper to generate presigned S3 URL ---
 def get_s3_url(object_key, bucket_name="form-sage-storage", expiration=3600):
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        region_name="us-east-2"
-    )
-    return s3_client.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': bucket_name, 'Key': object_key},
-        ExpiresIn=expiration
-    )
+    return url_cache.get(object_key, bucket_name, expiration)
 
 # --- Supabase Connection using psycopg2 ---
 def get_connection():
@@ -69,22 +67,93 @@ def store_df_to_db(df, table_name):
     values = [tuple(row) for row in df1.to_numpy()]
     
     psycopg2.extras.execute_values(cursor, query, values)
+    bump_table_versions(cursor, [table_name])
     conn.commit()
     cursor.close()
     conn.close()
 
+def load_file_data(filename):
+    """
+    (df_pages, df_extracted, df_info) for the file's current run, read with one
+    prepared, parameterized call to get_file_payload().
+    """
+    with read_connection() as conn:
+        payload = fetch_file_payload(conn, filename)
+    if payload is None:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    return (decode_geometry_columns(pd.DataFrame(payload["pages"])),
+            pd.DataFrame(payload["extracted"]),
+            pd.DataFrame(payload["info"]))
+
+def store_results_to_db(filename, df_pages, df_extracted=None, df_info=None, pending_uploads=None,
+                        content_hash=None):
+    """
+    Store one processing run of a file (pages, extracted values and call info)
+    under a new document run, then make that run the file's current version.
+    `pending_uploads` (an UploadQueue) is flushed before any row is written; if
+    an upload failed the run is marked failed and the error re-raised.
+    `content_hash` (SHA-256 of the uploaded file) is recorded on the run.
+    Returns the run_id.
+    """
+    conn = get_connection()
+    run_id = start_run(conn, filename, content_hash)
+    set_trace_run_id(run_id)
+    try:
+        if pending_uploads is not None:
+            pending_uploads.flush()
+        db_start = time.perf_counter()
+        with span("db_write", rows=len(df_pages)):
+            df_pages = df_pages.assign(run_id=run_id)
+            store_df_to_db(encode_geometry_columns(df_pages) if use_binary_geometry() else df_pages, 'pages')
+            if df_extracted is not None and not df_extracted.empty:
+                store_df_to_db(df_extracted.assign(run_id=run_id), 'extracted2')
+            if df_info is not None and not df_info.empty:
+                store_df_to_db(df_info.assign(run_id=run_id), 'call_info')
+            with span("search_index"):
+                index_run(conn, run_id, filename, df_pages, df_extracted)
+            superseded_run_id = complete_run(conn, run_id, page_count=len(df_pages))
+        db_time = time.perf_counter() - db_start
+    except Exception as e:
+        # The failed statement may have aborted the transaction; marking the
+        # run failed must not mask the original error.
+        try:
+            conn.rollback()
+            fail_run(conn, run_id, e)
+        except Exception as mark_error:
+            print(f"Error marking run {run_id} failed: {mark_error}")
+        finally:
+            conn.close()
+        raise
+
+    # Metrics and pruning are best-effort: a failure here must not fail the ingest.
+    try:
+        prune_run(conn, superseded_run_id)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error pruning search rows of run {superseded_run_id}: {e}")
+    try:
+        record_run_metrics(conn, run_id, superseded_run_id)
+        samples = stage_samples_from_pages(df_pages)
+        samples.append(("db_write", "all", db_time))
+        record_stage_latency(conn, samples)
+    except Exception as e:
+        print(f"Error recording metrics for run {run_id}: {e}")
+    finally:
+        flush_spans(conn)
+        conn.close()
+    return run_id
+
 @st.cache_data
 def process_pdf(upload_path):
     # Process the PDF and extract data using your pipeline
     df_pages, df_extracted, df_info = process_file(upload_path)
     
     # Store the extracted data into the Supabase database
-    store_df_to_db(df_pages, 'pages')
-    store_df_to_db(df_extracted, 'extracted2')
-    store_df_to_db(df_info, 'call_info')
+    store_results_to_db(os.path.basename(upload_path), df_pages, df_extracted, df_info)
     
     # Run entity matching on the file
     match_entities_for_file(os.path.basename(upload_path))
+    flush_spans()
     
     return df_pages, df_extracted, df_info
 
@@ -136,43 +205,7 @@ def process_pdf(upload_path):
 # # --- Loading Existing File Data ---
 # if selected_file:
 #     dt_start = datetime.now()
-#     conn = get_connection()
-    
-#     query_pages = f'''
-#     WITH p1 AS (
-#         SELECT *,
-#                ROW_NUMBER() OVER (PARTITION BY preprocessed ORDER BY created_at DESC) rn
-#         FROM pages
-#         WHERE filename = '{selected_file}'
-#     )
-#     SELECT * FROM p1 WHERE rn = 1  
-#     '''
-#     df_pages = pd.read_sql_query(query_pages, conn)
-    
-#     query_extracted = f'''
-#     WITH e3 AS (
-#         SELECT p.filename AS base_file, e2.*, 
-#                ROW_NUMBER() OVER (PARTITION BY e2.filename, e2.key ORDER BY created_at DESC) rn 
-#         FROM extracted2 e2
-#         JOIN (SELECT filename, preprocessed FROM pages) p ON e2.filename = p.preprocessed
-#         WHERE p.filename = '{selected_file}'
-#     )
-#     SELECT * FROM e3 WHERE rn = 1
-#     '''
-#     df_extracted = pd.read_sql_query(query_extracted, conn)
-    
-#     query_info = f'''
-#     WITH i1 AS (
-#         SELECT p.filename AS base_file, i.*, 
-#                ROW_NUMBER() OVER (PARTITION BY i.filename ORDER BY created_at DESC) rn 
-#         FROM call_info i 
-#         JOIN (SELECT filename, preprocessed FROM pages) p ON i.filename = p.preprocessed
-#         WHERE p.filename = '{selected_file}'
-#     )
-#     SELECT * FROM i1 WHERE rn = 1
-#     '''
-#     df_info = pd.read_sql_query(query_info, conn)
-#     conn.close()
+#     df_pages, df_extracted, df_info = load_file_data(selected_file)
 
 # if uploaded_file or selected_file:
 #     dt_end = datetime.now()
@@ -2,7 +2,11 @@ import os
 import psycopg2
 import psycopg2.extras
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from rapidfuzz import fuzz
+from tracing import span
+from query_cache import bump_table_versions
 
 # Configuration mapping document types to fields
 DOCUMENT_FIELD_MAPPING = {
@@ -63,6 +67,14 @@ DOCUMENT_FIELD_MAPPING = {
     }
 }
 
+# Entity lookups started during extraction (see prefetch_for_page), keyed by
+# (entity_type, normalized identifier).
+ENTITY_PREFETCH = os.environ.get("ENTITY_PREFETCH", "1").lower() in ("1", "true", "yes")
+_prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="entity-prefetch")
+PREFETCH_MAX_ENTRIES = 1024
+_prefetched = {}
+_prefetch_lock = threading.Lock()
+
 def normalize_value(val):
     if val:
         return val.strip().lower()
@@ -86,31 +98,84 @@ def get_db_connection():
     )
     return conn
 
-def fetch_extracted_data(page_preprocessed, page_num):
+def fetch_extracted_data(page_preprocessed, page_num, run_id=None):
     print(f"[DEBUG] Fetching extracted data for file: {page_preprocessed}, page: {page_num}")
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT key, value FROM extracted2 
         WHERE filename = %s AND page_num = %s
-    """, (page_preprocessed, page_num))
+          AND (%s IS NULL OR run_id = %s)
+        ORDER BY created_at
+    """, (page_preprocessed, page_num, run_id, run_id))
     rows = cursor.fetchall()
     conn.close()
     data = {row[0]: row[1] for row in rows}
     print(f"[DEBUG] Extracted data: {data}")
     return data
 
+def _find_entity(cursor, entity_type, norm_identifier):
+    cursor.execute("""
+        SELECT entity_id, additional_info FROM entities 
+        WHERE entity_type = %s AND additional_info ILIKE %s
+    """, (entity_type, f"%{norm_identifier}%"))
+    return cursor.fetchone()
+
+def _lookup_entity(entity_type, norm_identifier):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        return _find_entity(cursor, entity_type, norm_identifier)
+    finally:
+        conn.close()
+
+def prefetch_entity(entity_type, identifier_value):
+    """Start looking up an existing entity in the background; match_entity() picks the result up."""
+    key = (entity_type, normalize_value(identifier_value))
+    if not ENTITY_PREFETCH or not key[1]:
+        return
+    with _prefetch_lock:
+        if key not in _prefetched:
+            _prefetched[key] = _prefetch_pool.submit(_lookup_entity, *key)
+        while len(_prefetched) > PREFETCH_MAX_ENTRIES:
+            # Lookups for pages that were never matched; oldest first.
+            _prefetched.pop(next(iter(_prefetched)))
+
+def prefetch_for_page(page_label, values):
+    """
+    Prefetch the entities a page will be matched on, from identifier values
+    read before extraction finishes (see identifier_extractor.py): EIN fields
+    for businesses, SSN fields for people.
+    """
+    mapping = DOCUMENT_FIELD_MAPPING.get((page_label or "").strip().lower()) or {}
+    for entity_type in ("business", "person"):
+        for field in mapping.get(entity_type, []):
+            if ("ein" in field or "ssn" in field) and values.get(field):
+                prefetch_entity(entity_type, values[field])
+
+def _prefetched_entity(entity_type, norm_identifier):
+    """The prefetched lookup result (row or None), or False if there was no usable prefetch."""
+    with _prefetch_lock:
+        future = _prefetched.pop((entity_type, norm_identifier), None)
+    if future is None:
+        return False
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"[DEBUG] Prefetched entity lookup failed, querying again: {e}")
+        return False
+
 def match_entity(entity_type, identifier_value, additional_info):
     print(f"[DEBUG] Matching entity for type: {entity_type} with identifier: {identifier_value}")
+    norm_identifier = normalize_value(identifier_value)
+    result = _prefetched_entity(entity_type, norm_identifier)
+    if result:
+        print(f"[DEBUG] Found existing entity (ID: {result[0]}) for {entity_type} with identifier: {identifier_value} (prefetched)")
+        return result[0]
     conn = get_db_connection()
     cursor = conn.cursor()
-    norm_identifier = normalize_value(identifier_value)
-    query = """
-        SELECT entity_id, additional_info FROM entities 
-        WHERE entity_type = %s AND additional_info ILIKE %s
-    """
-    cursor.execute(query, (entity_type, f"%{norm_identifier}%"))
-    result = cursor.fetchone()
+    # A prefetch that found nothing is re-checked: the entity may have been created since.
+    result = _find_entity(cursor, entity_type, norm_identifier)
     if result:
         entity_id = result[0]
         print(f"[DEBUG] Found existing entity (ID: {entity_id}) for {entity_type} with identifier: {identifier_value}")
@@ -121,8 +186,9 @@ def match_entity(entity_type, identifier_value, additional_info):
             INSERT INTO entities (entity_type, entity_name, additional_info)
             VALUES (%s, %s, %s) RETURNING entity_id
         """, (entity_type, entity_name, info_json))
-        conn.commit()
         entity_id = cursor.fetchone()[0]
+        bump_table_versions(cursor, ["entities"])
+        conn.commit()
         print(f"[DEBUG] Created new entity (ID: {entity_id}) for {entity_type} with identifier: {identifier_value}")
     conn.close()
     return entity_id
@@ -135,6 +201,7 @@ def create_crosswalk(page_id, entity_id):
         INSERT INTO page_entity_crosswalk (page_id, entity_id)
         VALUES (%s, %s)
     """, (page_id, entity_id))
+    bump_table_versions(cursor, ["page_entity_crosswalk"])
     conn.commit()
     conn.close()
     print(f"[DEBUG] Crosswalk entry created.")
@@ -150,7 +217,7 @@ def match_entities_for_page(page):
         return
 
     # Retrieve extracted data for this page
-    data = fetch_extracted_data(page['preprocessed'], page['page_number'])
+    data = fetch_extracted_data(page['preprocessed'], page['page_number'], page.get('run_id'))
     associations = []
 
     # If cross_page flag is set, merge data from all pages in the file.
@@ -159,13 +226,14 @@ def match_entities_for_page(page):
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT preprocessed, page_number FROM pages WHERE filename = %s
-        """, (page['filename'],))
+            SELECT preprocessed, page_number FROM pages
+            WHERE filename = %s AND (%s IS NULL OR run_id = %s)
+        """, (page['filename'], page.get('run_id'), page.get('run_id')))
         pages_in_file = cursor.fetchall()
         conn.close()
         merged_data = {}
         for preprocessed, page_num in pages_in_file:
-            page_data = fetch_extracted_data(preprocessed, page_num)
+            page_data = fetch_extracted_data(preprocessed, page_num, page.get('run_id'))
             merged_data.update(page_data)
         data = merged_data
         print(f"[DEBUG] Merged data: {data}")
@@ -305,11 +373,20 @@ def match_entities_for_page(page):
         create_crosswalk(page['id'], entity_id)
 
 def match_entities_for_file(filename):
+    with span("entity_match"):
+        _match_entities_for_file(filename)
+
+def _match_entities_for_file(filename):
     print(f"[DEBUG] Matching entities for file: {filename}")
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Assuming the pages table now uses "id" as the primary key
-    cursor.execute("SELECT id, * FROM pages WHERE filename = %s", (filename,))
+    # Assuming the pages table now uses "id" as the primary key.
+    # Only the file's current run is matched; older runs were matched when ingested.
+    cursor.execute("""
+        SELECT p.id, p.* FROM document_runs r
+        JOIN pages p ON p.run_id = r.run_id
+        WHERE r.filename = %s AND r.is_current
+    """, (filename,))
     pages = cursor.fetchall()
     col_names = [desc[0] for desc in cursor.description]
     conn.close()
@@ -0,0 +1,154 @@
+"""
+Model tiers for Gemini extraction, with validation-driven escalation.
+
+Extraction tries the first (cheapest) model of a page_label's tiers. The
+result is validated against the schema's checks; the failing fields Gemini
+returned are asked again of the next tier, and so on, so a stronger model
+only sees the pages and fields the cheap one got wrong:
+
+    required        fields every page of the schema has (business name, EIN, tax year...)
+    format          EIN, SSN last-4, tax year and amount fields that don't parse (identifier_extractor.normalize)
+    not on page     EIN / SSN last-4 / tax year values the page's pattern matches contradict
+    balance         Schedule L total assets vs total liabilities and equity, beginning and end
+    gross profit    gross receipts minus cost of goods sold vs gross profit
+
+Zonal and pattern values are validated with the rest (a balance check needs
+both sides) but never escalated. tier_stats keeps per-model call latency,
+tokens and escalation rate for /extraction/tier-stats; each call_info row
+also records its tier, latency and escalated field count
+(migrations/017_call_info_tier.sql).
+
+Environment:
+    EXTRACTION_TIERS            comma-separated models, cheapest first (default gemini-2.0-flash-lite,gemini-2.0-flash)
+    EXTRACTION_TIERS_<label>    tiers for one page_label, e.g. EXTRACTION_TIERS_1040_p1=gemini-2.0-flash
+    EXTRACTION_ESCALATE         fields / page: escalate only failing fields, or every Gemini field of the page (default fields)
+    BALANCE_TOLERANCE           max difference, in dollars, between totals that should agree (default 1)
+"""
+import os
+import threading
+from decimal import Decimal
+
+from identifier_extractor import FIELD_KINDS, FILL_KINDS, normalize
+
+EXTRACTION_TIERS = [m.strip() for m in os.environ.get(
+    "EXTRACTION_TIERS", "gemini-2.0-flash-lite,gemini-2.0-flash").split(",") if m.strip()]
+EXTRACTION_ESCALATE = os.environ.get("EXTRACTION_ESCALATE", "fields").lower()
+BALANCE_TOLERANCE = Decimal(os.environ.get("BALANCE_TOLERANCE", "1"))
+
+# Schema class -> fields every page of that type has.
+REQUIRED_FIELDS = {
+    "BalanceSheet": ("beginning_total_assets", "ending_total_assets"),
+    "F1120S_p1": ("tax_year", "business_name", "ein"),
+    "F1120_p1": ("tax_year", "business_name", "ein"),
+    "F1065_p1": ("tax_year", "business_name", "ein"),
+    "F1120S_k1": ("tax_year", "business_ein", "business_name"),
+    "F1065_k1": ("tax_year", "business_ein", "business_name"),
+    "F1040_p1": ("tax_year", "primary_first_name", "primary_last_name"),
+    "F1040_sch_c": ("tax_year", "owner_name"),
+    "Acord25": ("certificate_date", "named_insured_name"),
+    "Acord28": ("certificate_date", "named_insured_name"),
+    "DriversLicense": ("first_name", "last_name", "exp_date"),
+    "Passport": ("first_name", "last_name", "exp_date"),
+}
+
+# Kinds whose unparseable values fail validation.
+FORMAT_KINDS = FILL_KINDS + ("amount",)
+
+# (left, right) totals that must agree, for schemas that have both.
+BALANCE_PAIRS = (
+    ("beginning_total_assets", "beginning_total_liabilities"),
+    ("ending_total_assets", "ending_total_liabilities"),
+)
+
+
+def tiers_for(page_label):
+    """Models to try for a page_label, cheapest first."""
+    override = os.environ.get(f"EXTRACTION_TIERS_{page_label}")
+    if override:
+        return [m.strip() for m in override.split(",") if m.strip()]
+    return list(EXTRACTION_TIERS)
+
+
+def _amount(value):
+    normalized = normalize("amount", value)
+    return Decimal(normalized) if normalized is not None else None
+
+
+def validate(model, values, identifiers=None):
+    """
+    {field: reason} for the fields of `values` (a page's values for schema
+    class `model`) that fail its checks. `identifiers` is the page's
+    identifier_extractor.PageIdentifiers, if scanned.
+    """
+    failing = {}
+    for key in REQUIRED_FIELDS.get(model.__name__, ()):
+        if key in model.model_fields and not str(values.get(key) or "").strip():
+            failing[key] = "required"
+    for key, value in values.items():
+        if key not in FIELD_KINDS or key in failing or not str(value or "").strip():
+            continue
+        kind = FIELD_KINDS[key][0]
+        # Dates are written too many ways to escalate on format alone.
+        if kind not in FORMAT_KINDS:
+            continue
+        if normalize(kind, value) is None:
+            failing[key] = "format"
+        elif kind in FILL_KINDS and identifiers is not None and identifiers.cross_check(key, value) == "mismatch":
+            failing[key] = "not on page"
+    for left, right in BALANCE_PAIRS:
+        a, b = _amount(values.get(left)), _amount(values.get(right))
+        if a is not None and b is not None and abs(a - b) > BALANCE_TOLERANCE:
+            failing.setdefault(left, "balance")
+            failing.setdefault(right, "balance")
+    revenue, cogs, profit = (_amount(values.get(k)) for k in ("gross_revenue", "cost_of_goods_sold", "gross_profit"))
+    if None not in (revenue, cogs, profit) and abs(revenue - cogs - profit) > BALANCE_TOLERANCE:
+        for key in ("gross_revenue", "cost_of_goods_sold", "gross_profit"):
+            failing.setdefault(key, "gross profit")
+    return failing
+
+
+def to_escalate(failing, gemini_fields):
+    """The Gemini fields to ask the next tier for, given validate() failures."""
+    escalate = [key for key in gemini_fields if key in failing]
+    if escalate and EXTRACTION_ESCALATE == "page":
+        return list(gemini_fields)
+    return escalate
+
+
+class TierStats:
+    """Per-model extraction call latency, tokens and escalation counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model_id, latency_s, tokens, escalated_fields, failed=False):
+        with self._lock:
+            stats = self._models.setdefault(model_id, {
+                "calls": 0, "failed_calls": 0, "latency_s": 0.0, "max_latency_s": 0.0,
+                "tokens": 0, "escalated_calls": 0, "escalated_fields": 0,
+            })
+            stats["calls"] += 1
+            stats["failed_calls"] += int(failed)
+            stats["latency_s"] += latency_s
+            stats["max_latency_s"] = max(stats["max_latency_s"], latency_s)
+            stats["tokens"] += int(tokens or 0)
+            stats["escalated_calls"] += int(escalated_fields > 0)
+            stats["escalated_fields"] += escalated_fields
+
+    def report(self):
+        with self._lock:
+            models = {model_id: dict(stats) for model_id, stats in self._models.items()}
+        for stats in models.values():
+            calls = stats["calls"]
+            stats["mean_latency_s"] = stats["latency_s"] / calls if calls else 0.0
+            stats["mean_tokens"] = stats["tokens"] / calls if calls else 0.0
+            stats["escalation_rate"] = stats["escalated_calls"] / calls if calls else 0.0
+        return models
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+tier_stats = TierStats()
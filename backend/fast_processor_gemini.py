@@ -14,14 +14,37 @@ import time
 from google import genai
 from google.cloud import vision
 from gemini_models import get_model
+from pydantic import create_model
 from io import BytesIO  # NEW: for in-memory file operations
-from s3_utils import upload_fileobj_to_s3, download_fileobj_from_s3
+from upload_queue import UploadQueue, UploadError
+from image_pyramid import build_renditions
+from text_layer import open_document, page_text
+from page_triage import triage_page, NEAR_EMPTY_PAGE, SKIP_LABELS, TRIAGE_LABELS
+from phash_index import DuplicateFinder, page_hashes
+import zonal_extractor
+import combined_classify
+import extraction_policy
+from spatial_index import GridIndex, load_index
+from identifier_extractor import scan_page, IDENTIFIER_MIN_CONFIDENCE, FILL_KINDS
+from entity_matcher import prefetch_for_page
+from roi_crop import plan_regions, crop_regions
+from single_flight import file_sha256
+from storage import cached_page_path, get_page_cache
+from tracing import span, start_trace
 import mimetypes
+from functools import lru_cache
 
-# Load models for fallback classification
-text_classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-image_model = CLIPModel.from_pretrained("zer0int/CLIP-GmP-ViT-L-14")
-image_processor = CLIPProcessor.from_pretrained("zer0int/CLIP-GmP-ViT-L-14")
+# Models for fallback classification are loaded on first use, so importing this
+# module (API startup, benchmarks) doesn't pay for BART and CLIP up front.
+@lru_cache(maxsize=None)
+def get_text_classifier():
+    return pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+
+@lru_cache(maxsize=None)
+def get_image_model():
+    image_model = CLIPModel.from_pretrained("zer0int/CLIP-GmP-ViT-L-14")
+    image_processor = CLIPProcessor.from_pretrained("zer0int/CLIP-GmP-ViT-L-14")
+    return image_model, image_processor
 
 # For classification using template matching
 template_db_path = "template_keywords.pkl"
@@ -44,159 +67,214 @@ with open(template_db_path, "rb") as f:
 stop_words = set(stopwords.words("english"))
 
 class PDFHandler:
-    def __init__(self, pdf_path=None):
+    def __init__(self, pdf_path=None, content_hash=None):
         self.pdf_path = pdf_path
+        # Page images live under <stem>/<content hash prefix>/ so two uploads
+        # with the same filename but different content never share S3 objects
+        # or PageCache entries.
+        self.content_hash = content_hash
         # Removed PaddleOCR initialization since we now use Cloud Vision
+        # Preprocessed pages upload in the background; page_images keeps the
+        # PNG bytes so classification/extraction don't wait on S3.
+        self.uploads = UploadQueue()
+        self.page_images = {}
+        # Pages of other files with the same text layer and image hash (see
+        # phash_index.py), keyed by preprocessed S3 key; their label and
+        # extraction are reused.
+        self.duplicates = DuplicateFinder(os.path.basename(pdf_path))
+        self.reused = {}
         self.df_pages = self.convert_pages_to_img()
 
     def convert_pages_to_img(self, output_dir="debug_images"):
         """
         Process each page of a PDF (or a single image file) using the Cloud Vision API for OCR.
-        Instead of saving images locally, the preprocessed image is uploaded to S3.
+        Instead of saving images locally, the preprocessed image is queued for upload
+        to S3 (see self.uploads; flush before storing rows that reference the keys).
         Returns a DataFrame with the following columns:
-          - filename, preprocessed, page_number, image_width, image_height, lines, words,
-            bboxes, normalized_bboxes, tokens, words_for_clf, processing_time
+          - filename, preprocessed, page_number, image_width, image_height, ocr_source, lines, words,
+            image_levels, bboxes, normalized_bboxes, tokens, words_for_clf, render_time, ocr_time,
+            preprocess_time, processing_time
         """
-        start_time = time.time()
         classification_results = []
 
         # If the file is an image rather than a PDF:
         if self.pdf_path.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image = Image.open(self.pdf_path)
-            image_width, image_height = image.size
+            render_start = time.perf_counter()
+            with span("render", page=1):
+                image = Image.open(self.pdf_path)
+                image.load()
+            render_time = time.perf_counter() - render_start
+            classification_results.append(self.process_page(image, 1, render_time))
+
+        else:
+            print(os.getenv('POPPLER_PATH'))
+            # Directly convert PDF pages to images
+            render_start = time.perf_counter()
+            with span("render"):
+                pages = convert_from_path(self.pdf_path, dpi=300, poppler_path=os.getenv('POPPLER_PATH'))
+            # pdf2image renders the whole document in one call; attribute the time evenly.
+            render_time = (time.perf_counter() - render_start) / max(1, len(pages))
+            # Pages with a usable embedded text layer skip Cloud Vision (see text_layer.py).
+            doc = open_document(self.pdf_path)
+            try:
+                for page_num, image in enumerate(tqdm(pages, desc='converting pages...'), start=1):
+                    pdf_page = doc[page_num - 1] if doc is not None and page_num <= len(doc) else None
+                    classification_results.append(self.process_page(image, page_num, render_time, pdf_page))
+            finally:
+                if doc is not None:
+                    doc.close()
+
+        df_pages = pd.DataFrame(classification_results)
+        # Keep 64-bit hashes as Python ints; a float64 column (NaN for pages without one) would round them.
+        df_pages['phash'] = pd.Series([r['phash'] for r in classification_results], dtype=object)
+        # Per-page time from render to upload (previously the whole document's
+        # time was repeated on every page).
+        df_pages['processing_time'] = df_pages['render_time'] + df_pages['ocr_time'] + df_pages['preprocess_time']
+        return df_pages
 
-            # Convert image to bytes for Cloud Vision
+    def process_page(self, image, page_num, render_time=0.0, pdf_page=None):
+        """
+        OCR a single rendered page, denoise it and queue the preprocessed image
+        for upload to S3. Words and boxes come from the PDF's text layer when
+        `pdf_page` (a PyMuPDF page) has a usable one, otherwise from Cloud
+        Vision; ocr_source records which. Pages without a text layer are
+        triaged first (see page_triage.py): blank and separator pages skip OCR
+        and denoising. Text-layer pages are looked up by perceptual hash, and
+        a verified duplicate from another file with the same words lends its
+        label and extraction; scanned pages are always OCRed (see
+        phash_index.py). Returns the page record for df_pages.
+        """
+        image_width, image_height = image.size
+        fn = os.path.basename(self.pdf_path)
+        s3_prefix = f"debug_images/{os.path.splitext(fn)[0]}"
+        if self.content_hash:
+            s3_prefix = f"{s3_prefix}/{self.content_hash[:16]}"
+        s3_object_key = f"{s3_prefix}/page_{page_num}/preprocessed.png"
+
+        ocr_start = time.perf_counter()
+        text_layer = None
+        if pdf_page is not None:
+            with span("text_layer", page=page_num):
+                text_layer = page_text(pdf_page, image_width, image_height)
+        triage_label, ink_density = None, None
+        if text_layer is None:
+            with span("triage", page=page_num):
+                triage_label, ink_density = triage_page(image)
+        phash, phash_fine, reused = None, None, None
+        if triage_label not in TRIAGE_LABELS:
+            with span("phash", page=page_num):
+                phash, phash_fine = page_hashes(image)
+                if text_layer is not None:
+                    reused = self.duplicates.find(phash, phash_fine, image_width, image_height,
+                                                  words=text_layer["words"])
+            if reused is not None:
+                self.reused[s3_object_key] = reused
+        if text_layer is not None:
+            ocr_source = "text_layer"
+            lines, words = text_layer["lines"], text_layer["words"]
+            bboxes, normalized_bboxes = text_layer["bboxes"], text_layer["normalized_bboxes"]
+        elif triage_label in SKIP_LABELS:
+            ocr_source = "none"
+            lines, words, bboxes, normalized_bboxes = [], [], [], []
+        else:
+            ocr_source = "vision"
+            lines, words, bboxes, normalized_bboxes = self.vision_ocr(image, page_num)
+        word_index = GridIndex(normalized_bboxes).to_bytes() if len(words) else None
+        tokens = [word.lower() for word in words]
+        words_for_clf = set([word for word in tokens if word not in stop_words])
+        ocr_time = time.perf_counter() - ocr_start
+
+        # Preprocess the image (denoising) and queue the S3 upload
+        preprocess_start = time.perf_counter()
+        with span("denoise", page=page_num):
+            if triage_label in SKIP_LABELS:
+                # Nothing to read on the page; grayscale is enough for the viewer.
+                pp = image.convert("L")
+            else:
+                image_np = np.array(image)
+                denoised, _ = self.preprocess_image(image_np)
+                pp = Image.fromarray(denoised)
+            buffer_pp = BytesIO()
+            pp.save(buffer_pp, format="PNG")
+            pp_bytes = buffer_pp.getvalue()
+        self.uploads.submit(pp_bytes, s3_object_key, page=page_num)
+        self.page_images[s3_object_key] = pp_bytes
+        # Thumbnail / preview (and DZI tiles) for the viewer, next to preprocessed.png.
+        with span("pyramid", page=page_num):
+            image_levels, renditions = build_renditions(pp, s3_object_key)
+        for key, data in renditions:
+            self.uploads.submit(data, key, page=page_num)
+        # Seed the local page cache so later reads (re-runs, the API) don't re-download it.
+        page_cache = get_page_cache()
+        if page_cache is not None:
+            page_cache.put(s3_object_key, pp_bytes)
+        preprocess_time = time.perf_counter() - preprocess_start
+
+        return {
+            "filename": fn,
+            "preprocessed": s3_object_key,  # S3 reference for the preprocessed image
+            "image_levels": image_levels,  # renditions available next to it (see image_pyramid.py)
+            "page_number": page_num,
+            "image_width": image_width,
+            "image_height": image_height,
+            "ocr_source": ocr_source,  # "text_layer", "vision" or "none" (skipped by triage)
+            "triage_label": triage_label,  # blank_page / separator_page / near_empty_page, or None
+            "ink_density": ink_density,
+            "phash": phash,  # 64-bit dHash (BIGINT) and 1024-bit verification hash, see phash_index.py
+            "phash_fine": phash_fine,
+            "reused_from": reused["page"]["preprocessed"] if reused is not None else None,
+            "lines": lines,
+            "words": words,
+            "bboxes": bboxes,
+            "normalized_bboxes": normalized_bboxes,
+            "word_index": word_index,  # spatial_index.GridIndex over normalized_bboxes
+            "tokens": tokens,
+            "words_for_clf": words_for_clf,
+            "render_time": render_time,
+            "ocr_time": ocr_time,
+            "preprocess_time": preprocess_time,
+        }
+
+    def vision_ocr(self, image, page_num):
+        """
+        OCR a rendered page with Cloud Vision.
+        Returns (lines, words, bboxes, normalized_bboxes) in the image's pixel coordinates.
+        """
+        image_width, image_height = image.size
+        with span("encode", page=page_num):
             buffer = BytesIO()
             image.save(buffer, format="PNG")
             buffer.seek(0)
             image_bytes = buffer.getvalue()
 
-            # Perform document text detection using Cloud Vision API
+        # Perform OCR using Cloud Vision API
+        with span("ocr", page=page_num, image_bytes=len(image_bytes)):
             client = vision.ImageAnnotatorClient()
             vision_image = vision.Image(content=image_bytes)
             response = client.document_text_detection(image=vision_image)
-            if response.error.message:
-                raise Exception(response.error.message)
-            annotation = response.full_text_annotation
-            text_annotations = response.text_annotations
-            words = [s.description for s in text_annotations[1:]] if len(text_annotations) > 1 else []
-
-            # Extract bounding boxes from text annotations (skip the first element)
-            bboxes = []
-            for s in text_annotations[1:]:
-                vertices = s.bounding_poly.vertices
-                x1 = min(vertex.x for vertex in vertices)
-                y1 = min(vertex.y for vertex in vertices)
-                x2 = max(vertex.x for vertex in vertices)
-                y2 = max(vertex.y for vertex in vertices)
-                bboxes.append([x1, y1, x2, y2])
-            normalized_bboxes = [
-                [bbox[0] / image_width, bbox[1] / image_height, bbox[2] / image_width, bbox[3] / image_height]
-                for bbox in bboxes
-            ]
-
-            # Get lines by splitting the full text annotation (if available)
-            lines = annotation.text.splitlines() if annotation.text else []
-
-            tokens = [word.lower() for word in words]
-            words_for_clf = set([word for word in tokens if word not in stop_words])
-
-            # Preprocess the image (denoising) and upload to S3
-            image_np = np.array(image)
-            denoised, _ = self.preprocess_image(image_np)
-            pp = Image.fromarray(denoised)
-            fn = os.path.basename(self.pdf_path)
-            buffer_pp = BytesIO()
-            pp.save(buffer_pp, format="PNG")
-            buffer_pp.seek(0)
-            s3_object_key = f"debug_images/{os.path.splitext(fn)[0]}/page_1/preprocessed.png"
-            upload_fileobj_to_s3(buffer_pp, s3_object_key)
-
-            classification_results.append({
-                "filename": fn,
-                "preprocessed": s3_object_key,  # S3 reference
-                "page_number": 1,
-                "image_width": image_width,
-                "image_height": image_height,
-                "lines": lines,
-                "words": words,
-                "bboxes": bboxes,
-                "normalized_bboxes": normalized_bboxes,
-                "tokens": tokens,
-                "words_for_clf": words_for_clf
-            })
-
-        else:
-            print(os.getenv('POPPLER_PATH'))
-            # Directly convert PDF pages to images
-            pages = convert_from_path(self.pdf_path, dpi=300, poppler_path=os.getenv('POPPLER_PATH'))
-            for page_num, image in enumerate(tqdm(pages, desc='converting pages...'), start=1):
-                image_width, image_height = image.size
-
-                # Convert image to bytes for Cloud Vision
-                buffer = BytesIO()
-                image.save(buffer, format="PNG")
-                buffer.seek(0)
-                image_bytes = buffer.getvalue()
-
-                # Perform OCR using Cloud Vision API
-                client = vision.ImageAnnotatorClient()
-                vision_image = vision.Image(content=image_bytes)
-                response = client.document_text_detection(image=vision_image)
-                if response.error.message:
-                    raise Exception(response.error.message)
-                annotation = response.full_text_annotation
-                text_annotations = response.text_annotations
-                words = [s.description for s in text_annotations[1:]] if len(text_annotations) > 1 else []
-
-                # Get bounding boxes from text annotations (skipping the first element)
-                bboxes = []
-                for s in text_annotations[1:]:
-                    vertices = s.bounding_poly.vertices
-                    x1 = min(vertex.x for vertex in vertices)
-                    y1 = min(vertex.y for vertex in vertices)
-                    x2 = max(vertex.x for vertex in vertices)
-                    y2 = max(vertex.y for vertex in vertices)
-                    bboxes.append([x1, y1, x2, y2])
-                normalized_bboxes = [
-                    [bbox[0] / image_width, bbox[1] / image_height, bbox[2] / image_width, bbox[3] / image_height]
-                    for bbox in bboxes
-                ]
-
-                lines = annotation.text.splitlines() if annotation.text else []
-                tokens = [word.lower() for word in words]
-                words_for_clf = set([word for word in tokens if word not in stop_words])
-
-                # Preprocess the image and upload to S3
-                image_np = np.array(image)
-                denoised, _ = self.preprocess_image(image_np)
-                pp = Image.fromarray(denoised)
-                fn = os.path.basename(self.pdf_path)
-                buffer_pp = BytesIO()
-                pp.save(buffer_pp, format="PNG")
-                buffer_pp.seek(0)
-                s3_object_key = f"debug_images/{os.path.splitext(fn)[0]}/page_{page_num}/preprocessed.png"
-                upload_fileobj_to_s3(buffer_pp, s3_object_key)
-
-                classification_results.append({
-                    "filename": fn,
-                    "preprocessed": s3_object_key,  # S3 reference for the preprocessed image
-                    "page_number": page_num,
-                    "image_width": image_width,
-                    "image_height": image_height,
-                    "lines": lines,
-                    "words": words,
-                    "bboxes": bboxes,
-                    "normalized_bboxes": normalized_bboxes,
-                    "tokens": tokens,
-                    "words_for_clf": words_for_clf
-                })
-
-        df_pages = pd.DataFrame(classification_results)
-        end_time = time.time()
-        processing_time = end_time - start_time
-        df_pages['processing_time'] = processing_time
-        return df_pages
+        if response.error.message:
+            raise Exception(response.error.message)
+        annotation = response.full_text_annotation
+        text_annotations = response.text_annotations
+        words = [s.description for s in text_annotations[1:]] if len(text_annotations) > 1 else []
+
+        # Get bounding boxes from text annotations (skipping the first element)
+        bboxes = []
+        for s in text_annotations[1:]:
+            vertices = s.bounding_poly.vertices
+            x1 = min(vertex.x for vertex in vertices)
+            y1 = min(vertex.y for vertex in vertices)
+            x2 = max(vertex.x for vertex in vertices)
+            y2 = max(vertex.y for vertex in vertices)
+            bboxes.append([x1, y1, x2, y2])
+        normalized_bboxes = [
+            [bbox[0] / image_width, bbox[1] / image_height, bbox[2] / image_width, bbox[3] / image_height]
+            for bbox in bboxes
+        ]
+
+        # Get lines by splitting the full text annotation (if available)
+        lines = annotation.text.splitlines() if annotation.text else []
+        return lines, words, bboxes, normalized_bboxes
 
     def preprocess_image(self, image, output_dir="debug_images"):
         """
@@ -223,23 +301,31 @@ class PDFHandler:
 
 
 class ClassifyExtract:
-    def __init__(self, row):
+    def __init__(self, row, image_bytes=None):
         self.fallback_labels = fallback_labels
+        # In-memory preprocessed image, when the caller still has it (its S3 upload may be in flight).
+        self.image_bytes = image_bytes
         self.filename = row['filename']
+        self.page_number = row.get('page_number')
         self.image_path = row['preprocessed']
         self.image_width, self.image_height = row['image_width'], row['image_height']
         self.lines = row['lines']
         self.words = row['words']
         self.bboxes = row['bboxes'] 
         self.normalized_bboxes = row['normalized_bboxes']
+        self.word_index = row.get('word_index')
         self.tokens = row['tokens'] 
         self.words_for_clf = row['words_for_clf']
+        self.triage_label = row.get('triage_label')
+        # (info, values) of a combined classify-and-extract call, see classify_and_extract().
+        self.combined = None
         self.page_label, self.page_score, self.page_confidence_scores, self.page_all_scores, self.clf_type = self.classify_document_with_confidence()
         self.k = self.load_label_info()
         self.keys = [t['key'] for t in self.k[self.page_label]]
         self.queries = [t['question'] for t in self.k[self.page_label]]
         self.coords = [t['target_coords'] for t in self.k[self.page_label]]
         self.bbox_draw_list = []
+        self.zonal_found = {}
         # self.model_for_extractor = self.get_model
 
     def get_device(self):
@@ -296,7 +382,7 @@ class ClassifyExtract:
         """
         Classify document using text-based zero-shot classification.
         """
-        result = text_classifier(text, candidate_labels=labels)
+        result = get_text_classifier()(text, candidate_labels=labels)
         all_scores = result["scores"]
         best_label, best_score = result["labels"][0], result["scores"][0]
         best_label = self.fallback_labels[best_label]
@@ -309,16 +395,14 @@ class ClassifyExtract:
         """
         Classify document using image-based zero-shot classification.
         """
-        import os
-        from s3_utils import download_fileobj_from_s3
-
-        # Check if the file exists locally; if not, download it from S3.
-        if not os.path.exists(image_path):
-            file_obj = download_fileobj_from_s3(image_path)
-            image = Image.open(file_obj)
+        # Local file if present, else a cached copy of the S3 object.
+        if self.image_bytes is not None and image_path == self.image_path:
+            image = Image.open(BytesIO(self.image_bytes))
         else:
-            image = Image.open(image_path)
+            with span("s3_download", page=self.page_number):
+                image = Image.open(cached_page_path(image_path))
         
+        image_model, image_processor = get_image_model()
         inputs = image_processor(text=labels, images=image, return_tensors="pt", padding=True)
         outputs = image_model(**inputs)
         probs = outputs.logits_per_image.softmax(dim=1)  # Image-text similarity scores
@@ -391,16 +475,29 @@ class ClassifyExtract:
         and fall back to image-based classification if needed.
         """
         # Step 1: Keyword-based classification
-        kw_result = self.classify_using_keywords()
+        with span("classify_keywords", page=self.page_number):
+            kw_result = self.classify_using_keywords()
         if kw_result:
             best_label, best_score, confidence_scores, all_scores, clf_type = kw_result
             return best_label, best_score, confidence_scores, all_scores, clf_type
 
+        # Near-empty pages (page_triage.py) aren't worth the model fallbacks.
+        if self.triage_label == NEAR_EMPTY_PAGE:
+            return NEAR_EMPTY_PAGE, 0, None, None, 'triage'
+
+        # Combined mode: one Gemini call labels and extracts the page, no local models.
+        if combined_classify.COMBINED_CLASSIFY:
+            with span("classify_combined", page=self.page_number):
+                combined_result = self.classify_and_extract()
+            if combined_result:
+                return combined_result
+
         # Step 2: Text-based classification
         # Use first 100 characters for classification
         words_from_set = list(self.words_for_clf)
         words_for_txt = ' '.join(words_from_set)
-        txt_result = self.classify_using_text(text=words_for_txt, labels=list(self.fallback_labels.keys()))
+        with span("classify_text", page=self.page_number):
+            txt_result = self.classify_using_text(text=words_for_txt, labels=list(self.fallback_labels.keys()))
         if txt_result:
             best_label, best_score, confidence_scores, all_scores, clf_type = txt_result
             return best_label, best_score, confidence_scores, all_scores, clf_type
@@ -411,7 +508,8 @@ class ClassifyExtract:
             return 'unknown_text_type', 0, None, None, None
         
         # Step 3: Fallback to image-based classification
-        img_result = self.classify_using_image(image_path=self.image_path, labels=list(self.fallback_labels.keys()))
+        with span("classify_image", page=self.page_number):
+            img_result = self.classify_using_image(image_path=self.image_path, labels=list(self.fallback_labels.keys()))
         if img_result:
             best_label, best_score, confidence_scores, all_scores, clf_type = img_result
             return best_label, best_score, confidence_scores, all_scores, clf_type
@@ -419,63 +517,247 @@ class ClassifyExtract:
         # Step 4: Final fallback
         return 'unknown', 0, None, None, None
     
-    def process_image(self):
-        model_use = get_model(self.page_label)
-        api_key = os.environ.get("GOOGLE_GENAI_API_KEY")
-        client = genai.Client(api_key=api_key)
-        model_id = "gemini-2.0-flash"
-        max_retries = 5
-        backoff_factor = 2
-
-        if os.path.exists(self.image_path):
-            file_to_upload = self.image_path
+    def classify_and_extract(self):
+        """
+        Label the page and extract its fields in one Gemini call (see
+        combined_classify). The values are kept for process_image(). Returns
+        a classify_document_with_confidence() result, or None if the call
+        failed so the local models run instead.
+        """
+        prompt = (
+            "Classify this document page, then extract the structured data of its type only. "
+            "If SPII is requested, only return partial data. "
+            "If a field exists but contains no value, return an empty string."
+        )
+        try:
+            result = self.generate([self.page_upload()], prompt, combined_classify.combined_model(),
+                                   {'crop_mode': 'full', 'crop_regions': 1, 'crop_area': 1.0})
+        except Exception as e:
+            print(f"Combined classify-and-extract failed, using the local classifiers: {e}")
+            return None
+        if result is None:
+            return None
+        info, parsed = result
+        label, confidence, values = combined_classify.unpack(parsed)
+        self.combined = (info, values)
+        return label, confidence, None, None, 'gemini_combined'
+
+    def zonal_extract(self, model_use):
+        """
+        Values of the page's text fields read from the OCR geometry (see
+        zonal_extractor), keeping only those at or above ZONAL_MIN_CONFIDENCE.
+        """
+        self.zonal_found = {}
+        if not zonal_extractor.ZONAL_EXTRACTION or model_use is None:
+            return {}
+        fields = {name for name, field in model_use.model_fields.items() if field.annotation is str}
+        with span("zonal_extract", page=self.page_number) as sp:
+            try:
+                found = zonal_extractor.extract_fields(self.page_label, self.words, self.bboxes,
+                                                       self.normalized_bboxes, self.k, fields,
+                                                       index=load_index(self.word_index, self.normalized_bboxes))
+            except Exception as e:
+                print(f"Zonal extraction failed, extracting every field with Gemini: {e}")
+                return {}
+            self.zonal_found = found
+            confident = {key: v for key, v in found.items() if v['confidence'] >= zonal_extractor.ZONAL_MIN_CONFIDENCE}
+            sp.set(fields=len(fields), filled=len(confident))
+        scale = [self.image_width, self.image_height, self.image_width, self.image_height]
+        self.bbox_draw_list = [[c * s for c, s in zip(v['value_bbox'], scale)]
+                               for v in confident.values() if v['value_bbox']]
+        return confident
+
+    def extracted_frame(self, model_use, zonal, parsed, identifiers=None):
+        """
+        extracted2 rows in schema field order: zonal/pattern values first
+        choice, Gemini for the rest. Gemini values of identifier fields are
+        cross-checked against the page's pattern matches.
+        """
+        keys, values, sources, confidences, checks = [], [], [], [], []
+        for name in model_use.model_fields:
+            if name in zonal:
+                keys.append(name)
+                values.append(zonal[name]['value'])
+                sources.append(zonal[name].get('source', 'zonal'))
+                confidences.append(zonal[name]['confidence'])
+                checks.append(None)
+            elif name in parsed:
+                keys.append(name)
+                values.append(parsed[name])
+                sources.append('gemini')
+                confidences.append(None)
+                checks.append(identifiers.cross_check(name, parsed[name]) if identifiers is not None else None)
+                if checks[-1] == 'mismatch':
+                    print(f"Cross-check mismatch on page {self.page_number}: {name}={parsed[name]!r} not found on the page")
+        return pd.DataFrame({
+            'filename': self.image_path,
+            'key': keys,
+            'value': values,
+            'source': sources,
+            'confidence': confidences,
+            'cross_check': checks,
+        })
+
+    def process_image(self, identifiers=None):
+        """
+        Extract the page's schema fields: zonal values and confident pattern
+        values (`identifiers`, an identifier_extractor.PageIdentifiers) first,
+        then Gemini for the remaining fields, or the values of the combined
+        classify call if there was one. Gemini fields failing validation are
+        escalated to the next model tier. Returns (info, extracted); info
+        (one call_info row per call) is None when no model call was needed.
+        """
+        full_model = get_model(self.page_label)
+        zonal = self.zonal_extract(full_model)
+        if identifiers is not None:
+            zonal = identifiers.merge(zonal, [name for name, field in full_model.model_fields.items()
+                                              if field.annotation is str])
+        if self.combined is not None and self.combined[1] is not None:
+            # The combined classify call already returned the values.
+            info, values = self.combined
+            return info, self.extracted_frame(full_model, zonal, values, identifiers)
+        remaining = [name for name in full_model.model_fields if name not in zonal]
+        if not remaining:
+            # Every field was read from the page layout: no model call.
+            return None, self.extracted_frame(full_model, zonal, {}, identifiers)
+        # Send only the regions holding the remaining fields when they're known (see roi_crop.py).
+        upload = self.page_upload()
+        uploads = [upload]
+        crop_info = {'crop_mode': 'full', 'crop_regions': 1, 'crop_area': 1.0}
+        regions = plan_regions(self.page_label, remaining, self.k, self.zonal_found)
+        if regions:
+            with span("roi_crop", page=self.page_number, regions=len(regions)):
+                if hasattr(upload[0], "seek"):
+                    upload[0].seek(0)
+                with Image.open(upload[0]) as page_image:
+                    crops = crop_regions(page_image, regions)
+            uploads = [(BytesIO(crop), f"{upload[1]}_roi{i}", "image/png") for i, crop in enumerate(crops)]
+            crop_info = {
+                'crop_mode': 'roi',
+                'crop_regions': len(regions),
+                'crop_area': round(sum((r[2] - r[0]) * (r[3] - r[1]) for r in regions), 4),
+            }
+        prompt = (
+            "Extract the structured data from this document. "
+            "If SPII is requested, only return partial data. "
+            "If a field exists but contains no value, return an empty string."
+        )
+        if crop_info['crop_mode'] == 'roi':
+            prompt += " The images are crops of the regions of the page that hold the requested fields."
+        # Cheapest model first; fields failing validation go to the next tier (see extraction_policy.py).
+        tiers = extraction_policy.tiers_for(self.page_label)
+        zonal_values = {key: v['value'] for key, v in zonal.items()}
+        infos, parsed, ask = [], {}, remaining
+        for tier, model_id in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            model_use = full_model
+            if len(ask) < len(full_model.model_fields):
+                suffix = "Remaining" if tier == 0 else "Escalated"
+                model_use = create_model(
+                    f"{full_model.__name__}{suffix}",
+                    __doc__=full_model.__doc__,
+                    **{name: (full_model.model_fields[name].annotation, full_model.model_fields[name])
+                       for name in ask},
+                )
+            start = time.perf_counter()
+            try:
+                result = self.generate(uploads, prompt, model_use, dict(crop_info, tier=tier), model_id=model_id)
+            except genai.errors.ClientError as e:
+                # A tier that isn't available (unknown model, no quota) passes its fields on.
+                if last:
+                    raise e
+                print(f"Extraction with {model_id} failed, escalating: {e}")
+                result = None
+            latency = time.perf_counter() - start
+            if result is None:
+                extraction_policy.tier_stats.record(model_id, latency, 0, 0 if last else len(ask), failed=True)
+                continue
+            info, response = result
+            parsed.update(response.model_dump())
+            escalate = []
+            if not last:
+                failing = extraction_policy.validate(full_model, {**parsed, **zonal_values}, identifiers)
+                escalate = extraction_policy.to_escalate(failing, ask)
+                if escalate:
+                    print(f"Escalating {len(escalate)} field(s) of page {self.page_number} from {model_id}: "
+                          + ", ".join(f"{key} ({failing[key]})" for key in escalate))
+            info['latency_ms'] = round(latency * 1000, 1)
+            info['escalated_fields'] = len(escalate)
+            infos.append(info)
+            tokens = info['total_token_count'].fillna(0).iloc[0] if 'total_token_count' in info else 0
+            extraction_policy.tier_stats.record(model_id, latency, tokens, len(escalate))
+            if not escalate:
+                break
+            ask = escalate
+        if not infos:
+            # Every tier gave up: keep the zonal and pattern values, the Gemini fields stay missing.
+            print(f"No extraction tier answered for page {self.page_number}; keeping layout and pattern values only.")
+            return None, self.extracted_frame(full_model, zonal, parsed, identifiers)
+        return pd.concat(infos), self.extracted_frame(full_model, zonal, parsed, identifiers)
+
+    def page_upload(self):
+        """(file, display name, MIME type) of the page image, for generate()."""
+        if self.image_bytes is not None:
+            file_to_upload = BytesIO(self.image_bytes)
         else:
-            file_to_upload = download_fileobj_from_s3(self.image_path)
+            with span("s3_download", page=self.page_number):
+                file_to_upload = cached_page_path(self.image_path)
         
         # Determine the MIME type based on the file extension of self.image_path.
         mime_type, _ = mimetypes.guess_type(self.image_path)
         if not mime_type:
             mime_type = "application/octet-stream"
+        return file_to_upload, os.path.basename(self.image_path).split('.')[0], mime_type
+
+    def generate(self, uploads, prompt, response_schema, extra_info=None, model_id="gemini-2.0-flash"):
+        """
+        Upload `uploads` ((file, display name, MIME type) tuples) and ask
+        Gemini for `response_schema`, retrying 429s and unparsed responses
+        with backoff. Returns (info, parsed), info being the call_info row;
+        None when every attempt failed.
+        """
+        api_key = os.environ.get("GOOGLE_GENAI_API_KEY")
+        client = genai.Client(api_key=api_key)
+        max_retries = 5
+        backoff_factor = 2
+        extra_info = extra_info or {}
         
         for attempt in range(max_retries):
             print(f"Attempt {attempt + 1} of {max_retries}...")
             try:
-                # Pass the mime_type argument to the upload call
-                file = client.files.upload(
-                    file=file_to_upload, 
-                    config={'display_name': os.path.basename(self.image_path).split('.')[0],
-                            'mime_type':mime_type}
-                )
-                prompt = (
-                    "Extract the structured data from this document. "
-                    "If SPII is requested, only return partial data. "
-                    "If a field exists but contains no value, return an empty string."
-                )
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=[prompt, file],
-                    config={
-                        'response_mime_type': 'application/json',
-                        'response_schema': model_use
-                    }
-                )
+                files = []
+                for upload, name, upload_mime_type in uploads:
+                    if hasattr(upload, "seek"):
+                        upload.seek(0)  # a retried in-memory upload must start from the top
+                    # Pass the mime_type argument to the upload call
+                    with span("gemini_upload", page=self.page_number, attempt=attempt + 1):
+                        files.append(client.files.upload(
+                            file=upload, 
+                            config={'display_name': name, 'mime_type': upload_mime_type}
+                        ))
+                with span("gemini_generate", page=self.page_number, model=model_id, attempt=attempt + 1,
+                          **extra_info) as sp:
+                    response = client.models.generate_content(
+                        model=model_id,
+                        contents=[prompt, *files],
+                        config={
+                            'response_mime_type': 'application/json',
+                            'response_schema': response_schema
+                        }
+                    )
+                    if response.usage_metadata is not None:
+                        sp.set(total_token_count=response.usage_metadata.total_token_count)
                 print(response)
                 if response.parsed:
                     info = {
                         'filename': self.image_path,
                         'model_version': response.model_version,
+                        **extra_info,
                     }
                     info.update(response.usage_metadata)
                     info = pd.json_normalize(info)
 
-                    line_items = response.parsed.model_dump()
-                    extracted = pd.DataFrame({
-                        'key': list(line_items.keys()),
-                        'value': list(line_items.values()),
-                        'filename': self.image_path
-                    })
-                    extracted = extracted[['filename', 'key', 'value']]
-                    return info, extracted
+                    return info, response.parsed
                 else:
                     wait_time = backoff_factor ** attempt
                     print(f"Response not valid. Retrying in {wait_time} seconds...")
@@ -496,20 +778,53 @@ class ClassifyExtract:
 
 
 
-def process_file(fp, save_to_db=False):
-    p = PDFHandler(fp)
+def process_file(fp, save_to_db=False, content_hash=None):
+    start_trace(os.path.basename(fp))
+    if content_hash is None:
+        content_hash = file_sha256(fp)
+    p = PDFHandler(fp, content_hash=content_hash)
 
     df_pages = p.df_pages
 
     clf_results = []
     clf_confidence = []
     clf_types = []
+    classify_times = []
+    extract_times = []
     extraction_results = []
     info_results = []
     for _, row in tqdm(df_pages.iterrows()):
         # fp = rf"{row['preprocessed']}"
         # print(fp)
-        c = ClassifyExtract(row)
+        if row.get('triage_label') in SKIP_LABELS:
+            # Blank / separator page: nothing to classify or extract.
+            clf_types.append('triage')
+            clf_results.append(row['triage_label'])
+            clf_confidence.append(1.0)
+            classify_times.append(0.0)
+            extract_times.append(0.0)
+            continue
+        reused = p.reused.get(row['preprocessed'])
+        if reused is not None and reused['page'].get('page_label'):
+            # Same text layer as an already processed page: take its label and values.
+            source = reused['page']
+            clf_types.append('reused')
+            clf_results.append(source['page_label'])
+            clf_confidence.append(source['page_confidence'])
+            classify_times.append(0.0)
+            extract_times.append(0.0)
+            if reused['extracted']:
+                res = pd.DataFrame(reused['extracted'], columns=['key', 'value'])
+                res.insert(0, 'filename', row['preprocessed'])
+                res['source'] = 'reused'
+                res['page_label'] = source['page_label']
+                res['page_confidence'] = source['page_confidence']
+                res['page_num'] = row['page_number']
+                extraction_results.append(res)
+            continue
+        classify_start = time.perf_counter()
+        c = ClassifyExtract(row, image_bytes=p.page_images.get(row['preprocessed']))
+        classify_times.append(time.perf_counter() - classify_start)
         clf_type = c.clf_type
         page_label = c.page_label
         page_score = c.page_score
@@ -517,17 +832,32 @@ def process_file(fp, save_to_db=False):
         clf_results.append(page_label)
         clf_confidence.append(page_score)
         print(page_label)
-        if page_label not in ['unknown', 'unknown_text_type', 'unknown_tax_form_type']:
-            info, res = c.process_image()
+        extract_start = time.perf_counter()
+        if page_label not in ['unknown', 'unknown_text_type', 'unknown_tax_form_type', *TRIAGE_LABELS]:
+            with span("identifiers", page=row['page_number']):
+                identifiers = scan_page(row['lines'])
+            if identifiers is not None and get_model(page_label) is not None:
+                # Entity lookups for the page's EIN / SSN run while Gemini extracts the rest.
+                found = identifiers.field_values(get_model(page_label).model_fields)
+                prefetch_for_page(page_label, {key: v['value'] for key, v in found.items()
+                                               if v['kind'] in FILL_KINDS and v['confidence'] >= IDENTIFIER_MIN_CONFIDENCE})
+            info, res = c.process_image(identifiers=identifiers)
             res['page_label'] = page_label
             res['page_confidence'] = page_score
             res['page_num'] = row['page_number']
             extraction_results.append(res)
-            info_results.append(info)
+            if info is not None:
+                info_results.append(info)
+        if c.combined is not None and c.combined[1] is None:
+            # A combined classify call that didn't yield the values still used tokens.
+            info_results.append(c.combined[0])
+        extract_times.append(time.perf_counter() - extract_start)
 
     df_pages['clf_type'] = clf_types
     df_pages['page_label'] = clf_results
     df_pages['page_confidence'] = clf_confidence
+    df_pages['classify_time'] = classify_times
+    df_pages['extract_time'] = extract_times
     df_extracted = pd.DataFrame()
     df_info = pd.DataFrame()
     if len(extraction_results) > 0:
@@ -543,21 +873,31 @@ def process_file(fp, save_to_db=False):
             if df_extracted[col].apply(lambda x: isinstance(x, (list, dict, set))).any():
                 df_extracted[col] = df_extracted[col].apply(lambda x: str(x) if isinstance(x, (list, dict, set)) else x)
         
-        # Save to database if requested
+        # Save to database if requested; page uploads are flushed first so no
+        # committed row references an object that isn't in S3.
         if save_to_db:
             try:
-                from document_ui import store_df_to_db
-                store_df_to_db(df_pages, 'pages')
-                store_df_to_db(df_extracted, 'extracted2')
-                store_df_to_db(df_info, 'call_info')
+                from document_ui import store_results_to_db
+                store_results_to_db(os.path.basename(fp), df_pages, df_extracted, df_info,
+                                    pending_uploads=p.uploads, content_hash=content_hash)
                 print("Data saved to database successfully")
             except Exception as e:
                 print(f"Error saving to database: {e}")
                 import traceback
                 traceback.print_exc()
-        
+            finally:
+                # The save's outcome wins: a failed upload has already failed the
+                # run (or the save failed first), so remaining upload failures
+                # are only logged here, never raised over the handled error.
+                try:
+                    p.uploads.flush()
+                except UploadError as e:
+                    print(f"Error uploading page images: {e}")
+        else:
+            p.uploads.flush()
         return df_pages, df_extracted, df_info
     else:
+        p.uploads.flush()
         return df_pages, None, None
 
     
@@ -0,0 +1,170 @@
+"""
+Read queries for the file endpoints, on pooled connections with server-side
+prepared statements.
+
+get_connection() opens a new connection per call, so nothing prepared on it
+outlives the request. The read endpoints instead borrow from a small pool and
+PREPARE each statement once per connection; after that every call is a single
+EXECUTE with bound parameters and a cached plan. The /get-file payload comes
+from get_file_payload() (migrations/006_file_read_path.sql) in one round trip.
+
+Behind a transaction-mode pooler (e.g. Supabase on port 6543) prepared
+statements don't survive between transactions; set DB_PREPARED_STATEMENTS=0
+there, or the first failure falls back to plain parameterized execution.
+
+Environment:
+    READ_POOL_SIZE            max pooled read connections (default 5)
+    DB_PREPARED_STATEMENTS    1/0 (default 1)
+"""
+import os
+import re
+import threading
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+
+READ_POOL_SIZE = int(os.environ.get("READ_POOL_SIZE", "5"))
+USE_PREPARED = os.environ.get("DB_PREPARED_STATEMENTS", "1").lower() in ("1", "true", "yes")
+
+# name -> (parameter types, SQL with $n placeholders)
+STATEMENTS = {
+    "current_run": (
+        "text",
+        "SELECT run_id, completed_at FROM document_runs WHERE filename = $1 AND is_current",
+    ),
+    "file_payload": (
+        "text, integer, integer, text[]",
+        "SELECT get_file_payload($1, $2, $3, $4)",
+    ),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_prepared = weakref.WeakKeyDictionary()  # connection -> set of prepared statement names
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, READ_POOL_SIZE,
+                    user=os.environ.get("SUPABASE_USER"),
+                    password=os.environ.get("SUPABASE_PASSWORD"),
+                    host=os.environ.get("SUPABASE_HOST"),
+                    port=os.environ.get("SUPABASE_PORT", 5432),
+                    dbname=os.environ.get("SUPABASE_DBNAME"),
+                )
+    return _pool
+
+
+@contextmanager
+def read_connection():
+    """Borrow a pooled connection for read-only queries."""
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.rollback()  # end the read transaction; keeps the session (and its prepared statements)
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def _plain_sql(sql):
+    return re.sub(r"\$\d+", "%s", sql)
+
+
+def execute_prepared(conn, name, params):
+    """Run a statement from STATEMENTS and return all rows."""
+    global USE_PREPARED
+    types, sql = STATEMENTS[name]
+    cursor = conn.cursor()
+    try:
+        if USE_PREPARED:
+            try:
+                names = _prepared.setdefault(conn, set())
+                if name not in names:
+                    cursor.execute(f"PREPARE {name} ({types}) AS {sql}")
+                    names.add(name)
+                placeholders = ", ".join(["%s"] * len(params))
+                cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+                return cursor.fetchall()
+            except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement) as e:
+                # Typically a transaction-mode pooler handing us a different backend.
+                print(f"Prepared statement {name} unavailable ({e.pgcode}); using plain queries.")
+                conn.rollback()
+                _prepared.pop(conn, None)
+                USE_PREPARED = False
+        cursor.execute(_plain_sql(sql), params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def get_current_run_id(conn, filename):
+    rows = execute_prepared(conn, "current_run", (filename,))
+    return rows[0][0] if rows else None
+
+
+def fetch_file_payload(conn, filename, page_start=1, page_end=None, exclude=()):
+    """
+    {run_id, total_pages, pages, extracted, info} for the file's current run,
+    or None. Page rows come back as JSON, so BYTEA geometry columns arrive as
+    '\\x..' hex strings; they are converted back to bytes for geometry_codec.
+    """
+    rows = execute_prepared(conn, "file_payload", (filename, page_start, page_end, list(exclude)))
+    payload = rows[0][0] if rows else None
+    if payload is None:
+        return None
+    for page in payload["pages"]:
+        for col, value in page.items():
+            if col.endswith("_bin") and isinstance(value, str) and value.startswith("\\x"):
+                page[col] = bytes.fromhex(value[2:])
+    return payload
+
+
+# The statements inside get_file_payload() (and entity_matcher's lookups), for
+# checking with EXPLAIN that they use the indexes from migrations 002/006.
+EXPLAIN_QUERIES = {
+    "current run": "SELECT run_id FROM document_runs WHERE filename = %(filename)s AND is_current",
+    "pages of run": """
+        SELECT p.* FROM pages p
+        WHERE p.run_id = %(run_id)s AND p.page_number >= 1
+        ORDER BY p.page_number
+    """,
+    "extracted of run": """
+        SELECT e.* FROM pages p
+        JOIN extracted2 e ON e.filename = p.preprocessed AND e.run_id = p.run_id
+        WHERE p.run_id = %(run_id)s
+    """,
+    "info of run": """
+        SELECT i.* FROM pages p
+        JOIN call_info i ON i.filename = p.preprocessed AND i.run_id = p.run_id
+        WHERE p.run_id = %(run_id)s
+    """,
+    "entity_matcher pages by filename": "SELECT preprocessed, page_number FROM pages WHERE filename = %(filename)s AND run_id = %(run_id)s",
+}
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        sys.exit("usage: python file_queries.py <filename>   # EXPLAIN ANALYZE the /get-file read path")
+    with read_connection() as conn:
+        run_id = get_current_run_id(conn, sys.argv[1])
+        if run_id is None:
+            sys.exit(f"No current run for {sys.argv[1]}")
+        cursor = conn.cursor()
+        for label, sql in EXPLAIN_QUERIES.items():
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, {"filename": sys.argv[1], "run_id": run_id})
+            print(f"--- {label}")
+            print("\n".join(row[0] for row in cursor.fetchall()))
+        cursor.close()
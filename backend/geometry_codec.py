@@ -0,0 +1,203 @@
+import os
+import json
+import struct
+import numpy as np
+
+# Storage format for pages.words / bboxes / normalized_bboxes / tokens.
+#   "json"   -> legacy JSON text columns (default)
+#   "binary" -> packed BYTEA columns (words_bin, bboxes_bin, normalized_bboxes_bin)
+GEOMETRY_STORAGE = os.environ.get("GEOMETRY_STORAGE", "json").lower()
+
+# Every blob starts with: 2-byte magic, 1-byte dtype code, 4-byte element count.
+_HEADER = struct.Struct("<2sBI")
+_MAGIC = b"XG"
+
+_DTYPES = {
+    1: np.dtype("<i2"),  # pixel bboxes (300 dpi pages fit comfortably in int16)
+    2: np.dtype("<i4"),  # pixel bboxes for oversized pages
+    3: np.dtype("<f4"),  # normalized bboxes
+    4: np.dtype("<u4"),  # string lengths for packed word/line blobs
+}
+_DTYPE_CODES = {v: k for k, v in _DTYPES.items()}
+
+BINARY_COLUMNS = {
+    "words": "words_bin",
+    "bboxes": "bboxes_bin",
+    "normalized_bboxes": "normalized_bboxes_bin",
+}
+
+
+def use_binary_geometry():
+    return GEOMETRY_STORAGE == "binary"
+
+
+def _pack_array(arr, dtype):
+    arr = np.ascontiguousarray(arr, dtype=dtype)
+    return _HEADER.pack(_MAGIC, _DTYPE_CODES[np.dtype(dtype)], arr.size) + arr.tobytes()
+
+
+def _unpack_array(blob):
+    """
+    Decode a blob produced by _pack_array. Returns a read-only view over the
+    buffer (np.frombuffer), so nothing is copied.
+    """
+    buf = memoryview(blob)
+    magic, code, count = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC:
+        raise ValueError("Not a packed geometry blob.")
+    return np.frombuffer(buf, dtype=_DTYPES[code], count=count, offset=_HEADER.size)
+
+
+def pack_bboxes(bboxes):
+    """
+    Pack pixel bounding boxes [[x1, y1, x2, y2], ...] as int16 (int32 if any
+    coordinate does not fit).
+    """
+    arr = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    fits_int16 = arr.size == 0 or (arr.min() >= -32768 and arr.max() <= 32767)
+    return _pack_array(arr, "<i2" if fits_int16 else "<i4")
+
+
+def unpack_bboxes(blob):
+    """Decode pixel bounding boxes into an (N, 4) integer array."""
+    return _unpack_array(blob).reshape(-1, 4)
+
+
+def pack_normalized_bboxes(normalized_bboxes):
+    """Pack normalized bounding boxes as float32."""
+    arr = np.asarray(normalized_bboxes, dtype=np.float32).reshape(-1, 4)
+    return _pack_array(arr, "<f4")
+
+
+def unpack_normalized_bboxes(blob):
+    """Decode normalized bounding boxes into an (N, 4) float32 array."""
+    return _unpack_array(blob).reshape(-1, 4)
+
+
+def pack_strings(strings):
+    """
+    Pack a list of strings as a length-prefixed blob:
+    header, uint32 byte lengths for every string, then the UTF-8 payload.
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    lengths = np.fromiter((len(e) for e in encoded), dtype="<u4", count=len(encoded))
+    return _pack_array(lengths, "<u4") + b"".join(encoded)
+
+
+def unpack_strings(blob):
+    """Decode a blob produced by pack_strings into a list of strings."""
+    buf = memoryview(blob)
+    lengths = _unpack_array(buf)
+    offsets = np.empty(len(lengths) + 1, dtype=np.int64)
+    offsets[0] = _HEADER.size + lengths.nbytes
+    np.cumsum(lengths, out=offsets[1:])
+    offsets[1:] += offsets[0]
+    return [bytes(buf[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(len(lengths))]
+
+
+def encode_geometry_columns(df_pages):
+    """
+    Replace the JSON geometry columns of a pages DataFrame with packed blobs.
+    Tokens are not stored: they are the lower-cased words and are rebuilt on read.
+    `lines` stays as text because chat SQL and LIKE lookups read it directly.
+    """
+    df = df_pages.copy()
+    df["words_bin"] = df["words"].apply(pack_strings)
+    df["bboxes_bin"] = df["bboxes"].apply(pack_bboxes)
+    df["normalized_bboxes_bin"] = df["normalized_bboxes"].apply(pack_normalized_bboxes)
+    return df.drop(columns=["words", "bboxes", "normalized_bboxes", "tokens"])
+
+
+def decode_page_geometry(row):
+    """
+    Return (words, bboxes, normalized_bboxes, tokens) for a page row, reading
+    the packed columns when present and falling back to the JSON columns.
+    Boxes come back as NumPy arrays viewing the row's buffers.
+    """
+    if _is_packed(row.get("bboxes_bin")):
+        words = unpack_strings(row["words_bin"])
+        bboxes = unpack_bboxes(row["bboxes_bin"])
+        normalized_bboxes = unpack_normalized_bboxes(row["normalized_bboxes_bin"])
+    else:
+        words = _maybe_json(row.get("words")) or []
+        bboxes = np.asarray(_maybe_json(row.get("bboxes")) or [], dtype=np.int32).reshape(-1, 4)
+        normalized_bboxes = np.asarray(_maybe_json(row.get("normalized_bboxes")) or [], dtype=np.float32).reshape(-1, 4)
+    tokens = [w.lower() for w in words]
+    return words, bboxes, normalized_bboxes, tokens
+
+
+def decode_geometry_columns(df_pages):
+    """
+    Rebuild the geometry columns for rows stored in binary format, and drop
+    the *_bin columns. Used by read paths that return pages to the frontend.
+    Boxes stay NumPy arrays viewing the row's buffers (the JSON encoder
+    serializes them directly); callers that need lists convert them.
+    """
+    if "bboxes_bin" not in df_pages.columns:
+        return df_pages
+    df = df_pages.copy()
+    geometry = [
+        decode_page_geometry(row) if _is_packed(row.get("bboxes_bin")) else None
+        for row in df.to_dict(orient="records")
+    ]
+    for col, idx in (("words", 0), ("bboxes", 1), ("normalized_bboxes", 2), ("tokens", 3)):
+        existing = df[col].tolist() if col in df.columns else [None] * len(df)
+        df[col] = [g[idx] if g is not None else old for g, old in zip(geometry, existing)]
+    return df.drop(columns=[c for c in BINARY_COLUMNS.values() if c in df.columns])
+
+
+def _is_packed(value):
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+
+def _maybe_json(value):
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def backfill_binary_geometry(conn, batch_size=500):
+    """
+    Convert existing JSON geometry in `pages` to the packed columns, in batches.
+    The JSON columns are left in place; drop or null them once reads are moved over.
+    Returns the number of rows converted.
+    """
+    converted = 0
+    while True:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, words, bboxes, normalized_bboxes FROM pages
+            WHERE bboxes_bin IS NULL AND bboxes IS NOT NULL
+            ORDER BY id LIMIT %s
+        """, (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.close()
+            break
+        updates = []
+        for page_id, words, bboxes, normalized_bboxes in rows:
+            updates.append((
+                pack_strings(_maybe_json(words) or []),
+                pack_bboxes(_maybe_json(bboxes) or []),
+                pack_normalized_bboxes(_maybe_json(normalized_bboxes) or []),
+                page_id,
+            ))
+        cursor.executemany("""
+            UPDATE pages SET words_bin = %s, bboxes_bin = %s, normalized_bboxes_bin = %s
+            WHERE id = %s
+        """, updates)
+        conn.commit()
+        cursor.close()
+        converted += len(rows)
+        print(f"Backfilled {converted} pages...")
+    return converted
+
+
+if __name__ == "__main__":
+    from entity_matcher import get_db_connection
+    conn = get_db_connection()
+    try:
+        total = backfill_binary_geometry(conn)
+        print(f"Done. Converted {total} pages to binary geometry.")
+    finally:
+        conn.close()
@@ -0,0 +1,268 @@
+"""
+Deterministic extraction of identifier fields from a page's OCR lines.
+
+EINs, SSN last-4s, tax years, dates and currency amounts are what entity
+matching and the balance checks depend on most, and they're regular enough
+to read with patterns. scan_page() runs a compiled pattern set over the
+page's lines once; the result:
+
+    field_values(fields)    confident values for schema fields, so they can be
+                            filled (and entity lookups started) without Gemini
+    merge(values, fields)   combines them with zonal values; a disagreement
+                            sends the field to Gemini instead
+    cross_check(key, value) 'match' / 'mismatch' for a model value: does it
+                            validate and does it occur on the page?
+
+EINs are validated against the IRS campus prefixes and SSNs against the SSA
+rules (no 000/666/9xx area, 00 group or 0000 serial). Dates and amounts are
+only located by the label on their line, which isn't reliable enough to fill
+fields, so they are used for cross-checks only. Dates are read as m/d/y,
+ISO, "15 JAN 2030" or "January 15, 2030".
+
+Environment:
+    IDENTIFIER_EXTRACTION         1/0 (default 1)
+    IDENTIFIER_MIN_CONFIDENCE     min confidence of a pattern value used without Gemini (default 0.9)
+"""
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+IDENTIFIER_EXTRACTION = os.environ.get("IDENTIFIER_EXTRACTION", "1").lower() in ("1", "true", "yes")
+IDENTIFIER_MIN_CONFIDENCE = float(os.environ.get("IDENTIFIER_MIN_CONFIDENCE", "0.9"))
+
+# Valid EIN prefixes (IRS campus and internet assignment codes).
+EIN_PREFIXES = frozenset(
+    [1, 2, 3, 4, 5, 6, 10, 11, 12, 13, 14, 15, 16, 20, 21, 22, 23, 24, 25, 26, 27]
+    + list(range(30, 49)) + list(range(50, 69)) + [71, 72, 73, 74, 75, 76, 77]
+    + list(range(80, 89)) + [90, 91, 92, 93, 94, 95, 98, 99]
+)
+
+EIN_RE = re.compile(r"(?<![\d-])(\d{2})\s?-\s?(\d{7})(?![\d-])")
+SSN_RE = re.compile(r"(?<![\w-])([\dXx*]{3})\s?-\s?([\dXx*]{2})\s?-\s?(\d{4})(?![\d-])")
+YEAR_RE = re.compile(r"(?<!\d)(19[89]\d|20\d{2})(?!\d)")
+DATE_RE = re.compile(r"(?<!\d)(0?[1-9]|1[0-2])\s?[/-]\s?(0?[1-9]|[12]\d|3[01])\s?[/-]\s?((?:19|20)?\d{2})(?!\d)")
+ISO_DATE_RE = re.compile(r"(?<!\d)((?:19|20)\d{2})-(0?[1-9]|1[0-2])-(0?[1-9]|[12]\d|3[01])(?!\d)")
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+# "15 JAN 2030" (passports, licences) and "January 15, 2030" (ACORD, certificates).
+DAY_MONTH_RE = re.compile(r"(?<!\d)(0?[1-9]|[12]\d|3[01])\s+" + _MONTH + r",?\s+((?:19|20)?\d{2})(?!\d)", re.I)
+MONTH_DAY_RE = re.compile(r"\b" + _MONTH + r"\s+(0?[1-9]|[12]\d|3[01]),?\s+((?:19|20)\d{2})(?!\d)", re.I)
+ANY_DATE_RE = re.compile("|".join(p.pattern for p in (ISO_DATE_RE, DATE_RE, DAY_MONTH_RE, MONTH_DAY_RE)), re.I)
+MONTHS = {m: i for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun",
+                                      "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+AMOUNT_RE = re.compile(r"(?<![\w.,])\(?-?\$?\s?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{2})?\)?(?![\w/-])")
+
+TAX_YEAR_CONTEXT = re.compile(r"calendar year|tax year|for the year", re.I)
+# EINs on these lines belong to the paid preparer, not the filer.
+PREPARER_CONTEXT = re.compile(r"firm'?s|preparer|ptin", re.I)
+
+# Schema field -> (kind, label pattern for contextual kinds or None, ordinal among the page's values).
+FIELD_KINDS = {
+    "ein": ("ein", None, 0),
+    "business_ein": ("ein", None, 0),
+    "ssn_last_4": ("ssn_last_4", None, 0),
+    "primary_ssn_last_4": ("ssn_last_4", None, 0),
+    "spouse_ssn_last_4": ("ssn_last_4", None, 1),
+    "tax_year": ("tax_year", None, 0),
+    "inception_date": ("date", re.compile(r"date (incorporated|business started)", re.I), 0),
+    "certificate_date": ("date", re.compile(r"date \(mm/dd/yyyy\)|^date\b", re.I), 0),
+    "effective_date": ("date", re.compile(r"effective", re.I), 0),
+    "expiration_date": ("date", re.compile(r"expiration", re.I), 0),
+    "exp_date": ("date", re.compile(r"\bexp", re.I), 0),
+    "dob": ("date", re.compile(r"\bdob\b|date of birth|birth", re.I), 0),
+    "gross_revenue": ("amount", re.compile(r"gross receipts", re.I), 0),
+    "cost_of_goods_sold": ("amount", re.compile(r"cost of goods sold", re.I), 0),
+    "gross_profit": ("amount", re.compile(r"gross profit", re.I), 0),
+    "officers_compensation": ("amount", re.compile(r"compensation of officers|guaranteed payments", re.I), 0),
+    "depreciation": ("amount", re.compile(r"depreciation", re.I), 0),
+    "total_deductions": ("amount", re.compile(r"total deductions|total expenses", re.I), 0),
+    "net_profit": ("amount", re.compile(r"ordinary business income|taxable income|net profit", re.I), 0),
+    "agi": ("amount", re.compile(r"adjusted gross income", re.I), 0),
+    "w2_wages": ("amount", re.compile(r"form\(?s\)? w-2", re.I), 0),
+}
+# Kinds read without a label; the others only cross-check.
+FILL_KINDS = ("ein", "ssn_last_4", "tax_year")
+
+
+def normalize_ein(text):
+    """'12-3456789' for a valid EIN (any spacing/dash), else None."""
+    digits = re.sub(r"\D", "", str(text))
+    if len(digits) != 9 or int(digits[:2]) not in EIN_PREFIXES:
+        return None
+    return f"{digits[:2]}-{digits[2:]}"
+
+
+def ssn_last_4(area, group, serial):
+    """The serial of a (possibly masked) SSN if its visible parts are valid, else None."""
+    if serial == "0000":
+        return None
+    if area.isdigit() and (area in ("000", "666") or area.startswith("9")):
+        return None
+    if group.isdigit() and group == "00":
+        return None
+    return serial
+
+
+def normalize_date(text):
+    """
+    ISO date for m/d/y, ISO, "15 JAN 2030" or "January 15, 2030" text
+    (two-digit years read as 20xx), else None.
+    """
+    text = str(text)
+    if match := ISO_DATE_RE.search(text):
+        year, month, day = (int(g) for g in match.groups())
+    elif match := DATE_RE.search(text):
+        month, day, year = (int(g) for g in match.groups())
+    elif match := DAY_MONTH_RE.search(text):
+        day, month, year = int(match.group(1)), MONTHS[match.group(2).lower()[:3]], int(match.group(3))
+    elif match := MONTH_DAY_RE.search(text):
+        month, day, year = MONTHS[match.group(1).lower()[:3]], int(match.group(2)), int(match.group(3))
+    else:
+        return None
+    if year < 100:
+        year += 2000
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def normalize_amount(text):
+    """Amount text ('$1,234', '(500)', '12.50') as a plain decimal string, else None."""
+    text = str(text).strip()
+    negative = (text.startswith("(") and text.endswith(")")) or text.startswith("-")
+    digits = re.sub(r"[^\d.]", "", text)
+    if not digits or digits.count(".") > 1:
+        return None
+    try:
+        value = Decimal(digits)
+    except InvalidOperation:
+        return None
+    return format((-value if negative else value).normalize(), "f")
+
+
+def normalize(kind, value):
+    """Comparable form of a value of the given kind, or None if it doesn't parse/validate."""
+    if value is None or not str(value).strip():
+        return None
+    if kind == "ein":
+        return normalize_ein(value)
+    if kind == "ssn_last_4":
+        digits = re.sub(r"\D", "", str(value))
+        return digits[-4:] if len(digits) >= 4 and digits[-4:] != "0000" else None
+    if kind == "tax_year":
+        match = YEAR_RE.search(str(value))
+        return match.group(1) if match else None
+    if kind == "date":
+        return normalize_date(value)
+    if kind == "amount":
+        return normalize_amount(value)
+    return None
+
+
+class PageIdentifiers:
+    """Pattern matches of one page, by kind, in reading order."""
+
+    def __init__(self, lines):
+        self.lines = [str(line) for line in (lines or [])]
+        self.candidates = {"ein": [], "ssn_last_4": [], "tax_year": [], "date": [], "amount": []}
+        for i, line in enumerate(self.lines):
+            for match in EIN_RE.finditer(line):
+                ein = normalize_ein(match.group(0))
+                preparer = PREPARER_CONTEXT.search(line) or (i and PREPARER_CONTEXT.search(self.lines[i - 1]))
+                if ein and not preparer:
+                    self.candidates["ein"].append(ein)
+            for match in SSN_RE.finditer(line):
+                last4 = ssn_last_4(*match.groups())
+                if last4:
+                    self.candidates["ssn_last_4"].append(last4)
+            for match in ANY_DATE_RE.finditer(line):
+                self.candidates["date"].append(normalize_date(match.group(0)))
+            for match in AMOUNT_RE.finditer(line):
+                amount = normalize_amount(match.group(0))
+                if amount is not None:
+                    self.candidates["amount"].append(amount)
+            if TAX_YEAR_CONTEXT.search(line):
+                year = YEAR_RE.search(line)
+                if year:
+                    self.candidates["tax_year"].append(year.group(1))
+
+    def _distinct(self, kind):
+        return list(dict.fromkeys(self.candidates[kind]))
+
+    def _labelled(self, kind, label):
+        """Value of `kind` after `label` on the first line containing it, or on the next line."""
+        for i, line in enumerate(self.lines):
+            if not label.search(line):
+                continue
+            pattern = ANY_DATE_RE if kind == "date" else AMOUNT_RE
+            for text in (line[label.search(line).end():], self.lines[i + 1] if i + 1 < len(self.lines) else ""):
+                matches = [m.group(0) for m in pattern.finditer(text)]
+                # Dates follow their label; amounts sit at the right end of the line.
+                for match in (matches if kind == "date" else matches[::-1]):
+                    value = normalize(kind, match)
+                    if value is not None:
+                        return value
+            return None
+        return None
+
+    def field_values(self, fields):
+        """{key: {"value", "confidence", "kind"}} for the schema fields with a recognizable value."""
+        values = {}
+        for key in fields:
+            if key not in FIELD_KINDS:
+                continue
+            kind, label, ordinal = FIELD_KINDS[key]
+            if label is not None:
+                value = self._labelled(kind, label)
+                confidence = 0.6
+            else:
+                distinct = self._distinct(kind)
+                value = distinct[ordinal] if len(distinct) > ordinal else None
+                # A single candidate is unambiguous; otherwise reading order decides.
+                confidence = 0.95 if len(distinct) == ordinal + 1 else 0.6
+            if value is not None:
+                values[key] = {"value": value, "confidence": confidence, "kind": kind}
+        return values
+
+    def merge(self, values, fields):
+        """
+        Add confident pattern values to zonal `values` (source 'pattern').
+        Zonal identifier values that don't validate, or disagree with a
+        confident pattern value, are dropped so the field goes to Gemini.
+        """
+        merged = dict(values)
+        found = self.field_values(fields)
+        for key in fields:
+            if key not in FIELD_KINDS or FIELD_KINDS[key][0] not in FILL_KINDS:
+                continue
+            kind = FIELD_KINDS[key][0]
+            pattern = found.get(key)
+            confident = pattern is not None and pattern["confidence"] >= IDENTIFIER_MIN_CONFIDENCE
+            current = merged.get(key)
+            if current is not None and current["value"]:
+                zonal = normalize(kind, current["value"])
+                if zonal is None or (confident and zonal != pattern["value"]):
+                    print(f"Dropping zonal {key}={current['value']!r}: "
+                          f"{'invalid' if zonal is None else 'disagrees with ' + pattern['value']}")
+                    del merged[key]
+                continue
+            if confident:
+                merged[key] = {"value": pattern["value"], "confidence": pattern["confidence"], "source": "pattern"}
+        return merged
+
+    def cross_check(self, key, value):
+        """'match' if a model value validates and occurs on the page, 'mismatch' if not, None if unchecked."""
+        if key not in FIELD_KINDS or value is None or not str(value).strip():
+            return None
+        kind = FIELD_KINDS[key][0]
+        normalized = normalize(kind, value)
+        if normalized is None:
+            # Dates and amounts can be written in ways the patterns don't read: unchecked.
+            return "mismatch" if kind in FILL_KINDS else None
+        if not self.candidates[kind]:
+            return None
+        return "match" if normalized in self.candidates[kind] else "mismatch"
+
+
+def scan_page(lines):
+    """PageIdentifiers for a page's OCR lines, or None when disabled."""
+    if not IDENTIFIER_EXTRACTION:
+        return None
+    return PageIdentifiers(lines)
@@ -0,0 +1,138 @@
+"""
+Reduced-resolution renditions of preprocessed pages for the document viewer.
+
+For every page the pipeline writes, next to preprocessed.png:
+    thumb.webp                         ~256 px wide, for page strips / lists
+    preview.webp                       ~1280 px wide, for normal on-screen viewing
+    tiles/page.dzi + page_files/...    Deep Zoom pyramid of 256 px WebP tiles
+                                       (only with IMAGE_PYRAMID=dzi)
+
+Keys are derived from the `preprocessed` key, so only the list of levels that
+exist is stored on the page row (pages.image_levels).
+
+Environment:
+    IMAGE_PYRAMID   off | thumbs | dzi (default thumbs: thumbnail + preview)
+"""
+import os
+import math
+from io import BytesIO
+
+from PIL import Image
+
+IMAGE_PYRAMID = os.environ.get("IMAGE_PYRAMID", "thumbs").lower()
+
+THUMB_WIDTH = 256
+PREVIEW_WIDTH = 1280
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+WEBP_QUALITY = 80
+
+LEVELS = ("thumb", "preview", "dzi", "full")
+
+# Content-Type stored with each artifact, so browsers and CloudFront serve
+# them as images / XML rather than binary/octet-stream downloads.
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".dzi": "application/xml",
+}
+
+
+def level_key(preprocessed_key, level):
+    """S3 key of a rendition of the page whose full image is `preprocessed_key`."""
+    base = os.path.dirname(preprocessed_key)
+    if level == "thumb":
+        return f"{base}/thumb.webp"
+    if level == "preview":
+        return f"{base}/preview.webp"
+    if level == "dzi":
+        return f"{base}/tiles/page.dzi"
+    return preprocessed_key
+
+
+def content_type(object_key):
+    """Content-Type for an artifact key, or None for unknown extensions."""
+    return CONTENT_TYPES.get(os.path.splitext(object_key)[1].lower())
+
+
+def _webp(image):
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def _resize_to_width(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def dzi_descriptor(width, height):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'TileSize="{TILE_SIZE}" Overlap="{TILE_OVERLAP}" Format="webp">'
+        f'<Size Width="{width}" Height="{height}"/></Image>'
+    ).encode("utf-8")
+
+
+def dzi_tiles(image):
+    """
+    Yield (relative_key, bytes) for every tile of a Deep Zoom pyramid, from the
+    full-resolution level down to 1x1. Each level is downsampled from the one
+    above it rather than from the original.
+    """
+    max_level = math.ceil(math.log2(max(image.width, image.height)))
+    level_image = image
+    for level in range(max_level, -1, -1):
+        width, height = level_image.size
+        for col in range(math.ceil(width / TILE_SIZE)):
+            for row in range(math.ceil(height / TILE_SIZE)):
+                x0 = max(0, col * TILE_SIZE - TILE_OVERLAP)
+                y0 = max(0, row * TILE_SIZE - TILE_OVERLAP)
+                x1 = min(width, (col + 1) * TILE_SIZE + TILE_OVERLAP)
+                y1 = min(height, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+                yield f"page_files/{level}/{col}_{row}.webp", _webp(level_image.crop((x0, y0, x1, y1)))
+        level_image = level_image.resize(
+            (max(1, math.ceil(width / 2)), max(1, math.ceil(height / 2))), Image.LANCZOS
+        )
+
+
+def build_renditions(image, preprocessed_key, mode=None):
+    """
+    Encode the configured renditions of a preprocessed page.
+    Returns (levels, [(s3_key, bytes), ...]); levels is the comma-separated
+    list stored in pages.image_levels.
+    """
+    mode = (mode or IMAGE_PYRAMID).lower()
+    if mode == "off":
+        return "full", []
+    # Grayscale/binary denoised pages: convert once so every encode is cheap.
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("L")
+    artifacts = [
+        (level_key(preprocessed_key, "thumb"), _webp(_resize_to_width(image, THUMB_WIDTH))),
+        (level_key(preprocessed_key, "preview"), _webp(_resize_to_width(image, PREVIEW_WIDTH))),
+    ]
+    levels = ["thumb", "preview"]
+    if mode == "dzi":
+        dzi_key = level_key(preprocessed_key, "dzi")
+        tiles_base = os.path.dirname(dzi_key)
+        artifacts.append((dzi_key, dzi_descriptor(image.width, image.height)))
+        artifacts.extend((f"{tiles_base}/{rel}", data) for rel, data in dzi_tiles(image))
+        levels.append("dzi")
+    levels.append("full")
+    return ",".join(levels), artifacts
+
+
+def best_level_key(page, level):
+    """
+    Key to serve for `level` on a page row, falling back to the full image for
+    pages ingested before renditions existed (or with IMAGE_PYRAMID=off).
+    """
+    levels = page.get("image_levels")
+    available = levels.split(",") if isinstance(levels, str) else ["full"]
+    if level in available:
+        return level_key(page["preprocessed"], level)
+    return page["preprocessed"]
@@ -1,17 +1,32 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import shutil
 import os
+import io
+import json
+import time
+import hashlib
+from decimal import Decimal
 from fast_processor_gemini import process_file  # Import your processing function
-import boto3
-import psycopg2
+from url_signer import url_cache, page_urls, set_cookies, cdn_url, cookie_mode, IMAGE_URL_TTL
+from image_pyramid import best_level_key, level_key
+import numpy as np
 import pandas as pd
 from typing import List, Optional
-from chat_ui import convert_to_sql, run_sql_query, save_conversation, load_conversations, SCHEMA
-from document_ui import store_df_to_db, get_connection
+from chat_ui import (convert_to_sql, run_sql_query, stream_sql_query, is_read_query, save_conversation,
+                     load_conversations, SCHEMA, SQL_ROW_CAP, SQL_FETCH_SIZE)
+from document_ui import get_connection
 from entity_matcher import match_entities_for_file
+from geometry_codec import decode_geometry_columns
+from file_queries import read_connection, get_current_run_id, fetch_file_payload
+from tracing import flush_spans
+from translation_cache import translation_cache
+from query_cache import result_cache
+from extraction_policy import tier_stats
+from search_index import search
+from document_runs import find_completed_run
+from single_flight import receive_upload, content_lock, upload_flight
 
 
 app = FastAPI()
@@ -97,6 +112,21 @@ async def convert_to_sql_endpoint(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/convert-to-sql/cache-stats")
+def convert_to_sql_cache_stats():
+    """Hit rate and size of the NL-to-SQL translation cache."""
+    return translation_cache.report()
+
+@app.get("/run-sql/cache-stats")
+def run_sql_cache_stats():
+    """Hit rate and size of the query result cache shared by /run-sql and the dashboards."""
+    return result_cache.report()
+
+@app.get("/extraction/tier-stats")
+def extraction_tier_stats():
+    """Latency, tokens and escalation rate of each extraction model tier since startup."""
+    return tier_stats.report()
+
 @app.post("/run-sql")
 async def run_sql_endpoint(request: QueryRequest):
     """
@@ -110,34 +140,130 @@ async def run_sql_endpoint(request: QueryRequest):
         df = run_sql_query(request.query)
         # Convert the DataFrame to a string (you may modify the formatting as needed)
         result_text = df.to_string(index=False)
+        if df.attrs.get("truncated"):
+            result_text += f"\n... truncated to the first {SQL_ROW_CAP} rows"
         return {"result": result_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _ndjson_lines(query, batch_size):
+    for kind, value in stream_sql_query(query, batch_size=batch_size):
+        if kind == "columns":
+            line = {"columns": value}
+        elif kind == "rows":
+            line = {"rows": [list(row) for row in value]}
+        else:
+            line = {"done": True, **value}
+        yield json.dumps(line, default=_json_default) + "\n"
+
+class _ChunkSink(io.RawIOBase):
+    """File-like sink the Arrow stream writer writes into; drained after each batch."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def _arrow_batches(query, batch_size):
+    import pyarrow as pa
+    sink = _ChunkSink()
+    writer, columns = None, []
+    for kind, value in stream_sql_query(query, batch_size=batch_size):
+        if kind == "columns":
+            columns = value
+        elif kind == "rows":
+            data = {c: [row[i] for row in value] for i, c in enumerate(columns)}
+            # Later batches reuse the first batch's inferred schema.
+            batch = pa.RecordBatch.from_pydict(data, schema=writer.schema if writer else None)
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+            yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+@app.post("/run-sql/stream")
+def run_sql_stream_endpoint(request: QueryRequest, format: str = "ndjson", batch_size: int = SQL_FETCH_SIZE):
+    """
+    Streams the result of a read-only query in batches through a server-side
+    cursor, capped at SQL_ROW_CAP rows and SQL_STATEMENT_TIMEOUT_MS.
+    format=ndjson (default): one JSON object per line -
+        {"columns": [...]}, {"rows": [[...], ...]} per batch, {"done": true, "row_count": n, "truncated": bool}
+    format=arrow: an Arrow IPC stream (requires pyarrow).
+    """
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query is empty.")
+    if not is_read_query(request.query):
+        raise HTTPException(status_code=400, detail="Only SELECT/WITH queries can be streamed.")
+    batch_size = max(1, min(batch_size, 10000))
+    if format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="pyarrow is not installed.")
+        return StreamingResponse(_arrow_batches(request.query, batch_size),
+                                 media_type="application/vnd.apache.arrow.stream")
+    return StreamingResponse(_ndjson_lines(request.query, batch_size), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint for pipeline stage timings (PIPELINE_TRACING=1).
+    Requires prometheus_client.
+    """
+    try:
+        from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    except ImportError:
+        raise HTTPException(status_code=501, detail="prometheus_client is not installed.")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Image level served as s3_url by default: full | preview | thumb. The viewers
+# only display s3_url, so they get the ~1280 px preview; ?level=full still
+# serves the original.
+IMAGE_DEFAULT_LEVEL = os.environ.get("IMAGE_DEFAULT_LEVEL", "preview")
+
+def attach_page_urls(pages, level):
+    """
+    Set s3_url (the requested level, or the full image when that level doesn't
+    exist for a page) and thumb_url on each page. dzi_url is only returned in
+    CloudFront cookie mode, since tiles can't be presigned one by one.
+    Returns the CloudFront cookies to set, if any.
+    """
+    keys = []
+    for page in pages:
+        page["_url_key"] = best_level_key(page, level)
+        page["_thumb_key"] = best_level_key(page, "thumb")
+        keys += [page["_url_key"], page["_thumb_key"]]
+    urls, cookies = page_urls(keys)
+    for page in pages:
+        page["s3_url"] = urls.get(page.pop("_url_key"))
+        page["thumb_url"] = urls.get(page.pop("_thumb_key"))
+        if cookies is not None and "dzi" in str(page.get("image_levels") or "").split(","):
+            page["dzi_url"] = cdn_url(level_key(page["preprocessed"], "dzi"))
+    return cookies
+
 # Function to generate pre-signed URLs
 def get_s3_url(object_key, bucket_name="form-sage-storage", expiration=3600):
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        region_name="us-east-2"
-    )
-    return s3_client.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': bucket_name, 'Key': object_key},
-        ExpiresIn=expiration
-    )
+    return url_cache.get(object_key, bucket_name, expiration)
 
 @app.get("/list-files")
 def list_files():
     conn = get_connection()
     query = """
-    WITH p1 AS (
-        SELECT DISTINCT created_at, filename 
-        FROM pages
-        ORDER BY created_at DESC
-    )
-    SELECT filename FROM p1
+    SELECT filename
+    FROM document_runs
+    WHERE is_current
+    ORDER BY created_at DESC
     """
     df = pd.read_sql_query(query, conn)
     conn.close()
@@ -145,98 +271,219 @@ def list_files():
     # Return just the list of filenames
     return df["filename"].tolist()
 
+# Columns of `pages` that /get-file can return via ?fields=. Geometry columns
+# are read from their packed *_bin counterpart when stored in binary format.
+PAGE_FIELDS = (
+    "filename", "preprocessed", "image_levels", "page_number", "image_width", "image_height",
+    "lines", "words", "bboxes", "normalized_bboxes", "tokens", "words_for_clf",
+    "processing_time", "render_time", "ocr_time", "preprocess_time", "classify_time",
+    "extract_time", "clf_type", "page_label", "page_confidence", "run_id", "created_at",
+    "ocr_source", "triage_label", "ink_density", "phash", "reused_from",
+)
+# Stored on pages for the pipeline only; never returned.
+INTERNAL_PAGE_COLUMNS = ("phash_fine", "word_index")
+GEOMETRY_FIELDS = {"words", "tokens", "bboxes", "normalized_bboxes"}
+GEOMETRY_BINARY_COLUMNS = ("words_bin", "bboxes_bin", "normalized_bboxes_bin")
+
+def _json_default(value):
+    if value is None or value is pd.NaT:
+        return None
+    if hasattr(value, "tolist"):  # NumPy arrays and scalars
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def json_response(content, status_code=200, headers=None):
+    """Serialize with orjson when available (several times faster than json on page geometry)."""
+    try:
+        import orjson
+    except ImportError:
+        body = json.dumps(content, default=_json_default).encode("utf-8")
+    else:
+        body = orjson.dumps(content, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+def _excluded_page_columns(fields):
+    """Page columns get_file_payload() should drop for the requested fields (None = keep all)."""
+    if fields is None:
+        return list(INTERNAL_PAGE_COLUMNS)
+    # Always needed to build image URLs and to page through results.
+    needed = {"page_number", "preprocessed", "image_levels"} | set(fields)
+    if needed & GEOMETRY_FIELDS:
+        # Packed geometry is decoded from all three columns together.
+        needed.update(GEOMETRY_BINARY_COLUMNS)
+    return [c for c in PAGE_FIELDS + GEOMETRY_BINARY_COLUMNS + INTERNAL_PAGE_COLUMNS if c not in needed]
+
+def _file_etag(run_id, variant):
+    return f'W/"{run_id}-{hashlib.sha1(variant.encode("utf-8")).hexdigest()[:16]}"'
+
 @app.get("/get-file")
-def get_file(filename: str):
-    conn = get_connection()
-    
-    query_pages = f"""
-    WITH p1 AS (
-        SELECT *,
-               ROW_NUMBER() OVER (PARTITION BY preprocessed ORDER BY created_at DESC) rn
-        FROM pages
-        WHERE filename = '{filename}'
-    )
-    SELECT * FROM p1 WHERE rn = 1
-    """
-    df_pages = pd.read_sql_query(query_pages, conn)
-    
-    query_extracted = f"""
-    WITH e3 AS (
-        SELECT p.filename AS base_file, e2.*,
-               ROW_NUMBER() OVER (PARTITION BY e2.filename, e2.key ORDER BY created_at DESC) rn
-        FROM extracted2 e2
-        JOIN (SELECT filename, preprocessed FROM pages) p ON e2.filename = p.preprocessed
-        WHERE p.filename = '{filename}'
-    )
-    SELECT * FROM e3 WHERE rn = 1
-    """
-    df_extracted = pd.read_sql_query(query_extracted, conn)
-    
-    query_info = f"""
-    WITH i1 AS (
-        SELECT p.filename AS base_file, i.*,
-               ROW_NUMBER() OVER (PARTITION BY i.filename ORDER BY created_at DESC) rn
-        FROM call_info i
-        JOIN (SELECT filename, preprocessed FROM pages) p ON i.filename = p.preprocessed
-        WHERE p.filename = '{filename}'
-    )
-    SELECT * FROM i1 WHERE rn = 1
-    """
-    df_info = pd.read_sql_query(query_info, conn)
-    conn.close()
+def get_file(
+    filename: str,
+    request: Request,
+    level: str = IMAGE_DEFAULT_LEVEL,
+    page_start: int = 1,
+    page_count: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Pages, extracted values and call info of the file's current run.
 
-    # Convert each to records
-    pages = df_pages.to_dict(orient="records")
-    for page in pages:
-        page["s3_url"] = get_s3_url(page["preprocessed"])
-    extracted = df_extracted.to_dict(orient="records")
-    info = df_info.to_dict(orient="records")
+    page_start/page_count select a page range (default: all pages) and
+    `fields` is a comma-separated list of page columns to return (default: all;
+    page_number and s3_url/thumb_url are always included). extracted and info
+    are limited to the selected pages. Responses carry an ETag keyed by the
+    run, so an unchanged document revalidates with a 304.
+    """
+    requested = None
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in PAGE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown page fields: {', '.join(unknown)}")
+    page_start = max(1, page_start)
+    page_end = page_start + page_count - 1 if page_count else None
+
+    # Presigned URLs embedded in the body expire, so the ETag also changes
+    # every half URL lifetime; a revalidated body is never stale by more than that.
+    url_epoch = 0 if cookie_mode() else int(time.time() // max(1, IMAGE_URL_TTL // 2))
+    variant = f"{page_start}:{page_end}:{fields or ''}:{level}:{url_epoch}"
+
+    with read_connection() as conn:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Cheap revalidation: one indexed lookup, no page data.
+            run_id = get_current_run_id(conn, filename)
+            if run_id is not None and if_none_match == _file_etag(run_id, variant):
+                return Response(status_code=304, headers={"ETag": if_none_match, "Cache-Control": "private, no-cache"})
+        payload = fetch_file_payload(conn, filename, page_start, page_end, _excluded_page_columns(requested))
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"No processed run for {filename}")
 
-    return {
+    run_id = payload["run_id"]
+    headers = {"ETag": _file_etag(run_id, variant), "Cache-Control": "private, no-cache"}
+    pages = decode_geometry_columns(pd.DataFrame(payload["pages"])).to_dict(orient="records") if payload["pages"] else []
+    cookies = attach_page_urls(pages, level)
+    if requested is not None:
+        keep = set(requested) | {"page_number", "s3_url", "thumb_url", "dzi_url"}
+        pages = [{k: v for k, v in page.items() if k in keep} for page in pages]
+
+    last_page = pages[-1]["page_number"] if pages else None
+    total_pages = payload["total_pages"]
+    response = json_response({
         "filename": filename,
+        "run_id": run_id,
+        "total_pages": total_pages,
+        "next_page_start": last_page + 1 if page_end and last_page and total_pages and last_page < total_pages else None,
         "pages": pages,
-        "extracted": extracted,
-        "info": info
-    }
+        "extracted": payload["extracted"],
+        "info": payload["info"]
+    }, headers=headers)
+    set_cookies(response, cookies)
+    return response
+
 
+@app.get("/search")
+def search_endpoint(
+    q: str,
+    filename: Optional[str] = None,
+    source: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+):
+    """
+    Ranked full-text / fuzzy search over OCR lines and extracted values of the
+    current run of each file. Hits carry the page number and the bounding box
+    of the matching text (pixel and normalized). `source` narrows to 'line'
+    or 'value'; paginate with page/page_size while has_more is true.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty search query")
+    if source is not None and source not in ("line", "value"):
+        raise HTTPException(status_code=400, detail="source must be 'line' or 'value'")
+    with read_connection() as conn:
+        result = search(conn, q, filename=filename, source=source, page=page, page_size=page_size)
+    return json_response(dict(result, query=q))
+
+def _stringify_nested(df):
+    """Lists, dicts, sets and arrays as strings, as the /upload response has always returned them."""
+    if df is None:
+        return []
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, (list, dict, set, np.ndarray))).any():
+            df[col] = df[col].apply(lambda x: str(x.tolist() if isinstance(x, np.ndarray) else x)
+                                    if isinstance(x, (list, dict, set, np.ndarray)) else x)
+    return df.to_dict(orient="records")
+
+def upload_key(content_hash, filename):
+    """Single-flight / advisory-lock key of an upload: its bytes and the filename its run is stored under."""
+    return hashlib.sha256(f"{content_hash}\0{filename}".encode("utf-8")).hexdigest()
+
+def process_upload(file_path, content_hash):
+    """
+    Process an uploaded file once per content hash and filename. Runs under an
+    advisory lock on both, so another API worker receiving the same file waits
+    and then reuses the completed run instead of processing it again. The same
+    bytes under another filename get their own run, so /get-file finds it.
+    Returns the /upload response body without image URLs.
+    """
+    filename = os.path.basename(file_path)
+    lock_conn = get_connection()
+    try:
+        with content_lock(lock_conn, upload_key(content_hash, filename)):
+            completed = find_completed_run(lock_conn, content_hash, filename)
+            if completed is not None:
+                run_id, filename = completed
+                with read_connection() as conn:
+                    payload = fetch_file_payload(conn, filename)
+                if payload is not None and payload["run_id"] == run_id:
+                    pages = decode_geometry_columns(pd.DataFrame(payload["pages"])) if payload["pages"] else None
+                    return {
+                        "filename": filename,
+                        "pages": _stringify_nested(pages),
+                        "extracted": payload["extracted"],
+                        "info": payload["info"],
+                        "message": "Identical file already processed; returning the stored results",
+                    }
+
+            df_pages, df_extracted, df_info = process_file(file_path, save_to_db=True, content_hash=content_hash)
+            # Run entity matching after processing the file
+            match_entities_for_file(os.path.basename(file_path))
+            flush_spans()
+            return {
+                "filename": os.path.basename(file_path),
+                "pages": _stringify_nested(df_pages),
+                "extracted": _stringify_nested(df_extracted),
+                "info": _stringify_nested(df_info),
+                "message": "File processed successfully and saved to database",
+            }
+    finally:
+        lock_conn.close()
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
+    """
+    Process an uploaded file. The body is hashed while it is written to
+    uploaded_samples/<sha256>/<filename>; concurrent uploads of the same bytes
+    and filename share one pipeline run, and re-uploads are served from the
+    completed run.
+    """
     try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Process the file and save to database in one step
-        df_pages, df_extracted, df_info = process_file(file_path, save_to_db=True)
-
-        # Fix non-serializable columns for JSON response
-        for df in [df_pages, df_extracted, df_info]:
-            if df is not None:  # Check if df is not None before processing
-                for col in df.columns:
-                    if df[col].apply(lambda x: isinstance(x, (list, dict, set))).any():
-                        df[col] = df[col].apply(lambda x: str(x) if isinstance(x, (list, dict, set)) else x)
-        
-        pages = df_pages.to_dict(orient="records")
-        for page in pages:
-            page["s3_url"] = get_s3_url(page["preprocessed"])
-
-        extracted = df_extracted.to_dict(orient="records") if df_extracted is not None else []
-        info = df_info.to_dict(orient="records") if df_info is not None else []
-
-        if extracted:
-            print(extracted[0])
-        
-        # Run entity matching after processing the file
-        match_entities_for_file(os.path.basename(file_path))
-
-        return JSONResponse({
-            "filename": file.filename,
-            "pages": pages,
-            "extracted": extracted,
-            "info": info,
-            "message": "File processed successfully and saved to database"
-        })
+        content_hash, file_path = await receive_upload(file, UPLOAD_DIR)
+        body, shared = await upload_flight.do_async(upload_key(content_hash, os.path.basename(file_path)),
+                                                    lambda: process_upload(file_path, content_hash))
+        # Each response gets its own copy of the page dicts and freshly signed URLs.
+        pages = [{k: v for k, v in page.items() if k not in INTERNAL_PAGE_COLUMNS} for page in body["pages"]]
+        cookies = attach_page_urls(pages, IMAGE_DEFAULT_LEVEL)
+        response = json_response(dict(body, pages=pages, content_hash=content_hash, shared=shared))
+        set_cookies(response, cookies)
+        return response
     except Exception as e:
         # Log the exception details
         import traceback
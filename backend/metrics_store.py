@@ -0,0 +1,157 @@
+"""
+Incrementally maintained metrics for metrics_ui.
+
+Aggregates are updated when a run is stored (document_ui.store_results_to_db),
+so the dashboard reads O(labels x days) rows no matter how large `pages` grows.
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime, timezone
+import psycopg2.extras
+
+from query_cache import bump_table_versions
+
+# Upper bounds (seconds) of the latency histogram buckets; a final +inf bucket follows.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Per-page timing columns written by fast_processor_gemini, keyed by stage name.
+STAGE_COLUMNS = {
+    "render": "render_time",
+    "ocr": "ocr_time",
+    "preprocess": "preprocess_time",
+    "classify": "classify_time",
+    "extract": "extract_time",
+}
+
+
+def latency_bucket(seconds):
+    """Index of the histogram bucket for a latency in seconds."""
+    return bisect.bisect_left(LATENCY_BUCKETS, seconds)
+
+
+def _apply_run_pages(cursor, run_id, sign):
+    cursor.execute("""
+        INSERT INTO page_metrics_daily (day, page_label, clf_type, page_count, confidence_sum)
+        SELECT r.created_at::date,
+               COALESCE(p.page_label, 'unknown'),
+               COALESCE(p.clf_type, 'none'),
+               %(sign)s * COUNT(*),
+               %(sign)s * COALESCE(SUM(p.page_confidence), 0)
+        FROM pages p
+        JOIN document_runs r ON r.run_id = p.run_id
+        WHERE p.run_id = %(run_id)s
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, page_label, clf_type) DO UPDATE
+        SET page_count = page_metrics_daily.page_count + EXCLUDED.page_count,
+            confidence_sum = page_metrics_daily.confidence_sum + EXCLUDED.confidence_sum
+    """, {"run_id": run_id, "sign": sign})
+
+
+def record_run_metrics(conn, run_id, superseded_run_id=None):
+    """
+    Add a newly completed run's pages to page_metrics_daily and subtract the
+    run it superseded. Only reads the pages of those two runs.
+    """
+    cursor = conn.cursor()
+    _apply_run_pages(cursor, run_id, 1)
+    if superseded_run_id is not None:
+        _apply_run_pages(cursor, superseded_run_id, -1)
+    bump_table_versions(cursor, ["page_metrics_daily"])
+    conn.commit()
+    cursor.close()
+
+
+def record_stage_latency(conn, samples, day=None):
+    """
+    Fold latency samples into stage_latency_daily.
+
+    Args:
+        samples: iterable of (stage, page_label, seconds).
+        day: date the samples belong to. Defaults to today (UTC).
+    """
+    day = day or datetime.now(timezone.utc).date()
+    agg = defaultdict(lambda: [0, 0.0])
+    for stage, page_label, seconds in samples:
+        if seconds is None or seconds != seconds:  # skip missing / NaN
+            continue
+        key = (stage, page_label or "none", latency_bucket(seconds))
+        agg[key][0] += 1
+        agg[key][1] += float(seconds)
+    if not agg:
+        return
+    rows = [(day, stage, label, bucket, count, total) for (stage, label, bucket), (count, total) in agg.items()]
+    cursor = conn.cursor()
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO stage_latency_daily (day, stage, page_label, bucket, sample_count, total_seconds)
+        VALUES %s
+        ON CONFLICT (day, stage, page_label, bucket) DO UPDATE
+        SET sample_count = stage_latency_daily.sample_count + EXCLUDED.sample_count,
+            total_seconds = stage_latency_daily.total_seconds + EXCLUDED.total_seconds
+    """, rows)
+    bump_table_versions(cursor, ["stage_latency_daily"])
+    conn.commit()
+    cursor.close()
+
+
+def stage_samples_from_pages(df_pages):
+    """
+    Turn the per-page timing columns of df_pages into (stage, page_label, seconds)
+    samples. Pages read from the PDF text layer report their OCR time as the
+    "text_layer" stage so they don't skew the Cloud Vision latencies.
+    """
+    samples = []
+    for row in df_pages.to_dict(orient="records"):
+        for stage, col in STAGE_COLUMNS.items():
+            if col in row:
+                if stage == "ocr" and row.get("ocr_source") == "text_layer":
+                    stage = "text_layer"
+                samples.append((stage, row.get("page_label"), row[col]))
+    return samples
+
+
+def histogram_quantile(q, counts):
+    """
+    Estimate a quantile from bucket counts (Prometheus-style linear interpolation
+    within the bucket). `counts` is indexed like LATENCY_BUCKETS plus +inf.
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if seen + count >= rank and count > 0:
+            if i >= len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[-1]
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            return lower + (LATENCY_BUCKETS[i] - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+def rebuild_page_metrics(conn):
+    """Recompute page_metrics_daily from the current runs (repair / initial load)."""
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE page_metrics_daily")
+    cursor.execute("""
+        INSERT INTO page_metrics_daily (day, page_label, clf_type, page_count, confidence_sum)
+        SELECT r.created_at::date, COALESCE(p.page_label, 'unknown'), COALESCE(p.clf_type, 'none'),
+               COUNT(*), COALESCE(SUM(p.page_confidence), 0)
+        FROM document_runs r
+        JOIN pages p ON p.run_id = r.run_id
+        WHERE r.is_current
+        GROUP BY 1, 2, 3
+    """)
+    bump_table_versions(cursor, ["page_metrics_daily"])
+    conn.commit()
+    cursor.close()
+
+
+if __name__ == "__main__":
+    from entity_matcher import get_db_connection
+    conn = get_db_connection()
+    try:
+        rebuild_page_metrics(conn)
+        print("Rebuilt page_metrics_daily from current runs.")
+    finally:
+        conn.close()
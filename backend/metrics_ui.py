@@ -2,6 +2,8 @@ import streamlit as st
 import os
 import psycopg2
 import pandas as pd
+from metrics_store import LATENCY_BUCKETS, histogram_quantile
+from query_cache import cached_read_sql
 
 def get_connection():
     user = os.environ.get("SUPABASE_USER")
@@ -21,20 +23,14 @@ def get_connection():
 def page_performance():
     conn = get_connection()
     query = '''
-    WITH most_recent_runs AS (
-        SELECT page_label, 
-               preprocessed,
-               page_number,
-               page_confidence, 
-               ROW_NUMBER() OVER (PARTITION BY preprocessed ORDER BY created_at DESC) AS rn
-        FROM pages
-    )
-    SELECT page_label, COUNT(*) AS page_count, AVG(page_confidence) AS agg_avg_conf
-    FROM most_recent_runs
-    WHERE rn = 1
+    SELECT page_label,
+           SUM(page_count) AS page_count,
+           SUM(confidence_sum) / NULLIF(SUM(page_count), 0) AS agg_avg_conf
+    FROM page_metrics_daily
     GROUP BY page_label
+    HAVING SUM(page_count) > 0
     '''
-    df_results = pd.read_sql_query(query, conn)
+    df_results = cached_read_sql(query, conn)
     conn.close()
     st.dataframe(df_results)
 
@@ -42,15 +38,106 @@ def clf_performance():
     conn = get_connection()
     query = '''    
     SELECT clf_type, 
-           COUNT(*) AS page_count, 
-           AVG(page_confidence) AS agg_avg_conf
-    FROM pages
+           SUM(page_count) AS page_count, 
+           SUM(confidence_sum) / NULLIF(SUM(page_count), 0) AS agg_avg_conf
+    FROM page_metrics_daily
     GROUP BY clf_type
+    HAVING SUM(page_count) > 0
     '''
-    df_results = pd.read_sql_query(query, conn)
+    df_results = cached_read_sql(query, conn)
     conn.close()
     st.dataframe(df_results)
 
+def stage_latency():
+    conn = get_connection()
+    query = '''
+    SELECT day, stage, bucket, SUM(sample_count) AS sample_count, SUM(total_seconds) AS total_seconds
+    FROM stage_latency_daily
+    GROUP BY day, stage, bucket
+    '''
+    df = cached_read_sql(query, conn)
+    conn.close()
+    if df.empty:
+        st.write("No stage timings recorded yet.")
+        return
+
+    n_buckets = len(LATENCY_BUCKETS) + 1
+    summary = []
+    for stage, df_stage in df.groupby("stage"):
+        counts = df_stage.groupby("bucket")["sample_count"].sum().reindex(range(n_buckets), fill_value=0).tolist()
+        samples = df_stage["sample_count"].sum()
+        summary.append({
+            "stage": stage,
+            "samples": samples,
+            "mean_s": df_stage["total_seconds"].sum() / samples if samples else None,
+            "p50_s": histogram_quantile(0.5, counts),
+            "p95_s": histogram_quantile(0.95, counts),
+        })
+    st.dataframe(pd.DataFrame(summary), hide_index=True)
+
+    daily = df.groupby(["day", "stage"])[["sample_count", "total_seconds"]].sum().reset_index()
+    daily["mean_s"] = daily["total_seconds"] / daily["sample_count"]
+    st.line_chart(daily.pivot(index="day", columns="stage", values="mean_s"))
+
+def triage_counts():
+    conn = get_connection()
+    query = '''
+    SELECT day, page_label, SUM(page_count) AS page_count
+    FROM page_metrics_daily
+    WHERE clf_type = 'triage'
+    GROUP BY day, page_label
+    HAVING SUM(page_count) > 0
+    '''
+    df = cached_read_sql(query, conn)
+    conn.close()
+    if df.empty:
+        st.write("No pages have been skipped by triage yet.")
+        return
+    st.dataframe(df.groupby("page_label")["page_count"].sum().reset_index(), hide_index=True)
+    st.bar_chart(df.pivot_table(index="day", columns="page_label", values="page_count", aggfunc="sum"))
+
+def extraction_tokens():
+    conn = get_connection()
+    query = '''
+    SELECT COALESCE(crop_mode, 'full') AS crop_mode,
+           COUNT(*) AS calls,
+           AVG(crop_regions) AS avg_regions,
+           AVG(crop_area) AS avg_area,
+           AVG(prompt_token_count) AS avg_prompt_tokens,
+           AVG(total_token_count) AS avg_total_tokens
+    FROM call_info
+    WHERE created_at >= NOW() - INTERVAL '30 days'
+    GROUP BY COALESCE(crop_mode, 'full')
+    '''
+    df = cached_read_sql(query, conn)
+    conn.close()
+    if df.empty:
+        st.write("No extraction calls in the last 30 days.")
+        return
+    st.dataframe(df, hide_index=True)
+
+def extraction_tiers():
+    conn = get_connection()
+    query = '''
+    SELECT tier,
+           model_version,
+           COUNT(*) AS calls,
+           AVG(latency_ms) AS avg_latency_ms,
+           AVG(total_token_count) AS avg_total_tokens,
+           AVG(CASE WHEN escalated_fields > 0 THEN 1.0 ELSE 0.0 END) AS escalation_rate,
+           SUM(escalated_fields) AS escalated_fields
+    FROM call_info
+    WHERE created_at >= NOW() - INTERVAL '30 days' AND tier IS NOT NULL
+    GROUP BY tier, model_version
+    ORDER BY tier, model_version
+    '''
+    df = cached_read_sql(query, conn)
+    conn.close()
+    if df.empty:
+        st.write("No tiered extraction calls in the last 30 days.")
+        return
+    st.dataframe(df, hide_index=True)
+
 st.info('This page shows performance metrics of classification and extraction methods.')
 
 with st.expander("Page Statistics"):
@@ -60,3 +147,19 @@ with st.expander("Page Statistics"):
 with st.expander("Classifier Performance"):
     st.info('Performance by Classifier')
     clf_performance()
+
+with st.expander("Page Triage"):
+    st.info('Blank, separator and near-empty pages labelled before OCR (blank and separator pages skip OCR, classification and extraction).')
+    triage_counts()
+
+with st.expander("Stage Latency"):
+    st.info('Per-page latency by pipeline stage (render, OCR, preprocess, classify, extract) and per-run DB write time. Percentiles are estimated from histogram buckets.')
+    stage_latency()
+
+with st.expander("Extraction Tokens"):
+    st.info('Gemini tokens per extraction call over the last 30 days, for calls sent region crops (roi) versus the whole page (full).')
+    extraction_tokens()
+
+with st.expander("Extraction Tiers"):
+    st.info('Extraction calls per model tier over the last 30 days: latency, tokens, and the share of calls whose fields failed validation and went to the next tier.')
+    extraction_tiers()
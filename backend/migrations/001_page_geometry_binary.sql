@@ -0,0 +1,11 @@
+-- Packed OCR geometry for pages (see geometry_codec.py).
+-- Enabled per deployment with GEOMETRY_STORAGE=binary. Existing rows can be
+-- converted with `python geometry_codec.py`.
+
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS words_bin BYTEA;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS bboxes_bin BYTEA;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS normalized_bboxes_bin BYTEA;
+
+-- Box arrays are dense binary and do not compress; skip TOAST compression attempts.
+ALTER TABLE pages ALTER COLUMN bboxes_bin SET STORAGE EXTERNAL;
+ALTER TABLE pages ALTER COLUMN normalized_bboxes_bin SET STORAGE EXTERNAL;
@@ -0,0 +1,75 @@
+-- Current-version model for processed documents (see document_runs.py).
+-- Every ingest of a file creates one run; exactly one completed run per
+-- filename is flagged is_current. Reads join on the current run instead of
+-- computing ROW_NUMBER() over the whole history.
+
+CREATE TABLE IF NOT EXISTS document_runs (
+    run_id BIGSERIAL PRIMARY KEY,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',  -- running | complete | failed
+    is_current BOOLEAN NOT NULL DEFAULT FALSE,
+    page_count INTEGER,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    completed_at TIMESTAMP
+);
+
+-- At most one current run per file; also the lookup index for /get-file.
+CREATE UNIQUE INDEX IF NOT EXISTS document_runs_current_filename_idx
+    ON document_runs (filename) WHERE is_current;
+-- Drives the "all current runs" scans (metrics, list-files).
+CREATE INDEX IF NOT EXISTS document_runs_current_created_idx
+    ON document_runs (created_at DESC) WHERE is_current;
+
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS run_id BIGINT;
+ALTER TABLE extracted2 ADD COLUMN IF NOT EXISTS run_id BIGINT;
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS run_id BIGINT;
+
+CREATE INDEX IF NOT EXISTS pages_run_id_idx ON pages (run_id, page_number);
+CREATE INDEX IF NOT EXISTS extracted2_run_id_idx ON extracted2 (run_id);
+CREATE INDEX IF NOT EXISTS call_info_run_id_idx ON call_info (run_id);
+-- Used by the backfill below to find the page run an extracted row belongs to.
+CREATE INDEX IF NOT EXISTS pages_preprocessed_created_at_idx ON pages (preprocessed, created_at);
+
+-- Backfill: each (filename, created_at) batch in pages becomes one completed run.
+INSERT INTO document_runs (filename, status, page_count, created_at, completed_at)
+SELECT filename, 'complete', COUNT(*), created_at, created_at
+FROM pages
+WHERE run_id IS NULL
+GROUP BY filename, created_at;
+
+UPDATE pages p
+SET run_id = r.run_id
+FROM document_runs r
+WHERE p.run_id IS NULL
+  AND r.filename = p.filename
+  AND r.created_at = p.created_at;
+
+UPDATE document_runs r
+SET is_current = TRUE
+FROM (
+    SELECT DISTINCT ON (filename) run_id
+    FROM document_runs
+    WHERE status = 'complete'
+    ORDER BY filename, created_at DESC, run_id DESC
+) latest
+WHERE r.run_id = latest.run_id
+  AND NOT EXISTS (SELECT 1 FROM document_runs c WHERE c.filename = r.filename AND c.is_current);
+
+-- extracted2 / call_info rows are keyed by the page's preprocessed image; attach
+-- each to the latest page run written at or before it.
+UPDATE extracted2 e
+SET run_id = (
+    SELECT p.run_id FROM pages p
+    WHERE p.preprocessed = e.filename AND p.created_at <= e.created_at
+    ORDER BY p.created_at DESC LIMIT 1
+)
+WHERE e.run_id IS NULL;
+
+UPDATE call_info i
+SET run_id = (
+    SELECT p.run_id FROM pages p
+    WHERE p.preprocessed = i.filename AND p.created_at <= i.created_at
+    ORDER BY p.created_at DESC LIMIT 1
+)
+WHERE i.run_id IS NULL;
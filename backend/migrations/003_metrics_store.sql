@@ -0,0 +1,42 @@
+-- Pre-aggregated metrics maintained at ingest time (see metrics_store.py).
+-- metrics_ui reads these instead of scanning pages on every render.
+
+-- Page counts and confidence sums for the current run of every file, by the
+-- day the run was ingested. When a file is re-processed the superseded run's
+-- contribution is subtracted, so totals match the old ROW_NUMBER() semantics.
+CREATE TABLE IF NOT EXISTS page_metrics_daily (
+    day DATE NOT NULL,
+    page_label TEXT NOT NULL,
+    clf_type TEXT NOT NULL,
+    page_count BIGINT NOT NULL DEFAULT 0,
+    confidence_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, page_label, clf_type)
+);
+
+-- Per-stage latency histograms. One row per (day, stage, page_label, bucket);
+-- bucket i counts samples <= metrics_store.LATENCY_BUCKETS[i] (the last bucket is +inf).
+CREATE TABLE IF NOT EXISTS stage_latency_daily (
+    day DATE NOT NULL,
+    stage TEXT NOT NULL,
+    page_label TEXT NOT NULL,
+    bucket SMALLINT NOT NULL,
+    sample_count BIGINT NOT NULL DEFAULT 0,
+    total_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, stage, page_label, bucket)
+);
+
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS render_time REAL;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS ocr_time REAL;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS preprocess_time REAL;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS classify_time REAL;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS extract_time REAL;
+
+-- Initial load from the current runs (same as `python metrics_store.py`).
+INSERT INTO page_metrics_daily (day, page_label, clf_type, page_count, confidence_sum)
+SELECT r.created_at::date, COALESCE(p.page_label, 'unknown'), COALESCE(p.clf_type, 'none'),
+       COUNT(*), COALESCE(SUM(p.page_confidence), 0)
+FROM document_runs r
+JOIN pages p ON p.run_id = r.run_id
+WHERE r.is_current
+GROUP BY 1, 2, 3
+ON CONFLICT DO NOTHING;
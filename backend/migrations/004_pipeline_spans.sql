@@ -0,0 +1,18 @@
+-- Per-page, per-stage pipeline spans (see tracing.py). Only written when
+-- PIPELINE_TRACING=1.
+
+CREATE TABLE IF NOT EXISTS pipeline_spans (
+    span_id BIGSERIAL PRIMARY KEY,
+    trace_id TEXT NOT NULL,
+    run_id BIGINT,
+    filename TEXT,
+    page_number INTEGER,
+    stage TEXT NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    error TEXT,
+    attributes JSONB
+);
+
+CREATE INDEX IF NOT EXISTS pipeline_spans_run_id_idx ON pipeline_spans (run_id);
+CREATE INDEX IF NOT EXISTS pipeline_spans_stage_started_idx ON pipeline_spans (stage, started_at);
@@ -0,0 +1,4 @@
+-- Renditions written next to each page's preprocessed image (see image_pyramid.py),
+-- e.g. 'thumb,preview,full'. NULL for pages ingested before renditions existed;
+-- /get-file falls back to the full image for those.
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS image_levels TEXT;
@@ -0,0 +1,70 @@
+-- Read path for /get-file (see file_queries.py): one function call returns the
+-- pages, extracted values and call info of a file's current run as JSON, so the
+-- endpoint makes one round trip through a prepared statement.
+
+-- entity_matcher's cross-page merge: pages WHERE filename = $1 [AND run_id = $2].
+CREATE INDEX IF NOT EXISTS pages_filename_idx ON pages (filename);
+-- Run backfill and "latest page row for a preprocessed image" lookups (also created by 002).
+CREATE INDEX IF NOT EXISTS pages_preprocessed_created_at_idx ON pages (preprocessed, created_at);
+-- Page -> extracted rows join below and entity_matcher.fetch_extracted_data
+-- (filename = $1 AND page_num = $2 AND run_id = $3), ordered like the old
+-- ROW_NUMBER() OVER (PARTITION BY filename, key ORDER BY created_at DESC).
+CREATE INDEX IF NOT EXISTS extracted2_filename_key_created_idx ON extracted2 (filename, key, created_at);
+CREATE INDEX IF NOT EXISTS call_info_filename_idx ON call_info (filename);
+
+-- p_exclude drops page columns the caller didn't ask for (e.g. OCR geometry)
+-- before they are serialized. Returns NULL when the file has no current run.
+-- plpgsql so the inner statements' plans are cached per session.
+CREATE OR REPLACE FUNCTION get_file_payload(
+    p_filename TEXT,
+    p_page_start INTEGER DEFAULT 1,
+    p_page_end INTEGER DEFAULT NULL,
+    p_exclude TEXT[] DEFAULT '{}'
+) RETURNS JSONB
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    v_run_id BIGINT;
+    v_page_count INTEGER;
+    v_pages JSONB;
+    v_extracted JSONB;
+    v_info JSONB;
+BEGIN
+    SELECT run_id, page_count INTO v_run_id, v_page_count
+    FROM document_runs
+    WHERE filename = p_filename AND is_current;
+    IF v_run_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(p) - p_exclude ORDER BY p.page_number), '[]'::jsonb)
+    INTO v_pages
+    FROM pages p
+    WHERE p.run_id = v_run_id
+      AND p.page_number >= p_page_start
+      AND (p_page_end IS NULL OR p.page_number <= p_page_end);
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(e) || jsonb_build_object('base_file', p_filename)), '[]'::jsonb)
+    INTO v_extracted
+    FROM pages p
+    JOIN extracted2 e ON e.filename = p.preprocessed AND e.run_id = p.run_id
+    WHERE p.run_id = v_run_id
+      AND p.page_number >= p_page_start
+      AND (p_page_end IS NULL OR p.page_number <= p_page_end);
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(i) || jsonb_build_object('base_file', p_filename)), '[]'::jsonb)
+    INTO v_info
+    FROM pages p
+    JOIN call_info i ON i.filename = p.preprocessed AND i.run_id = p.run_id
+    WHERE p.run_id = v_run_id
+      AND p.page_number >= p_page_start
+      AND (p_page_end IS NULL OR p.page_number <= p_page_end);
+
+    RETURN jsonb_build_object(
+        'run_id', v_run_id,
+        'total_pages', v_page_count,
+        'pages', v_pages,
+        'extracted', v_extracted,
+        'info', v_info
+    );
+END;
+$$;
@@ -0,0 +1,8 @@
+-- Per-table write counters for the query result cache (see query_cache.py).
+-- Writers bump the tables they changed in the same transaction; cached reads
+-- are served only while the versions of the tables they read are unchanged.
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
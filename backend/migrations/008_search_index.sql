@@ -0,0 +1,25 @@
+-- Search index over OCR lines and extracted values (see search_index.py).
+-- Rows are written at ingest with the run that produced them; search joins
+-- document_runs on is_current, and superseded runs' rows are pruned.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS page_search (
+    id BIGSERIAL PRIMARY KEY,
+    run_id BIGINT NOT NULL REFERENCES document_runs (run_id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,         -- pages.filename
+    preprocessed TEXT NOT NULL,     -- pages.preprocessed
+    page_number INTEGER,
+    source TEXT NOT NULL,           -- 'line' (OCR line) or 'value' (extracted2 value)
+    key TEXT,                       -- extracted2.key for values
+    content TEXT NOT NULL,
+    bbox INTEGER[],                 -- [x1, y1, x2, y2] in page pixels
+    normalized_bbox REAL[],
+    -- 'simple' config: no stemming or stop words, so names, EINs and amounts match as written.
+    tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+);
+
+CREATE INDEX IF NOT EXISTS page_search_tsv_idx ON page_search USING GIN (tsv);
+CREATE INDEX IF NOT EXISTS page_search_content_trgm_idx ON page_search USING GIN (content gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS page_search_run_id_idx ON page_search (run_id);
+-- Search filtered to one file.
+CREATE INDEX IF NOT EXISTS page_search_filename_idx ON page_search (filename);
@@ -0,0 +1,4 @@
+-- Where a page's words and boxes came from (see text_layer.py):
+-- 'text_layer' for the PDF's embedded text, 'vision' for Cloud Vision OCR.
+-- NULL for pages ingested before the text-layer fast path (all OCR'd).
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS ocr_source TEXT;
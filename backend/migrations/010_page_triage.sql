@@ -0,0 +1,5 @@
+-- Pre-OCR page triage (see page_triage.py). Blank and separator pages are
+-- stored with ocr_source = 'none', clf_type = 'triage' and the triage label as
+-- page_label, so they are counted in page_metrics_daily like any other label.
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS triage_label TEXT;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS ink_density REAL;
@@ -0,0 +1,11 @@
+-- Perceptual hashes for near-duplicate page reuse (see phash_index.py).
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS phash BIGINT;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS phash_fine BYTEA;
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS reused_from TEXT;
+
+-- Multi-index hashing: one index per 16-bit band of the 64-bit hash. A lookup
+-- probes each band with every value within d // 4 bits and ORs the four scans.
+CREATE INDEX IF NOT EXISTS pages_phash_band0_idx ON pages (((phash >> 48) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS pages_phash_band1_idx ON pages (((phash >> 32) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS pages_phash_band2_idx ON pages (((phash >> 16) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS pages_phash_band3_idx ON pages (((phash >> 0) & 65535)) WHERE phash IS NOT NULL;
@@ -0,0 +1,4 @@
+-- SHA-256 of the uploaded file for each run (see single_flight.py). /upload
+-- serves a re-upload of identical bytes from the completed current run.
+ALTER TABLE document_runs ADD COLUMN IF NOT EXISTS content_hash TEXT;
+CREATE INDEX IF NOT EXISTS document_runs_content_hash_idx ON document_runs (content_hash) WHERE is_current;
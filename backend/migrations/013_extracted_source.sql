@@ -0,0 +1,7 @@
+-- Where an extracted value came from (see zonal_extractor.py):
+-- 'zonal' (read from the OCR words in the field's labels.json target region),
+-- 'gemini' (model extraction) or 'reused' (copied from a near-duplicate page).
+-- confidence is the zonal match confidence, NULL for other sources.
+-- NULL source for values extracted before zonal extraction (all Gemini).
+ALTER TABLE extracted2 ADD COLUMN IF NOT EXISTS source TEXT;
+ALTER TABLE extracted2 ADD COLUMN IF NOT EXISTS confidence REAL;
@@ -0,0 +1,4 @@
+-- Serialized grid index over the page's normalized word boxes (see
+-- spatial_index.py), built during OCR so geometry queries don't rebuild it.
+-- NULL for pages without words and for pages ingested before it existed.
+ALTER TABLE pages ADD COLUMN IF NOT EXISTS word_index BYTEA;
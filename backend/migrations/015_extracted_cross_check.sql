@@ -0,0 +1,10 @@
+-- Pattern-based identifier extraction (see identifier_extractor.py).
+-- extracted2.source gains 'pattern' for EIN / SSN last-4 / tax year values
+-- read with validated patterns instead of the model. cross_check records,
+-- for model values of identifier, date and amount fields, whether the value
+-- validates and appears on the page ('match') or not ('mismatch'); NULL when
+-- not checked.
+ALTER TABLE extracted2 ADD COLUMN IF NOT EXISTS cross_check TEXT;
+
+CREATE INDEX IF NOT EXISTS extracted2_cross_check_mismatch_idx
+    ON extracted2 (run_id) WHERE cross_check = 'mismatch';
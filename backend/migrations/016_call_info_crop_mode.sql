@@ -0,0 +1,8 @@
+-- Region-of-interest crops for Gemini extraction (see roi_crop.py).
+-- crop_mode is 'roi' when the call was sent crops of the regions holding the
+-- requested fields, 'full' when it was sent the whole page; crop_regions is
+-- the number of images sent and crop_area the share of the page they cover.
+-- Compare prompt_token_count by crop_mode to measure the savings.
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS crop_mode TEXT;
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS crop_regions INTEGER;
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS crop_area REAL;
@@ -0,0 +1,9 @@
+-- Model tiers for extraction (see extraction_policy.py). A page's fields go
+-- to the cheapest model of its tiers first; fields failing validation are
+-- asked again of the next tier, so a page can have several call_info rows.
+-- tier is the 0-based position of the call's model in the tiers,
+-- latency_ms the call's wall time including retries, escalated_fields the
+-- number of fields this call passed on to the next tier.
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS tier INTEGER;
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS latency_ms REAL;
+ALTER TABLE call_info ADD COLUMN IF NOT EXISTS escalated_fields INTEGER;
@@ -0,0 +1,94 @@
+"""
+Cheap pre-OCR triage of rendered pages.
+
+Scanned packets carry blank backs, separator sheets and near-empty pages (fax
+covers, "intentionally left blank"). triage_page() looks at a small grayscale
+thumbnail of the render - a few milliseconds - and labels them:
+
+    blank_page        almost no ink: skips OCR, denoising, classification and extraction
+    separator_page    a uniform coloured/dark sheet or mostly solid fill: skipped like blank pages
+    near_empty_page   little ink: OCR'd, but only keyword classification is tried
+                      (no BART/CLIP fallbacks) and nothing is extracted
+
+"Ink" is measured against the page's own paper colour (a high percentile of
+the thumbnail), so grey or yellowed scans aren't mistaken for content. The
+thumbnail is box-filtered, which averages scanner speckle away; a margin is
+ignored for punch holes and scan edges.
+
+Environment:
+    PAGE_TRIAGE_ENABLED           1/0 (default 1)
+    TRIAGE_THUMB_WIDTH            thumbnail width in pixels (default 256)
+    TRIAGE_MARGIN                 fraction of each edge ignored (default 0.05)
+    TRIAGE_INK_CONTRAST           grey levels below the paper colour that count as ink (default 60)
+    TRIAGE_BLANK_INK              max ink fraction of a blank page (default 0.002)
+    TRIAGE_NEAR_EMPTY_INK         max ink fraction of a near-empty page (default 0.015)
+    TRIAGE_SEPARATOR_DARK         min fraction of dark pixels on a separator page (default 0.6)
+    TRIAGE_UNIFORM_STD            max brightness std-dev of a uniform sheet (default 6)
+    TRIAGE_UNIFORM_MAX_MEAN       a uniform sheet darker than this is a separator, not paper (default 200)
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+PAGE_TRIAGE_ENABLED = os.environ.get("PAGE_TRIAGE_ENABLED", "1").lower() in ("1", "true", "yes")
+TRIAGE_THUMB_WIDTH = int(os.environ.get("TRIAGE_THUMB_WIDTH", "256"))
+TRIAGE_MARGIN = float(os.environ.get("TRIAGE_MARGIN", "0.05"))
+TRIAGE_INK_CONTRAST = float(os.environ.get("TRIAGE_INK_CONTRAST", "60"))
+TRIAGE_BLANK_INK = float(os.environ.get("TRIAGE_BLANK_INK", "0.002"))
+TRIAGE_NEAR_EMPTY_INK = float(os.environ.get("TRIAGE_NEAR_EMPTY_INK", "0.015"))
+TRIAGE_SEPARATOR_DARK = float(os.environ.get("TRIAGE_SEPARATOR_DARK", "0.6"))
+TRIAGE_UNIFORM_STD = float(os.environ.get("TRIAGE_UNIFORM_STD", "6"))
+TRIAGE_UNIFORM_MAX_MEAN = float(os.environ.get("TRIAGE_UNIFORM_MAX_MEAN", "200"))
+
+BLANK_PAGE = "blank_page"
+SEPARATOR_PAGE = "separator_page"
+NEAR_EMPTY_PAGE = "near_empty_page"
+TRIAGE_LABELS = (BLANK_PAGE, SEPARATOR_PAGE, NEAR_EMPTY_PAGE)
+# Pages with these labels are never OCR'd, classified or extracted.
+SKIP_LABELS = (BLANK_PAGE, SEPARATOR_PAGE)
+
+try:
+    from prometheus_client import Counter
+    TRIAGE_PAGES = Counter("xaio_page_triage_total", "Pages by pre-OCR triage result.", ["result"])
+except ImportError:
+    TRIAGE_PAGES = None
+
+
+def _thumbnail(image):
+    width, height = image.size
+    scale = min(1.0, TRIAGE_THUMB_WIDTH / max(1, width))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    thumb = image.convert("L") if scale == 1.0 else image.resize(size, Image.BOX).convert("L")
+    arr = np.asarray(thumb, dtype=np.float32)
+    my, mx = int(arr.shape[0] * TRIAGE_MARGIN), int(arr.shape[1] * TRIAGE_MARGIN)
+    return arr[my:arr.shape[0] - my or None, mx:arr.shape[1] - mx or None]
+
+
+def triage_page(image):
+    """
+    (label, ink_density) for a rendered page (PIL image). label is one of
+    TRIAGE_LABELS, or None for a page with regular content.
+    """
+    if not PAGE_TRIAGE_ENABLED:
+        return None, None
+    arr = _thumbnail(image)
+    if arr.size == 0:
+        return None, None
+    paper = float(np.percentile(arr, 95))
+    ink_density = float(np.mean(arr < paper - TRIAGE_INK_CONTRAST))
+    dark_fraction = float(np.mean(arr < 96))
+
+    if dark_fraction >= TRIAGE_SEPARATOR_DARK:
+        label = SEPARATOR_PAGE
+    elif float(arr.std()) <= TRIAGE_UNIFORM_STD and float(arr.mean()) < TRIAGE_UNIFORM_MAX_MEAN:
+        label = SEPARATOR_PAGE
+    elif ink_density <= TRIAGE_BLANK_INK:
+        label = BLANK_PAGE
+    elif ink_density <= TRIAGE_NEAR_EMPTY_INK:
+        label = NEAR_EMPTY_PAGE
+    else:
+        label = None
+    if TRIAGE_PAGES is not None:
+        TRIAGE_PAGES.labels(result=label or "content").inc()
+    return label, ink_density
@@ -0,0 +1,207 @@
+"""
+Perceptual-hash lookup of previously processed pages.
+
+The same K-1s, licenses and ACORD certificates arrive in many packets. Each
+rendered page gets two difference hashes (dHash) of its grayscale image:
+
+    phash        64 bits (8x8) - stored in pages.phash and used to find candidates
+    phash_fine   1024 bits (32x32) - stored in pages.phash_fine and used to verify them
+
+Candidates are found with multi-index hashing: the 64-bit hash is split into
+four 16-bit bands, each with an expression index on pages
+(migrations/011_page_hashes.sql). If two hashes are within distance d, one
+band is within d // 4 bits (pigeonhole). So probing every band value within
+that radius (17 values per band for d < 8) finds all matches through four
+index lookups, however many pages there are.
+
+A candidate is reused only if:
+- its coarse distance is <= PHASH_MAX_DISTANCE;
+- its aspect ratio matches;
+- its fine hash differs in at most PHASH_VERIFY_MAX_BITS bits;
+- for pages with a PDF text layer, its words are identical.
+Forms that differ only in a few filled-in digits can still look alike at
+these resolutions, so the defaults are strict. A rescan that shifts the page
+fails verification and is processed normally. Only pages with a PDF text
+layer are looked up: a scanned K-1 or ACORD sharing a template with another
+can pass the hash checks with different typed values, and its OCR (which
+feeds identifier, zonal and search) would carry them, so scanned pages are
+always OCRed. Reuse is off by default.
+
+Environment:
+    PHASH_REUSE                 1/0 (default 0)
+    PHASH_MAX_DISTANCE          max Hamming distance of the 64-bit hashes (default 6)
+    PHASH_VERIFY_MAX_BITS       max Hamming distance of the 1024-bit hashes (default 16)
+"""
+import os
+import json
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+from file_queries import read_connection
+from geometry_codec import decode_page_geometry
+
+PHASH_REUSE = os.environ.get("PHASH_REUSE", "0").lower() in ("1", "true", "yes")
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "6"))
+PHASH_VERIFY_MAX_BITS = int(os.environ.get("PHASH_VERIFY_MAX_BITS", "16"))
+
+BANDS = 4
+BAND_BITS = 16
+MAX_CANDIDATES = 200
+ASPECT_TOLERANCE = 0.02
+
+_BAND_SQL = "((p.phash >> {shift}) & 65535)"
+
+
+def _dhash_bits(gray, size):
+    """size x size dHash bits (each pixel brighter than its right neighbour) of a PIL 'L' image."""
+    arr = np.asarray(gray.resize((size + 1, size), Image.BOX), dtype=np.int16)
+    return (arr[:, 1:] > arr[:, :-1]).ravel()
+
+
+def page_hashes(image):
+    """(phash, phash_fine) of a rendered page: a signed 64-bit int (Postgres BIGINT) and 128 bytes."""
+    gray = image.convert("L")
+    bits = _dhash_bits(gray, 8)
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value, np.packbits(_dhash_bits(gray, 32)).tobytes()
+
+
+def hamming(a, b):
+    """Bit distance between two hashes (ints or equal-length bytes)."""
+    if isinstance(a, int):
+        return bin((a ^ b) & ((1 << 64) - 1)).count("1")
+    return int(np.unpackbits(np.bitwise_xor(np.frombuffer(bytes(a), np.uint8), np.frombuffer(bytes(b), np.uint8))).sum())
+
+
+def bands(phash):
+    """The four 16-bit bands of a 64-bit hash, most significant first."""
+    unsigned = phash & ((1 << 64) - 1)
+    return [(unsigned >> (BAND_BITS * (BANDS - 1 - i))) & 0xFFFF for i in range(BANDS)]
+
+
+def band_probes(value, radius):
+    """Every 16-bit value within `radius` bits of `value`."""
+    probes = [value]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), r):
+            flipped = value
+            for bit in positions:
+                flipped ^= 1 << bit
+            probes.append(flipped)
+    return probes
+
+
+def find_candidates(conn, phash, exclude_filename=None, max_distance=PHASH_MAX_DISTANCE):
+    """
+    Pages of completed runs (of other files than `exclude_filename`) whose
+    phash is within max_distance of `phash`, as dicts ordered by distance.
+    """
+    radius = max_distance // BANDS
+    conditions, params = [], []
+    for i, value in enumerate(bands(phash)):
+        conditions.append(f"{_BAND_SQL.format(shift=BAND_BITS * (BANDS - 1 - i))} = ANY(%s)")
+        params.append(band_probes(value, radius))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT p.preprocessed, p.run_id, p.phash, p.phash_fine, p.image_width, p.image_height
+            FROM pages p
+            JOIN document_runs r ON r.run_id = p.run_id AND r.status = 'complete'
+            WHERE p.phash IS NOT NULL AND ({' OR '.join(conditions)})
+              AND (%s::text IS NULL OR r.filename <> %s)
+            LIMIT {MAX_CANDIDATES}
+        """, params + [exclude_filename, exclude_filename])
+        columns = [d[0] for d in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    for row in rows:
+        row["distance"] = hamming(phash, row["phash"])
+    return sorted((r for r in rows if r["distance"] <= max_distance), key=lambda r: r["distance"])
+
+
+def _load_page(conn, preprocessed, run_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM pages WHERE preprocessed = %s AND run_id = %s LIMIT 1", (preprocessed, run_id))
+        columns = [d[0] for d in cursor.description]
+        row = cursor.fetchone()
+        page = dict(zip(columns, row)) if row else None
+        cursor.execute(
+            "SELECT key, value FROM extracted2 WHERE filename = %s AND run_id = %s ORDER BY created_at",
+            (preprocessed, run_id),
+        )
+        extracted = cursor.fetchall()
+    finally:
+        cursor.close()
+    return page, extracted
+
+
+class DuplicateFinder:
+    """
+    Per-file lookup of near-identical pages from earlier runs of other files
+    (re-processing a file always starts from scratch). A failing database (or
+    PHASH_REUSE=0) disables reuse for the rest of the file; pages are then
+    processed normally.
+    """
+
+    def __init__(self, filename, enabled=None):
+        self.filename = filename
+        self.enabled = PHASH_REUSE if enabled is None else enabled
+
+    def find(self, phash, phash_fine, image_width, image_height, words=None):
+        """
+        The best verified earlier page with the same text-layer `words`, or
+        None (always for scanned pages, words=None). The match is a dict
+        with "page" (the pages row, geometry decoded and rescaled to this
+        image) and "extracted" ([(key, value), ...] of its run).
+        """
+        if not self.enabled or words is None:
+            return None
+        try:
+            with read_connection() as conn:
+                for candidate in find_candidates(conn, phash, self.filename):
+                    if not self._verified(candidate, phash_fine, image_width, image_height):
+                        continue
+                    page, extracted = _load_page(conn, candidate["preprocessed"], candidate["run_id"])
+                    if page is None:
+                        continue
+                    match = self._rescale(page, image_width, image_height)
+                    if list(match["words"]) != list(words):
+                        continue
+                    return {"page": match, "extracted": extracted, "distance": candidate["distance"]}
+        except Exception as e:
+            print(f"Duplicate page lookup failed, processing pages normally: {e}")
+            self.enabled = False
+        return None
+
+    @staticmethod
+    def _verified(candidate, phash_fine, image_width, image_height):
+        if not candidate.get("phash_fine") or not candidate.get("image_height") or not image_height:
+            return False
+        aspect = image_width / image_height
+        candidate_aspect = candidate["image_width"] / candidate["image_height"]
+        if abs(aspect - candidate_aspect) > ASPECT_TOLERANCE * aspect:
+            return False
+        return hamming(phash_fine, candidate["phash_fine"]) <= PHASH_VERIFY_MAX_BITS
+
+    @staticmethod
+    def _rescale(page, image_width, image_height):
+        """The page's OCR with boxes in this image's pixel coordinates (via the normalized boxes)."""
+        words, _, normalized_bboxes, _ = decode_page_geometry(page)
+        normalized = np.asarray(normalized_bboxes, dtype=np.float64).reshape(-1, 4)
+        scale = np.array([image_width, image_height, image_width, image_height])
+        lines = page.get("lines")
+        if isinstance(lines, str):
+            lines = json.loads(lines)
+        return dict(
+            page,
+            lines=lines or [],
+            words=list(words),
+            bboxes=np.rint(normalized * scale).astype(int).tolist(),
+            normalized_bboxes=normalized.tolist(),
+        )
@@ -0,0 +1,167 @@
+"""
+In-memory cache of read-query results, invalidated by per-table versions.
+
+Every writer bumps `table_versions` for the tables it wrote, in the same
+transaction (store_df_to_db, document_runs.complete_run, metrics_store, the
+entity matcher and write statements from /run-sql). A cached result is tagged
+with the tables its SQL reads and their versions when it was loaded; a lookup
+re-reads those versions (one indexed query) and only serves the entry if none
+changed. Between ingests, repeated chat and metrics queries come from memory.
+
+Tables are detected by name in the SQL, which over-approximates (a mention in a
+comment still tags the entry) - that only costs extra invalidation. Queries
+touching no known table are not cached.
+
+Environment:
+    QUERY_CACHE_ENABLED     1/0 (default 1)
+    QUERY_CACHE_ENTRIES     max cached results (default 256)
+    QUERY_CACHE_MAX_MB      max total result size (default 256)
+    QUERY_CACHE_TTL         seconds, a safety net for writes that bypass the bumps (default 3600)
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+QUERY_CACHE_ENTRIES = int(os.environ.get("QUERY_CACHE_ENTRIES", "256"))
+QUERY_CACHE_MAX_BYTES = int(float(os.environ.get("QUERY_CACHE_MAX_MB", "256")) * 1024 * 1024)
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+
+TRACKED_TABLES = (
+    "pages", "extracted2", "call_info", "document_runs", "entities", "page_entity_crosswalk",
+    "page_metrics_daily", "stage_latency_daily", "pipeline_spans", "conversations", "page_search",
+)
+_TABLE_RES = {t: re.compile(rf"\b{t}\b", re.IGNORECASE) for t in TRACKED_TABLES}
+
+
+def tables_in(sql):
+    return tuple(sorted(t for t, pattern in _TABLE_RES.items() if pattern.search(sql)))
+
+
+def normalize_sql(sql):
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def bump_table_versions(cursor, tables):
+    """
+    Increment the versions of `tables` inside the caller's transaction, so the
+    bump commits (or rolls back) with the write itself. Never fails the write:
+    if table_versions is missing the bump is skipped.
+    """
+    tables = sorted(set(tables))
+    if not tables:
+        return
+    cursor.execute("SAVEPOINT bump_table_versions")
+    try:
+        cursor.execute("""
+            INSERT INTO table_versions (table_name, version, updated_at)
+            SELECT t, 1, now() FROM unnest(%s::text[]) AS t
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = table_versions.version + 1, updated_at = now()
+        """, (tables,))
+        cursor.execute("RELEASE SAVEPOINT bump_table_versions")
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT bump_table_versions")
+        print(f"Could not bump table versions for {tables}: {e}")
+
+
+def bump_tables_for_statement(cursor, sql):
+    """Bump the tables a write statement mentions (all tracked tables if none are recognised)."""
+    bump_table_versions(cursor, tables_in(sql) or TRACKED_TABLES)
+
+
+def _current_versions(conn, tables):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (list(tables),)
+        )
+        found = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    return tuple(found.get(t, 0) for t in tables)
+
+
+class ResultCache:
+    def __init__(self, max_entries=QUERY_CACHE_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # normalized sql -> (tables, versions, df, nbytes, created)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "uncacheable": 0, "evictions": 0}
+
+    def read_sql(self, sql, conn, params=None, loader=None):
+        """
+        pd.read_sql_query(sql, conn, params) - or loader() if given - served
+        from cache while the tables the SQL reads are unchanged. `conn` is used
+        for the version check.
+        """
+        if loader is None:
+            loader = lambda: pd.read_sql_query(sql, conn, params=params)
+        tables = tables_in(sql)
+        if not QUERY_CACHE_ENABLED or not tables:
+            self.stats["uncacheable"] += 1
+            return loader()
+        try:
+            versions = _current_versions(conn, tables)
+        except Exception as e:
+            # table_versions missing (migration not applied): run uncached.
+            conn.rollback()
+            print(f"Query cache disabled for this read: {e}")
+            self.stats["uncacheable"] += 1
+            return loader()
+
+        key = (normalize_sql(sql), repr(params))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] == versions and now - entry[4] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[2].copy()
+                self._drop(key)
+                self.stats["stale"] += 1
+            self.stats["misses"] += 1
+
+        df = loader()
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes <= self.max_bytes // 4:
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (tables, versions, df.copy(), nbytes, now)
+                self._bytes += nbytes
+                while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                    self._drop(next(iter(self._entries)))
+                    self.stats["evictions"] += 1
+        return df
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), megabytes=round(self._bytes / 1024 / 1024, 2))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+result_cache = ResultCache()
+
+
+def cached_read_sql(sql, conn, params=None, loader=None):
+    return result_cache.read_sql(sql, conn, params, loader)
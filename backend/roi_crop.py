@@ -0,0 +1,148 @@
+"""
+Region-of-interest crops for Gemini extraction.
+
+Most schemas only concern part of a form: the K-1 header fields, the top of
+the 1120-S. Sending Gemini a few downscaled crops instead of the whole page
+cuts image tokens (Gemini bills larger images by 768x768 tile) and upload
+time.
+
+Each field's region is learned from the page itself when zonal extraction
+located the field's anchor but couldn't read the value confidently: the
+anchor plus its target region. Otherwise it comes from labels.json: the
+field's search_coords (where its anchor can be) plus the extent of its
+target_coords when the anchor sits at the top or bottom of that area. The
+remaining fields' regions are padded by ROI_MARGIN and merged greedily, by
+smallest added area, down to ROI_MAX_REGIONS boxes. The whole page is sent
+instead when:
+- a field has neither a located anchor nor a labels.json entry;
+- a field's region is the whole page;
+- the merged crops would still cover more than ROI_MAX_AREA of the page.
+
+Environment:
+    ROI_CROP            1/0 (default 1)
+    ROI_MARGIN          normalized padding around each field region (default 0.03)
+    ROI_MAX_REGIONS     max crops sent per call (default 2)
+    ROI_MAX_AREA        max share of the page the crops may cover (default 0.6)
+    ROI_MAX_SIDE        long side, in pixels, crops are downscaled to (default 1600)
+    ROI_MIN_ANCHOR      min zonal anchor score for using the located region (default 0.75)
+"""
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from zonal_extractor import eval_coords
+
+ROI_CROP = os.environ.get("ROI_CROP", "1").lower() in ("1", "true", "yes")
+ROI_MARGIN = float(os.environ.get("ROI_MARGIN", "0.03"))
+ROI_MAX_REGIONS = int(os.environ.get("ROI_MAX_REGIONS", "2"))
+ROI_MAX_AREA = float(os.environ.get("ROI_MAX_AREA", "0.6"))
+ROI_MAX_SIDE = int(os.environ.get("ROI_MAX_SIDE", "1600"))
+ROI_MIN_ANCHOR = float(os.environ.get("ROI_MIN_ANCHOR", "0.75"))
+
+WHOLE_PAGE = [0.0, 0.0, 1.0, 1.0]
+# Height of the anchor line assumed when extending a search area by its target region.
+ANCHOR_HEIGHT = 0.012
+
+
+def _area(box):
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+
+def _union(a, b):
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+def _overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def entry_region(entry):
+    """Page region a labels.json entry's anchor and value can fall in."""
+    search = eval_coords(entry["search_coords"], {}) if entry.get("search_coords") else list(WHOLE_PAGE)
+    region = [float(c) for c in search]
+    # The value region relative to an anchor at the top and at the bottom of the search area.
+    for y1 in (search[1], search[3] - ANCHOR_HEIGHT):
+        anchor = {"x1": search[0], "y1": y1, "x2": search[2], "y2": y1 + ANCHOR_HEIGHT}
+        try:
+            target = eval_coords(entry["target_coords"], anchor)
+        except (KeyError, ValueError, TypeError, IndexError, SyntaxError):
+            # Refers to other anchors (label_data): bounded by the search area plus margin.
+            continue
+        region = _union(region, [min(target[0], target[2]), min(target[1], target[3]),
+                                 max(target[0], target[2]), max(target[1], target[3])])
+    return [max(0.0, region[0]), max(0.0, region[1]), min(1.0, region[2]), min(1.0, region[3])]
+
+
+def merge_regions(boxes, max_regions):
+    """Merge overlapping boxes, then the pair adding the least area, until at most max_regions remain."""
+    boxes = [list(b) for b in boxes]
+    while len(boxes) > 1:
+        best = None
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                merged = _union(boxes[i], boxes[j])
+                cost = 0.0 if _overlaps(boxes[i], boxes[j]) else _area(merged) - _area(boxes[i]) - _area(boxes[j])
+                if best is None or cost < best[0]:
+                    best = (cost, i, j, merged)
+        cost, i, j, merged = best
+        if cost > 0 and len(boxes) <= max_regions:
+            break
+        boxes = [b for k, b in enumerate(boxes) if k not in (i, j)] + [merged]
+    return sorted(boxes, key=lambda b: (b[1], b[0]))
+
+
+def field_region(page_label, field, labels, located=None):
+    """A field's region: where zonal extraction located it, else from labels.json; None if unknown."""
+    found = (located or {}).get(field)
+    if found is not None and found.get("anchor_score", 0) >= ROI_MIN_ANCHOR and found.get("region"):
+        return _union(found["anchor_bbox"], found["region"])
+    entries = [e for e in labels.get(page_label) or [] if e.get("key") == field]
+    if not entries:
+        return None
+    region = None
+    for entry in entries:
+        try:
+            box = entry_region(entry)
+        except (KeyError, ValueError, SyntaxError):
+            return None
+        region = box if region is None else _union(region, box)
+    return region
+
+
+def plan_regions(page_label, fields, labels, located=None):
+    """
+    Normalized crop boxes covering `fields` of a page_label page, or None to
+    send the whole page. `located` is zonal_extractor.extract_fields() output
+    for the page.
+    """
+    if not ROI_CROP or not fields:
+        return None
+    boxes = []
+    for field in fields:
+        region = field_region(page_label, field, labels, located)
+        if region is None:
+            return None
+        boxes.append([max(0.0, region[0] - ROI_MARGIN), max(0.0, region[1] - ROI_MARGIN),
+                      min(1.0, region[2] + ROI_MARGIN), min(1.0, region[3] + ROI_MARGIN)])
+    regions = merge_regions(boxes, ROI_MAX_REGIONS)
+    if sum(_area(r) for r in regions) > ROI_MAX_AREA:
+        return None
+    return regions
+
+
+def crop_regions(image, regions):
+    """PNG bytes of each normalized region of a PIL image, downscaled to ROI_MAX_SIDE."""
+    width, height = image.size
+    crops = []
+    for region in regions:
+        box = (int(region[0] * width), int(region[1] * height),
+               int(round(region[2] * width)), int(round(region[3] * height)))
+        crop = image.crop(box)
+        scale = ROI_MAX_SIDE / max(crop.size)
+        if scale < 1:
+            crop = crop.resize((max(1, round(crop.width * scale)), max(1, round(crop.height * scale))), Image.LANCZOS)
+        buffer = BytesIO()
+        crop.save(buffer, format="PNG")
+        crops.append(buffer.getvalue())
+    return crops
@@ -1,16 +1,8 @@
-import os
-import boto3
-from io import BytesIO
+from storage import upload_fileobj, download_fileobj
 
-# Initialize the S3 client using environment variables
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-    region_name="us-east-1"  # Adjust if needed
-)
+# Kept for existing callers; the shared client and transfer settings live in storage.py.
 
-def upload_fileobj_to_s3(file_obj, object_key, bucket_name="form-sage-storage"):
+def upload_fileobj_to_s3(file_obj, object_key, bucket_name="form-sage-storage", content_type=None):
     """
     Upload a file-like object to S3.
 
@@ -18,20 +10,12 @@ def upload_fileobj_to_s3(file_obj, object_key, bucket_name="form-sage-storage"):
         file_obj: A file-like object (e.g., BytesIO) containing the file data.
         object_key: The key (path/filename) where the file should be stored in the bucket.
         bucket_name: The S3 bucket name. Defaults to "form-sage-storage".
+        content_type: Content-Type to store with the object (S3 defaults to binary/octet-stream).
 
     Returns:
         The S3 object key. You can optionally modify this to return a presigned URL.
     """
-    s3_client.upload_fileobj(file_obj, bucket_name, object_key)
-    return object_key
+    return upload_fileobj(file_obj, object_key, bucket_name, content_type=content_type)
 
 def download_fileobj_from_s3(object_key, bucket_name="form-sage-storage"):
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        region_name="us-east-1"  # Ensure this matches your bucket's region
-    )
-    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    file_content = response['Body'].read()
-    return BytesIO(file_content)
+    return download_fileobj(object_key, bucket_name)
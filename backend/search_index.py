@@ -0,0 +1,211 @@
+"""
+Full-text and fuzzy search over OCR lines and extracted values.
+
+At ingest every OCR line of a page and every extracted value becomes a row in
+`page_search` (migrations/008_search_index.sql), written in the same
+transaction that makes the run current. Rows carry the page number and a
+bounding box: for lines, the union of the word boxes Vision returned for that
+line; for extracted values, the box of the first line on the page containing
+the value (NULL if the value doesn't appear verbatim).
+
+search() ranks with a GIN tsvector index (word matches, ts_rank_cd) and a
+pg_trgm GIN index (substring / misspelling matches, similarity), restricted to
+each file's current run. Rows of superseded runs are pruned after ingest.
+
+Environment:
+    SEARCH_INDEX_ENABLED      1/0 (default 1)
+    SEARCH_MIN_SIMILARITY     pg_trgm threshold for fuzzy hits (default 0.3)
+"""
+import os
+import re
+import json
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from geometry_codec import decode_page_geometry
+from query_cache import bump_table_versions
+
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "1").lower() in ("1", "true", "yes")
+SEARCH_MIN_SIMILARITY = float(os.environ.get("SEARCH_MIN_SIMILARITY", "0.3"))
+MAX_PAGE_SIZE = 100
+
+_INSERT_SQL = """
+    INSERT INTO page_search
+        (run_id, filename, preprocessed, page_number, source, key, content, bbox, normalized_bbox)
+    VALUES %s
+"""
+
+
+def _compact(text):
+    return re.sub(r"\s+", "", text)
+
+
+def line_boxes(lines, words, bboxes, normalized_bboxes):
+    """
+    Assign Vision's words to the lines of the full-text annotation, in order,
+    and return one (bbox, normalized_bbox) per line (None for lines with no
+    words). Words are consumed until they cover the line's non-space
+    characters, which tolerates Vision splitting punctuation into its own word.
+    """
+    bboxes = np.asarray(bboxes).reshape(-1, 4)
+    normalized_bboxes = np.asarray(normalized_bboxes).reshape(-1, 4)
+    boxes, i = [], 0
+    for line in lines:
+        target = len(_compact(line))
+        start, covered = i, 0
+        while i < len(words) and covered < target:
+            covered += len(_compact(words[i]))
+            i += 1
+        if i == start:
+            boxes.append((None, None))
+            continue
+        box = bboxes[start:i]
+        norm = normalized_bboxes[start:i]
+        boxes.append((
+            [int(box[:, 0].min()), int(box[:, 1].min()), int(box[:, 2].max()), int(box[:, 3].max())],
+            [float(norm[:, 0].min()), float(norm[:, 1].min()), float(norm[:, 2].max()), float(norm[:, 3].max())]
+            if len(norm) else None,
+        ))
+    return boxes
+
+
+def _as_list(value):
+    """Page lines as a list, whether fresh from OCR or read back as JSON text."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value.splitlines()
+    return list(value) if value is not None else []
+
+
+def build_search_rows(run_id, filename, df_pages, df_extracted=None):
+    """page_search rows (as tuples for _INSERT_SQL) for one run."""
+    rows = []
+    page_lines = {}
+    for page in df_pages.to_dict(orient="records"):
+        words, bboxes, normalized_bboxes, _ = decode_page_geometry(page)
+        lines = _as_list(page.get("lines"))
+        boxed = []
+        for line, (bbox, norm) in zip(lines, line_boxes(lines, words, bboxes, normalized_bboxes)):
+            if not line.strip():
+                continue
+            boxed.append((line, bbox, norm))
+            rows.append((run_id, filename, page["preprocessed"], page["page_number"], "line", None, line, bbox, norm))
+        page_lines[page["preprocessed"]] = boxed
+
+    if df_extracted is not None and not df_extracted.empty:
+        for item in df_extracted.to_dict(orient="records"):
+            value = item.get("value")
+            if value is None or (isinstance(value, float) and np.isnan(value)) or not str(value).strip():
+                continue
+            value = str(value)
+            needle = value.casefold()
+            bbox, norm = next(
+                ((b, n) for line, b, n in page_lines.get(item["filename"], ()) if needle in line.casefold()),
+                (None, None),
+            )
+            rows.append((run_id, filename, item["filename"], item.get("page_num"), "value",
+                         item.get("key"), value, bbox, norm))
+    return rows
+
+
+def index_run(conn, run_id, filename, df_pages, df_extracted=None):
+    """
+    Write the search rows of a run on `conn` without committing, so they land
+    with document_runs.complete_run. Returns the number of rows written.
+    """
+    if not SEARCH_INDEX_ENABLED:
+        return 0
+    rows = build_search_rows(run_id, filename, df_pages, df_extracted)
+    cursor = conn.cursor()
+    try:
+        execute_values(cursor, _INSERT_SQL, rows, page_size=1000)
+        bump_table_versions(cursor, ["page_search"])
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+def prune_run(conn, run_id):
+    """Drop the search rows of a superseded run."""
+    if run_id is None:
+        return
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM page_search WHERE run_id = %s", (run_id,))
+    bump_table_versions(cursor, ["page_search"])
+    conn.commit()
+    cursor.close()
+
+
+def search(conn, query, filename=None, source=None, page=1, page_size=20):
+    """
+    Ranked hits for `query` across the current run of every file (or one
+    file). Returns {"hits": [...], "page": n, "page_size": n, "has_more": bool};
+    each hit has filename, page_number, source ('line' or 'value'), key,
+    content, score, bbox and normalized_bbox.
+    """
+    page = max(1, int(page))
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT set_limit(%s)", (SEARCH_MIN_SIMILARITY,))
+        cursor.execute("""
+            WITH q AS (SELECT websearch_to_tsquery('simple', %(query)s) AS tsq)
+            SELECT s.filename, s.preprocessed, s.page_number, s.source, s.key, s.content,
+                   s.bbox, s.normalized_bbox,
+                   ts_rank_cd(s.tsv, q.tsq) + similarity(s.content, %(query)s) AS score
+            FROM page_search s
+            JOIN document_runs r ON r.run_id = s.run_id AND r.is_current
+            CROSS JOIN q
+            WHERE (s.tsv @@ q.tsq OR s.content %% %(query)s)
+              AND (%(filename)s::text IS NULL OR s.filename = %(filename)s)
+              AND (%(source)s::text IS NULL OR s.source = %(source)s)
+            ORDER BY score DESC, s.filename, s.page_number, s.id
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            "query": query, "filename": filename, "source": source,
+            "limit": page_size + 1, "offset": (page - 1) * page_size,
+        })
+        columns = [d[0] for d in cursor.description]
+        hits = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    for hit in hits:
+        hit["score"] = float(hit["score"])
+    return {"hits": hits[:page_size], "page": page, "page_size": page_size, "has_more": len(hits) > page_size}
+
+
+def backfill_current_runs(conn):
+    """
+    Index the current run of every file that has no search rows yet (rows
+    ingested before the search index existed). Returns the number of runs indexed.
+    """
+    import pandas as pd
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT r.run_id, r.filename FROM document_runs r
+        WHERE r.is_current AND NOT EXISTS (SELECT 1 FROM page_search s WHERE s.run_id = r.run_id)
+        ORDER BY r.run_id
+    """)
+    runs = cursor.fetchall()
+    cursor.close()
+    for n, (run_id, filename) in enumerate(runs, start=1):
+        df_pages = pd.read_sql_query("SELECT * FROM pages WHERE run_id = %(run_id)s", conn, params={"run_id": run_id})
+        df_extracted = pd.read_sql_query(
+            "SELECT filename, page_num, key, value FROM extracted2 WHERE run_id = %(run_id)s",
+            conn, params={"run_id": run_id},
+        )
+        index_run(conn, run_id, filename, df_pages, df_extracted)
+        conn.commit()
+        print(f"Indexed run {run_id} ({filename}), {n}/{len(runs)}")
+    return len(runs)
+
+
+if __name__ == "__main__":
+    from entity_matcher import get_db_connection
+    conn = get_db_connection()
+    print(f"Backfilled {backfill_current_runs(conn)} runs.")
+    conn.close()
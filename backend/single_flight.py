@@ -0,0 +1,131 @@
+"""
+Single-flight processing of uploads, keyed by content hash and filename.
+
+/upload streams the request body to disk while hashing it (SHA-256), so the
+content hash is known once the upload is received, with no second read. The file
+lands at a content-addressed path, uploaded_samples/<sha256>/<filename>, so
+two uploads never write the same local file.
+
+Jobs for the same hash and filename (main.upload_key) are then coalesced;
+the same bytes under another filename are processed for that filename, so
+each filename has its own run:
+  - within a process, SingleFlight runs the job once and every concurrent
+    caller awaits the same future;
+  - across API workers, content_lock() holds a Postgres advisory lock on the
+    key while processing, so a second worker waits and then finds the
+    completed run (document_runs.content_hash, migration 012) instead of
+    running the pipeline again.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def receive_upload(upload, upload_dir):
+    """
+    Stream a FastAPI UploadFile to upload_dir/<sha256>/<filename>, hashing it
+    on the way. Returns (content_hash, path).
+    """
+    incoming = os.path.join(upload_dir, ".incoming")
+    os.makedirs(incoming, exist_ok=True)
+    tmp_path = os.path.join(incoming, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        content_hash = digest.hexdigest()
+        target_dir = os.path.join(upload_dir, content_hash)
+        os.makedirs(target_dir, exist_ok=True)
+        path = os.path.join(target_dir, os.path.basename(upload.filename))
+        # Same hash, same bytes: replacing an existing copy is harmless and atomic.
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return content_hash, path
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file already on disk (same hash as receive_upload)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Run at most one job per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def _join(self, key):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["followers"] += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self.stats["leaders"] += 1
+            return future, True
+
+    def _finish(self, key, future, fn):
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def do(self, key, fn):
+        """Blocking: (result, shared) where shared is True if another caller ran fn."""
+        future, leader = self._join(key)
+        if leader:
+            self._finish(key, future, fn)
+        return future.result(), not leader
+
+    async def do_async(self, key, fn):
+        """
+        Async: the leader runs the blocking fn in the default executor, so
+        followers (and other requests) keep being served while it runs.
+        Returns (result, shared).
+        """
+        future, leader = self._join(key)
+        if leader:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(None, self._finish, key, future, fn)
+        return await asyncio.wrap_future(future), not leader
+
+
+@contextmanager
+def content_lock(conn, content_hash):
+    """Session-level Postgres advisory lock on a content hash (blocks until acquired)."""
+    key = int(content_hash[:15], 16)  # fits a signed BIGINT
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (key,))
+    conn.commit()
+    try:
+        yield
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (key,))
+        conn.commit()
+        cursor.close()
+
+
+upload_flight = SingleFlight()
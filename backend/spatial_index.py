@@ -0,0 +1,187 @@
+"""
+Uniform-grid index over a page's normalized word boxes.
+
+A page has a few hundred to a few thousand OCR words, and geometry-aware code
+(zonal extraction, highlighting values, labeler overlays) keeps asking which
+words are inside or near a box. Bucketing the boxes into a GRID_CELLS x
+GRID_CELLS grid, stored CSR-style (one flat array of word indices plus
+per-cell offsets), lets a query look only at the words of the cells it
+touches instead of scanning every box:
+
+    query(region)         words intersecting a region
+    within(region)        words mostly inside a region, with their containment ratios
+    nearest(target, k)    k words closest to a point or box (expanding rings of cells)
+    same_line(i)          words on the same text line as word i, left to right
+
+The index is built once per page during OCR and stored next to it
+(pages.word_index, migrations/014_pages_word_index.sql) via to_bytes() /
+from_bytes(): the boxes as float32 plus the CSR arrays, a few KiB per page.
+
+Boxes are [x1, y1, x2, y2] in normalized page coordinates (0..1).
+"""
+import struct
+
+import numpy as np
+
+GRID_CELLS = 32
+
+# 2-byte magic, format version, grid cells, box count, bucket entry count.
+_HEADER = struct.Struct("<2sBHII")
+_MAGIC = b"XS"
+_VERSION = 1
+
+
+def containment(boxes, region):
+    """Fraction of each box's area that lies inside region (0 for degenerate boxes)."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    iw = np.minimum(boxes[:, 2], region[2]) - np.maximum(boxes[:, 0], region[0])
+    ih = np.minimum(boxes[:, 3], region[3]) - np.maximum(boxes[:, 1], region[1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return np.divide(inter, area, out=np.zeros_like(inter), where=area > 0)
+
+
+def box_distance(boxes, target):
+    """Euclidean gap between each box and a target box (0 where they overlap)."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    dx = np.maximum.reduce([boxes[:, 0] - target[2], target[0] - boxes[:, 2], np.zeros(len(boxes))])
+    dy = np.maximum.reduce([boxes[:, 1] - target[3], target[1] - boxes[:, 3], np.zeros(len(boxes))])
+    return np.hypot(dx, dy)
+
+
+def _as_box(target):
+    target = np.asarray(target, dtype=np.float64).ravel()
+    return np.concatenate([target, target]) if target.size == 2 else target
+
+
+class GridIndex:
+    """Word boxes bucketed by grid cell, with vectorized region, nearest and same-line queries."""
+
+    def __init__(self, boxes, cells=GRID_CELLS, _csr=None):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cells = cells
+        if _csr is not None:
+            self.offsets, self.items = _csr
+            return
+        lo, hi = self._cell_range(self.boxes[:, :2], self.boxes[:, 2:])
+        widths = hi[:, 0] - lo[:, 0] + 1
+        counts = widths * (hi[:, 1] - lo[:, 1] + 1)
+        # One entry per (box, covered cell), then sorted by cell.
+        box_ids = np.repeat(np.arange(len(self.boxes)), counts)
+        local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = np.repeat(lo[:, 0], counts) + local % np.repeat(widths, counts)
+        cy = np.repeat(lo[:, 1], counts) + local // np.repeat(widths, counts)
+        cell_ids = cy * cells + cx
+        order = np.argsort(cell_ids, kind="stable")
+        self.items = box_ids[order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cell_ids, minlength=cells * cells))))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell_range(self, low, high):
+        """Inclusive (cx, cy) cell ranges covering [low, high] corners, clipped to the grid."""
+        last = self.cells - 1
+        lo = np.clip(np.floor(np.nan_to_num(low) * self.cells), 0, last).astype(np.int64)
+        hi = np.clip(np.floor(np.nan_to_num(high) * self.cells), 0, last).astype(np.int64)
+        return lo, np.maximum(lo, hi)
+
+    def _window(self, cx0, cy0, cx1, cy1):
+        """Unique indices of the boxes bucketed in a rectangle of cells."""
+        chunks = [self.items[self.offsets[cy * self.cells + cx0]:self.offsets[cy * self.cells + cx1 + 1]]
+                  for cy in range(cy0, cy1 + 1)]
+        return np.unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+
+    def query(self, region):
+        """Indices (sorted) of the boxes that intersect region."""
+        if not len(self.boxes):
+            return np.empty(0, dtype=np.int64)
+        region = _as_box(region)
+        lo, hi = self._cell_range(region[None, :2], region[None, 2:])
+        candidates = self._window(lo[0, 0], lo[0, 1], hi[0, 0], hi[0, 1])
+        boxes = self.boxes[candidates]
+        hit = ((boxes[:, 0] <= region[2]) & (boxes[:, 2] >= region[0])
+               & (boxes[:, 1] <= region[3]) & (boxes[:, 3] >= region[1]))
+        return candidates[hit]
+
+    def within(self, region, min_containment=0.5):
+        """(indices, ratios) of the boxes with at least min_containment of their area inside region."""
+        candidates = self.query(region)
+        ratios = containment(self.boxes[candidates], region)
+        keep = ratios >= min_containment
+        return candidates[keep], ratios[keep]
+
+    def nearest(self, target, k=1):
+        """
+        (indices, distances) of the k boxes closest to a point [x, y] or box,
+        nearest first. Searches rings of cells outwards until no unsearched
+        box can be closer than the k-th found.
+        """
+        k = min(k, len(self.boxes))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        target = _as_box(target)
+        lo, hi = self._cell_range(target[None, :2], target[None, 2:])
+        (tx0, ty0), (tx1, ty1) = lo[0], hi[0]
+        last = self.cells - 1
+        for ring in range(self.cells + 1):
+            cx0, cy0 = max(tx0 - ring, 0), max(ty0 - ring, 0)
+            cx1, cy1 = min(tx1 + ring, last), min(ty1 + ring, last)
+            candidates = self._window(cx0, cy0, cx1, cy1)
+            if len(candidates) < k and (cx0, cy0, cx1, cy1) != (0, 0, last, last):
+                continue
+            distances = box_distance(self.boxes[candidates], target)
+            covered = (cx0, cy0, cx1, cy1) == (0, 0, last, last)
+            # Boxes outside the searched cells are at least `ring` cells away.
+            if covered or np.partition(distances, k - 1)[k - 1] <= ring / self.cells:
+                order = np.argsort(distances, kind="stable")[:k]
+                return candidates[order], distances[order]
+
+    def same_line(self, i, tolerance=0.5):
+        """
+        Indices of the words on the same text line as word i (i included),
+        left to right: vertical centres within `tolerance` line heights.
+        """
+        box = self.boxes[i]
+        height = box[3] - box[1]
+        centre = (box[1] + box[3]) / 2
+        candidates = self.query([0.0, centre - tolerance * height, 1.0, centre + tolerance * height])
+        boxes = self.boxes[candidates]
+        centres = (boxes[:, 1] + boxes[:, 3]) / 2
+        heights = np.maximum(boxes[:, 3] - boxes[:, 1], height)
+        line = candidates[np.abs(centres - centre) <= tolerance * heights]
+        return line[np.argsort(self.boxes[line, 0], kind="stable")]
+
+    def to_bytes(self):
+        """Compact serialization: header, float32 boxes, uint32 offsets and bucket entries."""
+        return b"".join((
+            _HEADER.pack(_MAGIC, _VERSION, self.cells, len(self.boxes), len(self.items)),
+            np.ascontiguousarray(self.boxes, dtype="<f4").tobytes(),
+            np.ascontiguousarray(self.offsets, dtype="<u4").tobytes(),
+            np.ascontiguousarray(self.items, dtype="<u4").tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """The index serialized by to_bytes() (bytes or a psycopg2 memoryview)."""
+        blob = bytes(blob)
+        magic, version, cells, n_boxes, n_items = _HEADER.unpack_from(blob)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a serialized word index")
+        pos = _HEADER.size
+        boxes = np.frombuffer(blob, dtype="<f4", count=n_boxes * 4, offset=pos).reshape(-1, 4)
+        pos += boxes.nbytes
+        offsets = np.frombuffer(blob, dtype="<u4", count=cells * cells + 1, offset=pos)
+        pos += offsets.nbytes
+        items = np.frombuffer(blob, dtype="<u4", count=n_items, offset=pos)
+        return cls(boxes, cells, _csr=(offsets.astype(np.int64), items.astype(np.int64)))
+
+
+def load_index(blob, normalized_bboxes):
+    """The page's stored index, or one built from its boxes (older pages, unreadable blobs)."""
+    if blob is not None and not (isinstance(blob, float) and np.isnan(blob)):
+        try:
+            return GridIndex.from_bytes(blob)
+        except (ValueError, struct.error, TypeError):
+            pass
+    return GridIndex(normalized_bboxes)
@@ -0,0 +1,218 @@
+"""
+Shared S3 access for the pipeline and the API.
+
+- One boto3 client per region, created once and shared across threads
+  (boto3 clients are thread-safe; sessions/resources are not).
+- Uploads/downloads go through a TransferConfig so large objects use
+  concurrent multipart transfers and ranged GETs.
+- Downloads stream to disk instead of buffering the whole body in memory.
+- PageCache is an on-disk LRU read-through cache for preprocessed page images,
+  so classify_using_image and process_image don't fetch the same page twice.
+
+Environment:
+    S3_BUCKET            default bucket (form-sage-storage)
+    S3_REGION            region for transfers (us-east-1)
+    S3_PRESIGN_REGION    region used to sign URLs (us-east-2, as main.py did)
+    S3_ENDPOINT_URL      custom endpoint, e.g. http://localhost:9000 for MinIO
+    PAGE_CACHE_DIR       cache directory (default: <tmp>/xaio_page_cache)
+    PAGE_CACHE_MAX_MB    cache size limit (default 1024; 0 disables the cache)
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+DEFAULT_BUCKET = os.environ.get("S3_BUCKET", "form-sage-storage")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_PRESIGN_REGION = os.environ.get("S3_PRESIGN_REGION", "us-east-2")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+
+# Page images are ~0.5-3 MB, so multipart rarely kicks in for them; raw PDFs
+# and batch exports do benefit. max_pool_connections must cover max_concurrency
+# times the number of threads transferring at once.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+CLIENT_CONFIG = Config(
+    max_pool_connections=32,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(region=None):
+    """Shared S3 client for `region` (defaults to S3_REGION)."""
+    region = region or S3_REGION
+    client = _clients.get(region)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(region)
+            if client is None:
+                client = boto3.client(
+                    "s3",
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                    region_name=region,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=CLIENT_CONFIG,
+                )
+                _clients[region] = client
+    return client
+
+
+def upload_fileobj(file_obj, object_key, bucket_name=DEFAULT_BUCKET, content_type=None):
+    extra_args = {"ContentType": content_type} if content_type else None
+    get_client().upload_fileobj(file_obj, bucket_name, object_key, ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+    return object_key
+
+
+def download_to_file(object_key, path, bucket_name=DEFAULT_BUCKET):
+    """Stream an object to `path` (written atomically via a temp file)."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            get_client().download_fileobj(bucket_name, object_key, f, Config=TRANSFER_CONFIG)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def download_fileobj(object_key, bucket_name=DEFAULT_BUCKET):
+    """Download into memory. Prefer download_to_file/cached_page_path for page images."""
+    buffer = BytesIO()
+    get_client().download_fileobj(bucket_name, object_key, buffer, Config=TRANSFER_CONFIG)
+    buffer.seek(0)
+    return buffer
+
+
+def open_stream(object_key, bucket_name=DEFAULT_BUCKET):
+    """The raw StreamingBody, for callers that process the object in chunks."""
+    return get_client().get_object(Bucket=bucket_name, Key=object_key)["Body"]
+
+
+def presigned_url(object_key, bucket_name=DEFAULT_BUCKET, expiration=3600):
+    return get_client(S3_PRESIGN_REGION).generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket_name, "Key": object_key},
+        ExpiresIn=expiration,
+    )
+
+
+class PageCache:
+    """
+    On-disk LRU cache of S3 objects keyed by (bucket, key). Recency is the file
+    mtime (touched on every hit), so the cache survives restarts and can be
+    shared by processes on the same host.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(e.stat().st_size for e in os.scandir(directory) if e.name.endswith(".bin"))
+
+    def _path(self, object_key, bucket_name):
+        digest = hashlib.sha1(f"{bucket_name}/{object_key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".bin")
+
+    def _key_lock(self, path):
+        with self._lock:
+            return self._key_locks.setdefault(path, threading.Lock())
+
+    def get(self, object_key, bucket_name=DEFAULT_BUCKET):
+        """Local path for the object, downloading it on a miss."""
+        path = self._path(object_key, bucket_name)
+        # Per-key lock so concurrent readers of one page download it once.
+        with self._key_lock(path):
+            if os.path.exists(path):
+                os.utime(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            download_to_file(object_key, path, bucket_name)
+        self._added(os.path.getsize(path))
+        return path
+
+    def put(self, object_key, data, bucket_name=DEFAULT_BUCKET):
+        """Write-through for objects we just uploaded."""
+        path = self._path(object_key, bucket_name)
+        with self._key_lock(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            existed = os.path.exists(path)
+            old_size = os.path.getsize(path) if existed else 0
+            os.replace(tmp_path, path)
+        self._added(len(data) - old_size)
+        return path
+
+    def _added(self, nbytes):
+        with self._lock:
+            self._size += nbytes
+            if self._size <= self.max_bytes:
+                return
+            entries = sorted(
+                (e for e in os.scandir(self.directory) if e.name.endswith(".bin")),
+                key=lambda e: e.stat().st_mtime,
+            )
+            # Evict down to 90% so we don't evict on every insert.
+            target = self.max_bytes * 0.9
+            for entry in entries:
+                if self._size <= target:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """The process-wide PageCache, or None when PAGE_CACHE_MAX_MB=0."""
+    global _page_cache
+    max_mb = float(os.environ.get("PAGE_CACHE_MAX_MB", "1024"))
+    if max_mb <= 0:
+        return None
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                directory = os.environ.get("PAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "xaio_page_cache")
+                _page_cache = PageCache(directory, int(max_mb * 1024 * 1024))
+    return _page_cache
+
+
+def cached_page_path(object_key, bucket_name=DEFAULT_BUCKET):
+    """
+    Local file for a page image: the path itself if it exists on disk, else a
+    cached copy of the S3 object (downloaded on first use).
+    """
+    if os.path.exists(object_key):
+        return object_key
+    cache = get_page_cache()
+    if cache is not None:
+        return cache.get(object_key, bucket_name)
+    path = os.path.join(tempfile.mkdtemp(prefix="xaio_page_"), os.path.basename(object_key))
+    return download_to_file(object_key, path, bucket_name)
@@ -0,0 +1,10 @@
+"""
+The backend modules are flat and read files (labels.json, template_keywords.pkl)
+relative to backend/, so tests import and run from there.
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
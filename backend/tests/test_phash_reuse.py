@@ -0,0 +1,70 @@
+"""Near-duplicate reuse must never give a scanned page another file's OCR or values."""
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+phash_index = pytest.importorskip("phash_index")
+fpg = pytest.importorskip("fast_processor_gemini")  # needs the full pipeline dependencies
+
+from identifier_extractor import scan_page
+
+OTHER_PAGE = {
+    "preprocessed": "debug_images/other/page_1/preprocessed.png",
+    "page_label": "1065_k1",
+    "page_confidence": 0.9,
+    "lines": ["Partnership's employer identification number 12-3456789", "SSN XXX-XX-1111"],
+    "words": ["Partnership's", "employer", "identification", "number", "12-3456789", "SSN", "XXX-XX-1111"],
+    "bboxes": [[10, 10, 20, 20]] * 7,
+    "normalized_bboxes": [[0.1, 0.1, 0.2, 0.2]] * 7,
+}
+OWN_LINES = ["Partnership's employer identification number 98-7654321", "SSN XXX-XX-2222"]
+
+
+class RecordingFinder:
+    """DuplicateFinder stand-in that would match every page."""
+
+    def __init__(self):
+        self.lookups = []
+
+    def find(self, phash, phash_fine, image_width, image_height, words=None):
+        self.lookups.append(words)
+        return {"page": dict(OTHER_PAGE), "extracted": [("business_ein", "12-3456789")], "distance": 0}
+
+
+class NoUploads:
+    def submit(self, data, key, page=None):
+        pass
+
+
+def scanned_handler(monkeypatch):
+    handler = fpg.PDFHandler.__new__(fpg.PDFHandler)
+    handler.pdf_path = "scanned_k1.pdf"
+    handler.uploads = NoUploads()
+    handler.page_images = {}
+    handler.reused = {}
+    handler.duplicates = RecordingFinder()
+    words = " ".join(OWN_LINES).split()
+    monkeypatch.setattr(handler, "vision_ocr", lambda image, page_num: (
+        list(OWN_LINES), words, [[10, 10, 20, 20]] * len(words), [[0.1, 0.1, 0.2, 0.2]] * len(words)))
+    monkeypatch.setattr(fpg, "triage_page", lambda image: (None, 0.2))
+    monkeypatch.setattr(fpg, "build_renditions", lambda image, key: ({}, []))
+    monkeypatch.setattr(fpg, "get_page_cache", lambda: None)
+    return handler
+
+
+def test_scanned_duplicate_is_ocred_and_gets_its_own_identifiers(monkeypatch):
+    handler = scanned_handler(monkeypatch)
+    row = handler.process_page(Image.new("RGB", (170, 220), "white"), 1)
+
+    assert row["ocr_source"] == "vision"
+    assert row["reused_from"] is None
+    assert handler.reused == {}
+    assert handler.duplicates.lookups == []
+    found = scan_page(row["lines"]).field_values(["business_ein", "ssn_last_4"])
+    assert found["business_ein"]["value"] == "98-7654321"
+    assert found["ssn_last_4"]["value"] == "2222"
+
+
+def test_finder_never_matches_pages_without_text_layer():
+    finder = phash_index.DuplicateFinder("scanned_k1.pdf", enabled=True)
+    # Returns before any database lookup.
+    assert finder.find(1, b"\0" * 128, 170, 220, words=None) is None
@@ -0,0 +1,35 @@
+"""Fillable forms keep their values in widgets, outside the text layer, so they must be OCRed."""
+import pytest
+
+fitz = pytest.importorskip("fitz")
+text_layer = pytest.importorskip("text_layer")
+
+FORM_TEXT = " ".join(["Partnership's employer identification number"] * 10)
+
+
+def _page(with_widget):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(36, 36, 576, 400), FORM_TEXT, fontsize=11)
+    if with_widget:
+        widget = fitz.Widget()
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.field_name = "ein"
+        widget.field_value = "12-3456789"
+        widget.rect = fitz.Rect(36, 420, 236, 440)
+        page.add_widget(widget)
+    return doc, page
+
+
+def test_flat_page_uses_text_layer():
+    doc, page = _page(with_widget=False)
+    result = text_layer.page_text(page, 1224, 1584)
+    assert result is not None
+    assert "identification" in result["words"]
+    doc.close()
+
+
+def test_page_with_form_widgets_is_ocred():
+    doc, page = _page(with_widget=True)
+    assert text_layer.page_text(page, 1224, 1584) is None
+    doc.close()
@@ -0,0 +1,19 @@
+"""Translation cache keys must keep the case of the literals the SQL will contain."""
+import pytest
+
+pytest.importorskip("numpy")
+
+from translation_cache import TranslationCache, normalize_question
+
+
+def test_entity_names_differing_in_case_miss_each_other():
+    cache = TranslationCache(near_duplicates=True)
+    cache.put("tax data for ACME Corp", "schema", "SELECT * FROM entities WHERE entity_name = 'ACME Corp'")
+
+    assert cache.get("tax data for acme corp", "schema") is None
+    assert cache.get("Tax data for ACME Corp?", "schema") is not None
+
+
+def test_quoted_literals_keep_case():
+    assert normalize_question("files for 'ACME Corp'") != normalize_question("files for 'acme corp'")
+    assert normalize_question("Show  files for 'ACME Corp'?") == normalize_question("show files for 'ACME Corp'")
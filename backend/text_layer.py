@@ -0,0 +1,97 @@
+"""
+OCR from a PDF's embedded text layer.
+
+Software-generated PDFs (most e-filed tax returns) already carry their text
+with positions; reading it with PyMuPDF takes milliseconds, where rendering
+and sending the page to Cloud Vision takes a second or more. PDFHandler asks
+page_text() for each page and only OCRs the pages it returns None for
+(scans, image-only pages, broken font encodings, fillable forms).
+
+Fillable (AcroForm) PDFs keep their filled-in values in widgets, which
+get_text() doesn't return: the page's text layer is only the blank form, while
+the rendered image shows the values. Pages with widgets are therefore OCRed.
+
+Output matches what PDFHandler.process_page builds from Vision: words with
+pixel boxes in the rendered image's coordinates, normalized boxes and lines.
+
+Environment:
+    TEXT_LAYER_MODE           auto (use the text layer when usable) | off (always OCR)
+    TEXT_LAYER_MIN_WORDS      fewer words than this counts as no text layer (default 20)
+    TEXT_LAYER_MIN_QUALITY    minimum share of cleanly decoded characters (default 0.9)
+"""
+import os
+
+import fitz  # PyMuPDF
+
+TEXT_LAYER_MODE = os.environ.get("TEXT_LAYER_MODE", "auto").lower()
+TEXT_LAYER_MIN_WORDS = int(os.environ.get("TEXT_LAYER_MIN_WORDS", "20"))
+TEXT_LAYER_MIN_QUALITY = float(os.environ.get("TEXT_LAYER_MIN_QUALITY", "0.9"))
+
+# Characters PyMuPDF emits for glyphs it could not map to Unicode.
+_UNMAPPED = {"�", "\x00"}
+
+
+def open_document(pdf_path):
+    """The PDF as a fitz.Document, or None if text-layer extraction is off or it can't be opened."""
+    if TEXT_LAYER_MODE == "off":
+        return None
+    try:
+        return fitz.open(pdf_path)
+    except Exception as e:
+        print(f"Could not open {pdf_path} for text extraction, OCRing every page: {e}")
+        return None
+
+
+def _quality(words):
+    chars = "".join(w[4] for w in words)
+    if not chars:
+        return 0.0
+    bad = sum(1 for c in chars if c in _UNMAPPED or not c.isprintable())
+    bad += 5 * chars.count("(cid:")
+    return 1.0 - bad / len(chars)
+
+
+def page_text(page, image_width, image_height):
+    """
+    {"lines", "words", "bboxes", "normalized_bboxes"} for a fitz page, scaled
+    to an image_width x image_height rendering of it, or None when the page
+    has no usable text layer and needs OCR (including pages with unflattened
+    form widgets, whose values aren't in the text layer).
+    """
+    if page.first_widget is not None:
+        return None
+    # Extraction order keeps each (block, line) contiguous; sort=True would
+    # interleave the lines of side-by-side form columns and split them.
+    words = [w for w in page.get_text("words") if w[4].strip()]
+    if len(words) < TEXT_LAYER_MIN_WORDS or _quality(words) < TEXT_LAYER_MIN_QUALITY:
+        return None
+
+    # Text coordinates are in unrotated PDF points; the rendering is rotated
+    # and sized from page.rect (the rotated crop box).
+    rotate = page.rotation_matrix if page.rotation else None
+    sx = image_width / page.rect.width
+    sy = image_height / page.rect.height
+
+    out_words, bboxes, normalized_bboxes = [], [], []
+    lines, current_line, line_key = [], [], None
+    for x0, y0, x1, y1, text, block_no, line_no, _ in words:
+        rect = fitz.Rect(x0, y0, x1, y1)
+        if rotate is not None:
+            rect = rect * rotate
+        bbox = [
+            int(round((rect.x0 - page.rect.x0) * sx)), int(round((rect.y0 - page.rect.y0) * sy)),
+            int(round((rect.x1 - page.rect.x0) * sx)), int(round((rect.y1 - page.rect.y0) * sy)),
+        ]
+        out_words.append(text)
+        bboxes.append(bbox)
+        normalized_bboxes.append([bbox[0] / image_width, bbox[1] / image_height,
+                                  bbox[2] / image_width, bbox[3] / image_height])
+        if (block_no, line_no) != line_key and current_line:
+            lines.append(" ".join(current_line))
+            current_line = []
+        line_key = (block_no, line_no)
+        current_line.append(text)
+    if current_line:
+        lines.append(" ".join(current_line))
+
+    return {"lines": lines, "words": out_words, "bboxes": bboxes, "normalized_bboxes": normalized_bboxes}
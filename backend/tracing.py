@@ -0,0 +1,194 @@
+"""
+Per-page, per-stage spans for the processing pipeline.
+
+Enable with PIPELINE_TRACING=1. When disabled, span() returns a shared no-op
+context manager, so instrumented code pays one function call and one branch.
+
+When enabled, every span is:
+  - buffered on the current trace and written to `pipeline_spans` by flush_spans(),
+  - observed into the Prometheus histogram xaio_pipeline_stage_seconds
+    (if prometheus_client is installed; see /metrics in main.py),
+  - emitted as an OpenTelemetry span (if opentelemetry-api is installed and
+    PIPELINE_OTEL=1; exporter setup is left to the deployment).
+"""
+import os
+import json
+import time
+import uuid
+import contextvars
+from datetime import datetime, timezone
+
+TRACING_ENABLED = os.environ.get("PIPELINE_TRACING", "0").lower() in ("1", "true", "yes")
+OTEL_ENABLED = os.environ.get("PIPELINE_OTEL", "0").lower() in ("1", "true", "yes")
+
+try:
+    from prometheus_client import Histogram
+    from metrics_store import LATENCY_BUCKETS
+    STAGE_SECONDS = Histogram(
+        "xaio_pipeline_stage_seconds",
+        "Time spent in each pipeline stage.",
+        ["stage"],
+        buckets=LATENCY_BUCKETS,
+    )
+except ImportError:
+    STAGE_SECONDS = None
+
+_tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace as otel_trace
+        _tracer = otel_trace.get_tracer("xaio.pipeline")
+    except ImportError:
+        print("PIPELINE_OTEL is set but opentelemetry-api is not installed; skipping OTel spans.")
+
+_current_trace = contextvars.ContextVar("pipeline_trace", default=None)
+_span_listeners = []
+
+
+class Trace:
+    """Spans recorded for one processed file."""
+
+    def __init__(self, filename):
+        self.trace_id = uuid.uuid4().hex
+        self.filename = filename
+        self.run_id = None
+        self.spans = []
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "page", "attrs", "trace", "started_at", "_start", "_otel")
+
+    def __init__(self, stage, page, attrs):
+        self.stage = stage
+        self.page = page
+        self.attrs = attrs
+        self.trace = _current_trace.get()
+        self._otel = None
+
+    def set(self, **attrs):
+        """Attach attributes discovered while the span is open (e.g. token counts)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._otel = _tracer.start_as_current_span(self.stage)
+            otel_span = self._otel.__enter__()
+            if self.page is not None:
+                otel_span.set_attribute("page_number", self.page)
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        if STAGE_SECONDS is not None:
+            STAGE_SECONDS.labels(stage=self.stage).observe(duration)
+        record = {
+            "stage": self.stage,
+            "page_number": self.page,
+            "started_at": self.started_at,
+            "duration_ms": duration * 1000,
+            "error": repr(exc) if exc is not None else None,
+            "attributes": self.attrs or None,
+        }
+        if self.trace is not None:
+            self.trace.spans.append(record)
+        for listener in _span_listeners:
+            listener(record)
+        if self._otel is not None:
+            self._otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+def span(stage, page=None, **attrs):
+    """
+    Time a pipeline stage:
+
+        with span("ocr", page=page_num):
+            ...
+    """
+    if not TRACING_ENABLED:
+        return _NOOP
+    return _Span(stage, page, attrs)
+
+
+def add_span_listener(fn):
+    """Call fn(span_record) whenever a span closes (used by the benchmark harness)."""
+    _span_listeners.append(fn)
+
+
+def remove_span_listener(fn):
+    if fn in _span_listeners:
+        _span_listeners.remove(fn)
+
+
+def start_trace(filename):
+    """Begin collecting spans for a file in the current context. Returns the Trace (or None)."""
+    if not TRACING_ENABLED:
+        return None
+    trace = Trace(filename)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def set_trace_run_id(run_id):
+    """Associate the current trace with the document run it produced."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.run_id = run_id
+
+
+def flush_spans(conn=None):
+    """
+    Write buffered spans of the current trace to `pipeline_spans` and clear the
+    buffer. Safe to call repeatedly (e.g. after the DB write and again after
+    entity matching). Opens its own connection when `conn` is not given.
+    """
+    trace = _current_trace.get()
+    if trace is None or not trace.spans:
+        return 0
+    spans, trace.spans = trace.spans, []
+    rows = [
+        (trace.trace_id, trace.run_id, trace.filename, s["page_number"], s["stage"],
+         s["started_at"], s["duration_ms"], s["error"],
+         json.dumps(s["attributes"], default=str) if s["attributes"] else None)
+        for s in spans
+    ]
+    own_conn = conn is None
+    if own_conn:
+        from entity_matcher import get_db_connection
+        conn = get_db_connection()
+    try:
+        import psycopg2.extras
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO pipeline_spans
+                (trace_id, run_id, filename, page_number, stage, started_at, duration_ms, error, attributes)
+            VALUES %s
+        """, rows)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error writing pipeline spans: {e}")
+    finally:
+        if own_conn:
+            conn.close()
+    return len(rows)
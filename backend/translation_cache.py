@@ -0,0 +1,167 @@
+"""
+Cache of natural-language -> SQL translations for chat_ui.convert_to_sql.
+
+Entries are keyed by the normalized question and a hash of the schema/prompt,
+so a schema change invalidates everything. Eviction is LRU with a TTL.
+
+Optionally (TRANSLATION_CACHE_NEAR_DUPLICATES=1) a miss falls back to a
+near-duplicate lookup: questions are embedded locally as hashed word and
+character-trigram vectors and compared by cosine similarity. A near hit is only
+accepted if the question's literals (names, numbers, quoted text) are exactly
+the same, so "tax data for Company XYZ" never answers "tax data for Company ABC".
+Literals are case-sensitive in both lookups, as they are in the SQL.
+
+Environment:
+    TRANSLATION_CACHE_SIZE               max entries (default 1000)
+    TRANSLATION_CACHE_TTL                seconds (default 86400)
+    TRANSLATION_CACHE_NEAR_DUPLICATES    1/0 (default 0)
+    TRANSLATION_CACHE_SIMILARITY         cosine threshold for near hits (default 0.92)
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "1000"))
+TRANSLATION_CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", "86400"))
+NEAR_DUPLICATES = os.environ.get("TRANSLATION_CACHE_NEAR_DUPLICATES", "0").lower() in ("1", "true", "yes")
+SIMILARITY_THRESHOLD = float(os.environ.get("TRANSLATION_CACHE_SIMILARITY", "0.92"))
+
+EMBEDDING_DIM = 2048
+
+_STOP_WORDS = {"a", "an", "the", "me", "please", "can", "you", "show", "give", "list", "tell", "what", "is", "are", "for", "of", "on"}
+_LITERAL_RE = re.compile(r"\"[^\"]+\"|'[^']+'|\b\d[\d,./-]*\b|(?<!^)(?<![.?!]\s)\b[A-Z][\w&.-]*(?:\s+[A-Z][\w&.-]*)*")
+
+
+def schema_hash(*parts):
+    """Hash of everything in the prompt besides the question (schema, examples, model)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def normalize_question(question):
+    """
+    Case-, whitespace-, quote- and trailing-punctuation-insensitive form of a
+    question. Literals (quoted text, numbers, capitalized names) keep their
+    case: they end up in the SQL, where = and LIKE are case-sensitive, so
+    "ACME Corp" and "acme corp" are different questions.
+    """
+    text = unicodedata.normalize("NFKC", question)
+    text = text.replace("’", "'").replace("“", '"').replace("”", '"')
+    text = re.sub(r"\s+", " ", text).strip().rstrip("?.! ")
+    parts, end = [], 0
+    for match in _LITERAL_RE.finditer(text):
+        parts.append(text[end:match.start()].casefold())
+        parts.append(match.group(0))
+        end = match.end()
+    parts.append(text[end:].casefold())
+    return "".join(parts)
+
+
+def question_literals(question):
+    """Names, numbers and quoted strings in the question (case-sensitive, like the SQL literals)."""
+    text = re.sub(r"\s+", " ", question.strip())
+    return frozenset(m.group(0).strip("'\"") for m in _LITERAL_RE.finditer(text))
+
+
+def embed(normalized):
+    """L2-normalized hashed bag of words + character trigrams (case-insensitive)."""
+    normalized = normalized.casefold()
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    words = [w for w in re.findall(r"\w+", normalized) if w not in _STOP_WORDS]
+    features = words + [normalized[i:i + 3] for i in range(max(0, len(normalized) - 2))]
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % EMBEDDING_DIM] += 1.0 if (h >> 63) else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class TranslationCache:
+    def __init__(self, max_entries=TRANSLATION_CACHE_SIZE, ttl=TRANSLATION_CACHE_TTL,
+                 near_duplicates=NEAR_DUPLICATES, threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self._entries = OrderedDict()  # (schema_hash, normalized) -> dict
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _expired(self, entry, now):
+        return now - entry["created"] > self.ttl
+
+    def get(self, question, schema_key):
+        """Cached SQL for the question, or None."""
+        normalized = normalize_question(question)
+        key = (schema_key, normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry["sql"]
+            if self.near_duplicates:
+                match = self._nearest(normalized, question_literals(question), schema_key, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.stats["near_hits"] += 1
+                    return self._entries[match]["sql"]
+            self.stats["misses"] += 1
+            return None
+
+    def _nearest(self, normalized, literals, schema_key, now):
+        candidates = [
+            k for k, e in self._entries.items()
+            if k[0] == schema_key and e["literals"] == literals and not self._expired(e, now)
+        ]
+        if not candidates:
+            return None
+        matrix = np.stack([self._entries[k]["vector"] for k in candidates])
+        scores = matrix @ embed(normalized)
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= self.threshold else None
+
+    def put(self, question, schema_key, sql):
+        normalized = normalize_question(question)
+        entry = {
+            "sql": sql,
+            "created": time.time(),
+            "question": question,
+            "literals": question_literals(question),
+            "vector": embed(normalized) if self.near_duplicates else None,
+        }
+        with self._lock:
+            self._entries[(schema_key, normalized)] = entry
+            self._entries.move_to_end((schema_key, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["near_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+translation_cache = TranslationCache()
@@ -0,0 +1,93 @@
+"""
+Background uploads of page artifacts to S3.
+
+PDFHandler used to upload each preprocessed page inline, so OCR of the next
+page waited on S3. Pages are now submitted to an UploadQueue and uploaded by a
+shared worker pool while the pipeline keeps going from the in-memory image.
+
+Every file gets its own queue; flush() waits for that file's uploads and raises
+UploadError if any failed. store_results_to_db() flushes before inserting rows
+that reference the keys, so a failed upload marks the run failed instead of
+committing pages that point at missing objects.
+
+Environment:
+    S3_UPLOAD_WORKERS   size of the shared upload pool (default 8)
+"""
+import os
+import contextvars
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import image_pyramid
+from s3_utils import upload_fileobj_to_s3
+from tracing import span
+
+UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+    return _executor
+
+
+class UploadError(Exception):
+    """One or more artifact uploads failed; `failures` maps object key -> exception."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        keys = ", ".join(sorted(failures)[:5])
+        super().__init__(f"{len(failures)} upload(s) failed: {keys}")
+
+
+class UploadQueue:
+    """Uploads submitted for one file."""
+
+    def __init__(self, bucket_name="form-sage-storage"):
+        self.bucket_name = bucket_name
+        self._futures = {}
+
+    def submit(self, data, object_key, page=None, content_type=None):
+        """
+        Queue `data` (bytes) for upload to `object_key`; returns immediately.
+        content_type defaults to the one image_pyramid.content_type() gives the key's extension.
+        """
+        if content_type is None:
+            content_type = image_pyramid.content_type(object_key)
+        # Run in a copy of the caller's context so spans land on the current trace.
+        ctx = contextvars.copy_context()
+        future = _get_executor().submit(ctx.run, self._upload, data, object_key, page, content_type)
+        self._futures[object_key] = future
+        return future
+
+    def _upload(self, data, object_key, page, content_type):
+        with span("s3_upload", page=page, key=object_key, bytes=len(data)):
+            upload_fileobj_to_s3(BytesIO(data), object_key, self.bucket_name, content_type=content_type)
+        return object_key
+
+    @property
+    def pending(self):
+        return sum(1 for f in self._futures.values() if not f.done())
+
+    def flush(self, timeout=None):
+        """Wait for all submitted uploads. Raises UploadError if any failed or timed out."""
+        if not self._futures:
+            return []
+        with span("s3_flush", uploads=len(self._futures)):
+            done, not_done = wait(self._futures.values(), timeout=timeout)
+        failures = {}
+        for key, future in self._futures.items():
+            if future in not_done:
+                failures[key] = TimeoutError(f"upload of {key} did not finish in {timeout}s")
+            elif future.exception() is not None:
+                failures[key] = future.exception()
+        if failures:
+            raise UploadError(failures)
+        return list(self._futures)
@@ -0,0 +1,147 @@
+"""
+Page image URLs for API responses.
+
+Presigned mode (default): URLs are signed with the shared S3 client from
+storage.py and cached until shortly before they expire, so re-opening a
+document doesn't re-sign every page. page_urls() signs all pages of a file in
+one pass under a single lock.
+
+Signed-cookie mode (IMAGE_URL_MODE=cookie): pages are served from CloudFront
+as plain URLs, and one set of CloudFront signed cookies scoped to the file's
+key prefix authorises all of them. Requires:
+    CLOUDFRONT_DOMAIN             e.g. d111111abcdef8.cloudfront.net
+    CLOUDFRONT_KEY_PAIR_ID        public key ID registered with the distribution
+    CLOUDFRONT_PRIVATE_KEY_PATH   PEM private key (needs the `cryptography` package)
+    CLOUDFRONT_COOKIE_DOMAIN      parent domain shared by the API and the CDN alias,
+                                  e.g. .example.com (browsers only accept cookies
+                                  for the API's own domain or a parent of it)
+
+Environment:
+    IMAGE_URL_MODE        presign | cookie (default presign)
+    IMAGE_URL_TTL         URL / cookie lifetime in seconds (default 3600)
+    URL_CACHE_MAX         max cached presigned URLs (default 50000)
+"""
+import os
+import json
+import time
+import base64
+import threading
+from collections import OrderedDict
+
+from storage import presigned_url, DEFAULT_BUCKET
+
+IMAGE_URL_MODE = os.environ.get("IMAGE_URL_MODE", "presign").lower()
+IMAGE_URL_TTL = int(os.environ.get("IMAGE_URL_TTL", "3600"))
+URL_CACHE_MAX = int(os.environ.get("URL_CACHE_MAX", "50000"))
+CLOUDFRONT_DOMAIN = os.environ.get("CLOUDFRONT_DOMAIN")
+CLOUDFRONT_KEY_PAIR_ID = os.environ.get("CLOUDFRONT_KEY_PAIR_ID")
+CLOUDFRONT_PRIVATE_KEY_PATH = os.environ.get("CLOUDFRONT_PRIVATE_KEY_PATH")
+CLOUDFRONT_COOKIE_DOMAIN = os.environ.get("CLOUDFRONT_COOKIE_DOMAIN") or None
+
+
+class PresignedUrlCache:
+    """LRU of signed URLs; entries are dropped at 90% of their lifetime so a client never gets a nearly-expired URL."""
+
+    def __init__(self, max_entries=URL_CACHE_MAX):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, object_keys, bucket_name=DEFAULT_BUCKET, expiration=IMAGE_URL_TTL):
+        """Return {key: url}, signing only the keys that aren't cached."""
+        now = time.monotonic()
+        urls = {}
+        with self._lock:
+            for key in object_keys:
+                cache_key = (bucket_name, key, expiration)
+                entry = self._entries.get(cache_key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(cache_key)
+                    urls[key] = entry[0]
+                    self.hits += 1
+                    continue
+                # Signing is local HMAC work, so doing it under the lock is cheap
+                # and keeps one signer per process.
+                url = presigned_url(key, bucket_name, expiration)
+                self._entries[cache_key] = (url, now + expiration * 0.9)
+                self._entries.move_to_end(cache_key)
+                urls[key] = url
+                self.misses += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return urls
+
+    def get(self, object_key, bucket_name=DEFAULT_BUCKET, expiration=IMAGE_URL_TTL):
+        return self.get_many([object_key], bucket_name, expiration)[object_key]
+
+
+url_cache = PresignedUrlCache()
+
+
+def cookie_mode():
+    return IMAGE_URL_MODE == "cookie" and bool(CLOUDFRONT_DOMAIN and CLOUDFRONT_KEY_PAIR_ID and CLOUDFRONT_PRIVATE_KEY_PATH)
+
+
+def cdn_url(object_key):
+    return f"https://{CLOUDFRONT_DOMAIN}/{object_key}"
+
+
+def _cloudfront_b64(data):
+    # CloudFront's URL-safe base64 variant.
+    return base64.b64encode(data).decode("ascii").replace("+", "-").replace("=", "_").replace("/", "~")
+
+
+_private_key = None
+
+
+def _load_private_key():
+    global _private_key
+    if _private_key is None:
+        from cryptography.hazmat.primitives import serialization
+        with open(CLOUDFRONT_PRIVATE_KEY_PATH, "rb") as f:
+            _private_key = serialization.load_pem_private_key(f.read(), password=None)
+    return _private_key
+
+
+def signed_cookies(object_keys, expiration=IMAGE_URL_TTL):
+    """
+    CloudFront signed cookies (custom policy) covering the common key prefix of
+    `object_keys`, e.g. debug_images/<file>/<content hash>/*. Returns {cookie name: value}.
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    prefix = os.path.commonpath(list(object_keys)) if object_keys else ""
+    resource = cdn_url(f"{prefix}/*" if prefix else "*")
+    policy = json.dumps({
+        "Statement": [{
+            "Resource": resource,
+            "Condition": {"DateLessThan": {"AWS:EpochTime": int(time.time()) + expiration}},
+        }]
+    }, separators=(",", ":")).encode("utf-8")
+    signature = _load_private_key().sign(policy, padding.PKCS1v15(), hashes.SHA1())
+    return {
+        "CloudFront-Policy": _cloudfront_b64(policy),
+        "CloudFront-Signature": _cloudfront_b64(signature),
+        "CloudFront-Key-Pair-Id": CLOUDFRONT_KEY_PAIR_ID,
+    }
+
+
+def page_urls(object_keys, bucket_name=DEFAULT_BUCKET, expiration=IMAGE_URL_TTL):
+    """
+    URLs for all pages of a file. Returns ({key: url}, cookies) where cookies
+    is None in presigned mode and the CloudFront cookies to set in cookie mode.
+    """
+    object_keys = [k for k in object_keys if k]
+    if cookie_mode():
+        return {k: cdn_url(k) for k in object_keys}, signed_cookies(object_keys, expiration)
+    return url_cache.get_many(object_keys, bucket_name, expiration), None
+
+
+def set_cookies(response, cookies, expiration=IMAGE_URL_TTL):
+    """Attach CloudFront cookies to a FastAPI/Starlette response."""
+    for name, value in (cookies or {}).items():
+        response.set_cookie(name, value, max_age=expiration, domain=CLOUDFRONT_COOKIE_DOMAIN,
+                            secure=True, httponly=True, samesite="none")
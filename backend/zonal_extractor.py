@@ -0,0 +1,310 @@
+"""
+Zonal extraction of fixed-layout form fields from OCR geometry.
+
+labels.json describes, per page label, where each field sits relative to a
+printed anchor on the form:
+
+    question        text of the anchor ("1 Cash", "Calendar Year or tax year");
+                    quoted words ("Line with the word 'Name' in it") are matched alone
+    search_coords   page region the anchor is searched in (default: the whole page)
+    ignore_words    anchor candidates containing any of these are skipped
+    target_coords   value region, an expression of the anchor box x1, y1, x2, y2 and
+                    of other anchors (label_data['ein']['label_bbox'][0])
+    prep            optional normalizer lambda, applied to each value line (the first
+                    non-empty result wins) or, if it indexes, to the list of lines
+
+All coordinates are normalized (0..1). The page's words are grouped into text
+segments (same row, split at wide gaps), the best-matching segment in the
+search region becomes the anchor, and the words lying mostly inside the target
+region (found through a spatial_index.GridIndex) make the value.
+
+Each field gets a confidence: the share of the question's words found in the
+anchor, lowered when value words straddle the region edge, and 0 when the
+region holds no value (an empty field can't be told from a misplaced region
+or an OCR miss). ClassifyExtract
+only asks Gemini for the fields below ZONAL_MIN_CONFIDENCE. Coordinate
+expressions and prep lambdas are evaluated through an AST whitelist, never
+with plain eval().
+
+Environment:
+    ZONAL_EXTRACTION        1/0 (default 1)
+    ZONAL_MIN_CONFIDENCE    min confidence of a field kept without Gemini (default 0.8)
+    ZONAL_MIN_CONTAINMENT   min share of a word's box inside the target region (default 0.5)
+    ZONAL_SEGMENT_GAP       gap, in line heights, that splits a row into segments (default 1.5)
+"""
+import ast
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+from rapidfuzz import fuzz
+
+from spatial_index import GridIndex
+
+ZONAL_EXTRACTION = os.environ.get("ZONAL_EXTRACTION", "1").lower() in ("1", "true", "yes")
+ZONAL_MIN_CONFIDENCE = float(os.environ.get("ZONAL_MIN_CONFIDENCE", "0.8"))
+ZONAL_MIN_CONTAINMENT = float(os.environ.get("ZONAL_MIN_CONTAINMENT", "0.5"))
+ZONAL_SEGMENT_GAP = float(os.environ.get("ZONAL_SEGMENT_GAP", "1.5"))
+
+# Words overlapping the target region less than this aren't part of the value,
+# but more than this means the region cuts through text.
+STRADDLE_MIN = 0.1
+TOKEN_MATCH_RATIO = 85
+
+_QUOTED = re.compile(r"'([^']+)'")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_BINARY_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+SAFE_BUILTINS = {
+    "str": str, "int": int, "float": float, "len": len, "list": list, "min": min, "max": max,
+    "sorted": sorted, "any": any, "all": all, "abs": abs, "round": round,
+}
+_PREP_NODES = (
+    ast.Expression, ast.Lambda, ast.arguments, ast.arg, ast.Name, ast.Load, ast.Store, ast.Constant,
+    ast.Call, ast.Attribute, ast.Subscript, ast.Slice, ast.GeneratorExp, ast.ListComp, ast.comprehension,
+    ast.Compare, ast.BoolOp, ast.UnaryOp, ast.BinOp, ast.IfExp, ast.List, ast.Tuple,
+    ast.And, ast.Or, ast.Not, ast.USub, ast.Add, ast.Sub, ast.Mult, ast.Mod,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+_BLOCKED_ATTRIBUTES = ("format", "format_map")
+
+
+@lru_cache(maxsize=None)
+def _parse(expression):
+    return ast.parse(expression, mode="eval").body
+
+
+def eval_coords(expression, variables):
+    """
+    Evaluate a labels.json coordinate expression such as
+    "[x1-0.005, y2, 0.7, y2+(y2-y1)]" with the given variables. Only numbers,
+    strings, names, + - * /, subscripts and lists are allowed.
+    """
+    def walk(node):
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [walk(e) for e in node.elts]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in variables:
+                raise KeyError(node.id)
+            return variables[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            return float(_BINARY_OPS[type(node.op)](walk(node.left), walk(node.right)))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            value = walk(node.operand)
+            return -value if isinstance(node.op, ast.USub) else value
+        if isinstance(node, ast.Subscript):
+            return walk(node.value)[walk(node.slice)]
+        raise ValueError(f"Unsupported expression in {expression!r}: {ast.dump(node)}")
+    return walk(_parse(expression))
+
+
+@lru_cache(maxsize=None)
+def compile_prep(source):
+    """A labels.json prep lambda as a function, after checking it only uses whitelisted syntax."""
+    tree = ast.parse(source, mode="eval")
+    if not isinstance(tree.body, ast.Lambda):
+        raise ValueError(f"prep must be a lambda: {source!r}")
+    bound = set(SAFE_BUILTINS)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            bound.add(node.id)
+    for node in ast.walk(tree):
+        if not isinstance(node, _PREP_NODES):
+            raise ValueError(f"Unsupported syntax in prep {source!r}: {type(node).__name__}")
+        if isinstance(node, ast.Attribute) and (node.attr.startswith("_") or node.attr in _BLOCKED_ATTRIBUTES):
+            raise ValueError(f"Attribute {node.attr!r} not allowed in prep {source!r}")
+        if isinstance(node, ast.Name) and node.id not in bound:
+            raise ValueError(f"Name {node.id!r} not allowed in prep {source!r}")
+    return eval(compile(tree, "<prep>", "eval"), {"__builtins__": SAFE_BUILTINS})
+
+
+def apply_prep(source, items):
+    """The value text of a field from its value lines (top to bottom) and optional prep."""
+    if not source:
+        return " ".join(items)
+    fn = compile_prep(source)
+    try:
+        if "[" in source:
+            result = fn(items)
+        else:
+            result = next((r for r in (fn(item) for item in items) if r), "")
+    except (IndexError, ValueError, TypeError):
+        return ""
+    if isinstance(result, (list, tuple)):
+        return " ".join(str(r) for r in result)
+    return str(result)
+
+
+def _tokens(text):
+    return _TOKEN.findall(text.lower())
+
+
+def question_tokens(question):
+    """Words an anchor has to contain: the quoted terms if any, else the question minus a trailing 'label'."""
+    quoted = _QUOTED.findall(question)
+    tokens = _tokens(" ".join(quoted) if quoted else question)
+    if len(tokens) > 1 and tokens[-1] == "label":
+        tokens = tokens[:-1]
+    return tokens
+
+
+def segments(words, boxes, order=None):
+    """
+    Group words into text segments: words on the same row (vertical centres
+    within half a line height) with no gap wider than ZONAL_SEGMENT_GAP line
+    heights. Returns [(text, box, [word indices])] in reading order; boxes
+    are unions of the word boxes. `order` restricts grouping to those words.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    idx = np.arange(len(boxes)) if order is None else np.asarray(order, dtype=np.int64)
+    idx = np.array([i for i in idx if str(words[i]).strip()], dtype=np.int64)
+    if not len(idx):
+        return []
+    heights = np.maximum(boxes[idx, 3] - boxes[idx, 1], 1e-6)
+    centres = (boxes[idx, 1] + boxes[idx, 3]) / 2
+
+    rows, row, row_centre, row_height = [], [], None, None
+    for k in np.argsort(centres, kind="stable"):
+        if row and abs(centres[k] - row_centre) <= 0.5 * max(row_height, heights[k]):
+            row.append(k)
+            row_centre = float(np.mean(centres[row]))
+            row_height = float(np.median(heights[row]))
+            continue
+        if row:
+            rows.append(row)
+        row, row_centre, row_height = [k], float(centres[k]), float(heights[k])
+    rows.append(row)
+
+    result = []
+    for row in rows:
+        members = idx[sorted(row, key=lambda k: boxes[idx[k], 0])]
+        gap_limit = ZONAL_SEGMENT_GAP * float(np.median(heights[row]))
+        start = 0
+        for j in range(1, len(members) + 1):
+            if j < len(members) and boxes[members[j], 0] - boxes[members[j - 1], 2] <= gap_limit:
+                continue
+            part = members[start:j]
+            b = boxes[part]
+            result.append((
+                " ".join(str(words[i]) for i in part),
+                [float(b[:, 0].min()), float(b[:, 1].min()), float(b[:, 2].max()), float(b[:, 3].max())],
+                part.tolist(),
+            ))
+            start = j
+    return result
+
+
+def _inside(box, region):
+    cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    return region[0] <= cx <= region[2] and region[1] <= cy <= region[3]
+
+
+def find_anchor(entry, page_segments):
+    """(segment, score) of the best anchor for a labels.json entry, or (None, 0.0)."""
+    wanted = question_tokens(entry["question"])
+    if not wanted:
+        return None, 0.0
+    region = eval_coords(entry["search_coords"], {}) if entry.get("search_coords") else [0, 0, 1, 1]
+    ignore = [w.lower() for w in (eval_coords(entry["ignore_words"], {}) if entry.get("ignore_words") else [])]
+    phrase = " ".join(wanted)
+    best, best_key = None, (0.0, 0.0)
+    for segment in page_segments:
+        text, box, _ = segment
+        if not _inside(box, region) or any(w in text.lower() for w in ignore):
+            continue
+        have = _tokens(text)
+        if not have:
+            continue
+        found = sum(
+            1 for t in wanted
+            if t in have or (len(t) >= 4 and max(fuzz.ratio(t, h) for h in have) >= TOKEN_MATCH_RATIO)
+        )
+        key = (found / len(wanted), fuzz.ratio(phrase, " ".join(have)) / 100)
+        if key > best_key:
+            best, best_key = segment, key
+    return best, best_key[0]
+
+
+def extract_fields(page_label, words, bboxes, normalized_bboxes, labels, fields=None, index=None):
+    """
+    Zonal values of a page: {key: {"value", "confidence", "anchor_score",
+    "anchor_bbox", "region", "value_bbox"}} for the labels.json entries of page_label (only the keys in
+    `fields`, if given; other entries still serve as anchors for label_data).
+    Fields whose anchor or region can't be resolved are left out. `index` is
+    the page's GridIndex, if already built.
+    """
+    entries = labels.get(page_label) or []
+    if not entries or not len(words):
+        return {}
+    # Segments are grouped in pixel coordinates, where line heights and gaps compare.
+    page_segments = segments(words, bboxes)
+    normalized = np.asarray(normalized_bboxes, dtype=np.float64).reshape(-1, 4)
+    if index is None:
+        index = GridIndex(normalized)
+
+    # Anchors are located first: target regions may refer to other fields' anchors.
+    anchors = {}
+    for entry in entries:
+        try:
+            segment, score = find_anchor(entry, page_segments)
+        except (ValueError, KeyError, SyntaxError) as e:
+            print(f"Skipping zonal anchor for {page_label}.{entry.get('key')}: {e}")
+            continue
+        if segment is not None:
+            anchors[entry["key"]] = (segment, score)
+
+    label_data = {}
+    for key, (segment, _) in anchors.items():
+        norm = normalized[segment[2]]
+        label_data[key] = {"label_bbox": [float(norm[:, 0].min()), float(norm[:, 1].min()),
+                                          float(norm[:, 2].max()), float(norm[:, 3].max())]}
+
+    results = {}
+    for entry in entries:
+        key = entry["key"]
+        if key not in anchors or (fields is not None and key not in fields):
+            continue
+        x1, y1, x2, y2 = label_data[key]["label_bbox"]
+        try:
+            region = eval_coords(entry["target_coords"], {"x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                                                          "label_data": label_data})
+            region = [min(region[0], region[2]), min(region[1], region[3]),
+                      max(region[0], region[2]), max(region[1], region[3])]
+        except (ValueError, KeyError, IndexError, TypeError, SyntaxError):
+            continue
+        if region[2] <= region[0] or region[3] <= region[1]:
+            continue
+
+        inside, ratios = index.within(region, ZONAL_MIN_CONTAINMENT)
+        touching, _ = index.within(region, STRADDLE_MIN)
+        straddling = len(touching) - len(inside)
+        items = [text for text, _, _ in segments(words, bboxes, order=inside)]
+        try:
+            value = apply_prep(entry.get("prep"), items)
+        except (ValueError, SyntaxError) as e:
+            print(f"Skipping zonal prep for {page_label}.{key}: {e}")
+            continue
+
+        # An empty region is as likely a misplaced region or an OCR miss as a blank field: not confident.
+        confidence = 0.0
+        if len(inside) and value.strip():
+            confidence = anchors[key][1] * float(ratios.mean()) * (1 - straddling / len(touching))
+        value_bbox = None
+        if len(inside):
+            b = normalized[inside]
+            value_bbox = [float(b[:, 0].min()), float(b[:, 1].min()), float(b[:, 2].max()), float(b[:, 3].max())]
+        results[key] = {
+            "value": value.strip(),
+            "confidence": round(confidence, 4),
+            "anchor_score": round(anchors[key][1], 4),
+            "anchor_bbox": label_data[key]["label_bbox"],
+            "region": region,
+            "value_bbox": value_bbox,
+        }
+    return results
@@ -54,7 +54,7 @@ export function FileUploader({ onUploadSuccess }: FileUploaderProps) {
     }
 
     try {
-      const res = await fetch(`http://localhost:8000/get-file?filename=${encodeURIComponent(filename)}`)
+      const res = await fetch(`http://localhost:8000/get-file?filename=${encodeURIComponent(filename)}&level=preview`)
       if (!res.ok) {
         throw new Error("Failed to fetch file data")
       }